@@ -0,0 +1,135 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Throughput measurement for zenmapper's dry-run benchmark mode.
+
+Time spent updating devices is split into three phases.
+
+* zodb: Loading devices from ZODB.
+* get_connections: Extracting edges from devices.
+* sql: Reading stored state from MySQL and diffing it with extracted edges.
+
+Example usage:
+
+    benchmark = Benchmark()
+
+    for node in benchmark.timed_nodes(nodes):
+        ...
+        benchmark.add("get_connections", seconds, node.id)
+
+    for line in benchmark.report(top=10):
+        LOG.info(line)
+
+"""
+
+import collections
+import datetime
+import threading
+import time
+
+PHASES = ("zodb", "get_connections", "sql")
+
+
+class Benchmark(object):
+
+    """Accumulates per-phase and per-device timings."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+
+        self.seconds = collections.Counter()
+        self.device_seconds = collections.defaultdict(collections.Counter)
+
+        self.devices = 0
+        self.changed = 0
+        self.edges = 0
+        self.added = 0
+        self.removed = 0
+
+    def add(self, phase, seconds, device=None):
+        """Add seconds spent in phase, optionally on behalf of device."""
+        with self.lock:
+            self.seconds[phase] += seconds
+            if device is not None:
+                self.device_seconds[device][phase] += seconds
+
+    def add_update(self, edges):
+        """Count a changed device and the number of edges extracted."""
+        with self.lock:
+            self.changed += 1
+            self.edges += edges
+
+    def add_diff(self, added, removed):
+        """Count edges that would have been added and removed."""
+        with self.lock:
+            self.added += added
+            self.removed += removed
+
+    def timed_nodes(self, nodes):
+        """Generate nodes, adding the time spent loading each to zodb."""
+        nodes = iter(nodes)
+        while True:
+            start = time.time()
+            try:
+                node = next(nodes)
+            except StopIteration:
+                return
+
+            self.add("zodb", time.time() - start, node.id)
+            self.devices += 1
+
+            yield node
+
+    def report(self, top=10):
+        """Return list of report lines."""
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        total = sum(self.seconds.values()) or 1e-6
+
+        lines = [
+            "checked {} devices in {} ({:.1f} devices/sec)".format(
+                self.devices,
+                datetime.timedelta(seconds=int(elapsed)),
+                self.devices / elapsed),
+
+            "extracted {} edges from {} changed devices ({:.1f} edges/sec)"
+            .format(
+                self.edges,
+                self.changed,
+                self.edges / elapsed),
+
+            "diff found {} edges to add and {} to remove".format(
+                self.added,
+                self.removed),
+
+            ", ".join(
+                "{} {:.1f}s ({:.0%})".format(
+                    phase,
+                    self.seconds[phase],
+                    self.seconds[phase] / total)
+                for phase in PHASES),
+            ]
+
+        slowest = sorted(
+            self.device_seconds.iteritems(),
+            key=lambda x: sum(x[1].values()),
+            reverse=True)[:top]
+
+        if slowest:
+            lines.append("slowest {} devices:".format(len(slowest)))
+            for device, seconds in slowest:
+                lines.append(
+                    "  {}: {:.2f}s ({})".format(
+                        device,
+                        sum(seconds.values()),
+                        ", ".join(
+                            "{} {:.2f}s".format(phase, seconds[phase])
+                            for phase in PHASES)))
+
+        return lines
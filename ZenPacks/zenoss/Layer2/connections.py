@@ -10,17 +10,24 @@
 """Glue between Zenoss and more abstract graph, and networkx modules."""
 
 # stdlib imports
+import collections
 import functools
+import threading
+import time
 
 # zenoss imports
-from Products.ZenUtils.guid.interfaces import IGlobalIdentifier
+from Products.ZenUtils.guid.interfaces import IGlobalIdentifier, IGUIDManager
 
 # third-party imports
 import networkx
 
 # zenpack imports
-from .graph import get_graph, get_provider
-from .connections_provider import IConnectionsProvider
+from .graph import LAYERS_VERSION, Provider, get_graph, get_provider
+from .macs import normalize as normalize_mac
+from .connections_provider import (
+    IConnectionsProvider, DeviceConnectionsProvider, get_device_statuses,
+    get_down_device_uuids,
+    )
 
 # logging
 import logging
@@ -32,6 +39,28 @@ LAYER2_NEIGHBOR_DEVICE_DEPTH = 3
 DEVICES_PREFIX = "/zport/dmd/Devices/"
 DEVICES_NETWORK_PREFIX = "/zport/dmd/Devices/Network/"
 
+# Devices whose missing layer2 neighbors are found between checks of
+# whether the graph's edges changed.
+STORE_NEIGHBORS_BATCH = 100
+
+# Most networkx_graph results, and most nodes in all of them, to cache in
+# each process. Larger results aren't cached.
+NETWORKX_CACHE_SIZE = 100
+NETWORKX_CACHE_NODES = 50000
+
+# Seconds a cached networkx_graph result is used. Results are invalidated
+# sooner if the graph's version changes. The shorter time applies when the
+# graph has no version.
+NETWORKX_CACHE_SECONDS = 300
+NETWORKX_CACHE_SECONDS_UNVERSIONED = 30
+
+# Seconds between checks of the graph's version for cached networkx_graph
+# results. Changes can go unnoticed this long.
+NETWORKX_CACHE_CHECK_SECONDS = 10
+
+# Seconds between checks of whether the cached layer catalog changed.
+LAYER_CATALOG_CHECK_SECONDS = 10
+
 
 def log_mysql_errors(default=None):
     """Log MySQL exceptions in decorated function and return default."""
@@ -48,6 +77,8 @@ def log_mysql_errors(default=None):
                 # Avoid problems with mutable default value.
                 if isinstance(default, set):
                     return set()
+                elif isinstance(default, dict):
+                    return {}
                 elif isinstance(default, list):
                     return []
                 elif isinstance(default, networkx.Graph):
@@ -60,23 +91,253 @@ def log_mysql_errors(default=None):
     return wrap
 
 
+def is_default_layer(layer):
+    """Return True if layer should be used by default."""
+    return not (layer.startswith("vlan") or layer.startswith("vxlan"))
+
+
+class LayerCatalog(object):
+    """In-memory catalog of the graph's layers and their edge counts.
+
+    The catalog is reloaded from the graph when its layers version
+    changes. The version is checked at most every check_seconds, and
+    immediately after invalidate is called. A graph without a version
+    is loaded once, and again only when a version is recorded.
+
+    """
+
+    def __init__(self, check_seconds):
+        self.check_seconds = check_seconds
+
+        self.lock = threading.Lock()
+        self.version = None
+        self.loaded = False
+        self.checked = 0
+        self.counts = {}
+        self.layers = []
+        self.default_layers = frozenset()
+
+    def refresh(self):
+        """Reload catalog if the graph's layers changed since last check."""
+        with self.lock:
+            if self.checked + self.check_seconds > time.time():
+                return
+
+            graph = get_graph()
+            version = graph.get_version(LAYERS_VERSION)
+            if not self.loaded or version != self.version:
+                counts = graph.get_layer_counts()
+
+                self.counts = counts
+                self.layers = sorted(counts)
+                self.default_layers = frozenset(
+                    x for x in self.layers if is_default_layer(x))
+
+                self.loaded = True
+
+            self.version = version
+            self.checked = time.time()
+
+    def invalidate(self):
+        """Check for changes on next refresh."""
+        with self.lock:
+            self.checked = 0
+
+
+LAYER_CATALOG = LayerCatalog(check_seconds=LAYER_CATALOG_CHECK_SECONDS)
+
+
 @log_mysql_errors(default=set())
 def get_layers():
     """Return set of all known layers."""
-    return get_graph().get_layers()
+    LAYER_CATALOG.refresh()
+    return set(LAYER_CATALOG.layers)
 
 
+@log_mysql_errors(default=[])
+def get_sorted_layers():
+    """Return sorted list of all known layers."""
+    LAYER_CATALOG.refresh()
+    return list(LAYER_CATALOG.layers)
+
+
+@log_mysql_errors(default={})
+def get_layer_counts():
+    """Return map of all known layers to their count of edge rows.
+
+    Counts are as of the last time the catalog was reloaded.
+
+    """
+    LAYER_CATALOG.refresh()
+    return dict(LAYER_CATALOG.counts)
+
+
+@log_mysql_errors(default=set())
 def get_default_layers():
     """Return set of layers to use by default."""
-    return {
-        x for x in get_layers()
-        if not (x.startswith("vlan") or x.startswith("vxlan"))}
+    LAYER_CATALOG.refresh()
+    return set(LAYER_CATALOG.default_layers)
+
+
+class GraphCache(object):
+    """Bounded LRU cache of NetworkX graphs tagged with graph versions.
+
+    The cache holds at most size graphs, and at most nodes nodes in all
+    of them. Graphs aren't copied. Every caller getting a key shares the
+    same graph, so callers must not modify it. Callers that need to
+    modify a graph must copy it first.
+
+    The graph's version is checked at most every check_seconds.
+
+    """
+
+    def __init__(self, size, nodes, seconds, unversioned_seconds,
+                 check_seconds):
+        self.size = size
+        self.nodes = nodes
+        self.seconds = seconds
+        self.unversioned_seconds = unversioned_seconds
+        self.check_seconds = check_seconds
+
+        self.lock = threading.Lock()
+        self.data = collections.OrderedDict()
+        self.node_count = 0
+        self.hits = 0
+        self.misses = 0
+        self.version = None
+        self.checked = 0
+
+    def get_version(self, version_fn):
+        """Return graph version from version_fn at most every check_seconds.
+
+        The last version returned by version_fn is used in between.
+
+        """
+        with self.lock:
+            if self.checked + self.check_seconds <= time.time():
+                self.version = version_fn()
+                self.checked = time.time()
+
+            return self.version
+
+    def get(self, key, version):
+        """Return shared graph cached for key at version, or None."""
+        if version is None:
+            seconds = self.unversioned_seconds
+        else:
+            seconds = self.seconds
+
+        with self.lock:
+            entry = self.data.get(key)
+            if (entry and entry[1] == version and
+                    entry[0] + seconds >= time.time()):
+                # Most recently used go to the end.
+                del self.data[key]
+                self.data[key] = entry
+                self.hits += 1
+            else:
+                self.discard(key)
+                self.misses += 1
+                return None
+
+        return entry[2]
+
+    def set(self, key, version, graph):
+        """Cache graph for key at version. Graph must not be modified after.
+
+        Graphs with more than the cache's limit of nodes aren't cached.
+
+        """
+        if len(graph) > self.nodes:
+            with self.lock:
+                self.discard(key)
+
+            return
+
+        entry = (time.time(), version, graph)
+
+        with self.lock:
+            self.discard(key)
+            self.data[key] = entry
+            self.node_count += len(entry[2])
+
+            # Least recently used are at the start.
+            while len(self.data) > self.size or self.node_count > self.nodes:
+                self.discard(next(iter(self.data)))
+
+    def discard(self, key):
+        """Remove graph cached for key. Caller must hold lock."""
+        entry = self.data.pop(key, None)
+        if entry:
+            self.node_count -= len(entry[2])
+
+    def clear(self):
+        """Remove all cached graphs."""
+        with self.lock:
+            self.data.clear()
+            self.node_count = 0
+            self.checked = 0
+
+    def stats(self):
+        """Return dict of hits, misses, size and nodes."""
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.data),
+                "nodes": self.node_count,
+                }
+
+
+NETWORKX_CACHE = GraphCache(
+    size=NETWORKX_CACHE_SIZE,
+    nodes=NETWORKX_CACHE_NODES,
+    seconds=NETWORKX_CACHE_SECONDS,
+    unversioned_seconds=NETWORKX_CACHE_SECONDS_UNVERSIONED,
+    check_seconds=NETWORKX_CACHE_CHECK_SECONDS)
 
 
 @log_mysql_errors(default=networkx.Graph())
 def networkx_graph(root, layers, depth=None):
-    """Return NetworkX graph of layers at depth starting from root."""
-    return get_graph().networkx_graph(root, layers, depth=depth)
+    """Return NetworkX graph of layers at depth starting from root.
+
+    Results are cached in NETWORKX_CACHE until the graph changes. Whole
+    components (depth=None) aren't cached. They can be large, and event
+    suppression already keeps them in its own ComponentRegistry.
+
+    Cached results are shared between callers and must not be modified.
+    Copy the result first to modify it.
+
+    """
+    graph = get_graph()
+    if depth is None:
+        return graph.networkx_graph(root, layers, depth=depth)
+
+    key = (root, frozenset(layers), depth)
+    version = NETWORKX_CACHE.get_version(graph.get_version)
+
+    nxg = NETWORKX_CACHE.get(key, version)
+    if nxg is None:
+        nxg = graph.networkx_graph(root, layers, depth=depth)
+        NETWORKX_CACHE.set(key, version, nxg)
+
+    return nxg
+
+
+@log_mysql_errors(default=None)
+def get_version():
+    """Return value that changes whenever edges change, or None."""
+    return get_graph().get_version()
+
+
+@log_mysql_errors(default=None)
+def get_changes(since):
+    """Return (last, nodes) tuple of edge changes after since, or None.
+
+    See Graph.get_changes.
+
+    """
+    return get_graph().get_changes(since)
 
 
 @log_mysql_errors(default=None)
@@ -85,27 +346,158 @@ def get_device_by_mac(dmd, macaddress):
     if not macaddress:
         return
 
-    nxg = networkx_graph(macaddress.upper(), [LAYER2_LAYER], depth=1)
-    for node in nxg.nodes():
-        if node.startswith(DEVICES_PREFIX):
+    return get_devices_by_macs(dmd, [macaddress]).get(macaddress)
+
+
+@log_mysql_errors(default={})
+def get_devices_by_macs(dmd, macaddresses):
+    """Return map of MAC address to first neighbor that's a device.
+
+    All MAC addresses are looked up with one query. MAC addresses
+    without a neighboring device aren't in the returned map.
+
+    """
+    macs_by_node = {}
+    for mac in macaddresses:
+        node = normalize_mac(mac)
+        if node:
+            macs_by_node.setdefault(node, []).append(mac)
+
+    if not macs_by_node:
+        return {}
+
+    neighbors = get_graph().get_neighbors_by_prefix(
+        macs_by_node.keys(), LAYER2_LAYER, DEVICES_PREFIX)
+
+    devices = {}
+    for node, paths in neighbors.iteritems():
+        for path in sorted(paths):
             try:
-                return dmd.getObjByPath(str(node))
+                device = dmd.getObjByPath(str(path))
             except Exception:
                 continue
 
+            for mac in macs_by_node.get(node, ()):
+                devices[mac] = device
+
+            break
+
+    return devices
+
+
+@log_mysql_errors(default=None)
+def get_layer2_edges():
+    """Return set of (source, target) edges in the layer2 layer, or None."""
+    return get_graph().get_layer_edges(LAYER2_LAYER)
+
 
 @log_mysql_errors(default=[])
 def get_layer2_neighbors(entity):
-    """Generate device UIDs that are layer2 neighbors of entity."""
-    nxg = networkx_graph(
-        entity,
-        [LAYER2_LAYER],
-        depth=LAYER2_NEIGHBOR_DEVICE_DEPTH)
+    """Generate device UIDs that are layer2 neighbors of entity.
+
+    Neighbors stored by zenmapper are used if available. Otherwise
+    they're found by traversing the graph. Reading never stores
+    neighbors. A reader racing zenmapper could otherwise store neighbors
+    that were already stale.
+
+    """
+    neighbors = get_graph().get_stored_neighbors(entity)
+    if neighbors is None:
+        neighbors = find_layer2_neighbors(entity)
+
+    for node in neighbors:
+        yield node
+
+
+def find_layer2_neighbors(entity, cached=True):
+    """Return list of device UIDs that are layer2 neighbors of entity.
+
+    Cached graphs can miss changes for NETWORKX_CACHE_CHECK_SECONDS.
+    Neighbors that will be stored must be found with cached=False.
+
+    """
+    if cached:
+        nxg = networkx_graph(
+            entity,
+            [LAYER2_LAYER],
+            depth=LAYER2_NEIGHBOR_DEVICE_DEPTH)
+    else:
+        nxg = get_graph().networkx_graph(
+            entity,
+            [LAYER2_LAYER],
+            depth=LAYER2_NEIGHBOR_DEVICE_DEPTH)
+
+    # Avoid including non-device entities, and the passed entity.
+    return [x for x in nxg.nodes() if x.startswith("/") and x != entity]
+
+
+def update_layer2_neighbors(rows):
+    """Update stored layer2 neighbors affected by changed edge rows.
+
+    rows are (source, target, layer) rows that were added to or removed
+    from the graph. Devices near them, and devices that listed devices
+    in them as neighbors, have their neighbors found again.
+
+    Other threads and processes write edges concurrently. If the graph's
+    edges changed while neighbors were found, the affected devices'
+    stored neighbors are discarded instead of risking storing stale
+    ones. store_missing_layer2_neighbors stores them again later.
+
+    """
+    nodes = set()
+    for source, target, layer in rows:
+        if layer == LAYER2_LAYER:
+            nodes.update((source, target))
+
+    if not nodes:
+        return
+
+    graph = get_graph()
+    version = graph.get_version()
+    entities = {
+        x for x in graph.get_reachable(
+            nodes, [LAYER2_LAYER], LAYER2_NEIGHBOR_DEVICE_DEPTH)
+        if x.startswith("/")}
+
+    # Devices that may no longer reach a device through removed rows.
+    entities.update(
+        graph.get_referrers(x for x in nodes if x.startswith("/")))
 
-    for node in nxg.nodes():
-        # Avoid yielding non-device entities, and the passed entity.
-        if node.startswith("/") and node != entity:
-            yield node
+    neighbors = {x: find_layer2_neighbors(x, cached=False) for x in entities}
+
+    if graph.get_version() == version:
+        graph.set_neighbors(neighbors)
+    else:
+        graph.discard_neighbors(entities)
+
+
+@log_mysql_errors(default=0)
+def store_missing_layer2_neighbors(entities, limit):
+    """Store layer2 neighbors of up to limit entities without them.
+
+    Devices whose edges haven't changed since neighbors were first
+    stored don't get them from update_layer2_neighbors. Neighbors found
+    while the graph's edges changed are discarded rather than risk
+    storing stale ones. They're found again next time.
+
+    Returns the number of entities whose neighbors were stored.
+
+    """
+    graph = get_graph()
+    missing = sorted(graph.get_unstored_nodes(entities))[:limit]
+
+    stored = 0
+    for start in range(0, len(missing), STORE_NEIGHBORS_BATCH):
+        version = graph.get_version()
+        neighbors = {
+            x: find_layer2_neighbors(x, cached=False)
+            for x in missing[start:start + STORE_NEIGHBORS_BATCH]}
+
+        if graph.get_version() == version:
+            graph.set_neighbors(neighbors)
+            stored += len(neighbors)
+
+    return stored
 
 
 @log_mysql_errors(default=[])
@@ -118,6 +510,18 @@ def get_layer2_neighbor_devices(device):
             continue
 
 
+# Everything needed to write a node's edges to the graph. Holds no
+# references to persistent objects so it can be handed to other threads.
+# edges is an EdgeRows (see graph.Provider.get_rows).
+NodeUpdate = collections.namedtuple(
+    "NodeUpdate", [
+        "id",
+        "uuid",
+        "edges",
+        "last_changed",
+        ])
+
+
 @log_mysql_errors(default=None)
 def update_node(node, force=False):
     """Update node and all of its connections in the graph.
@@ -126,28 +530,139 @@ def update_node(node, force=False):
     node's connections were already up to date.
 
     Always updates the node's connections and returns True if force is True.
+    Forced updates don't use indexes such as the interface index.
 
     """
-    provider = get_provider(IGlobalIdentifier(node).getGUID())
-    provider.load()
+    update = get_node_update(node, force=force, use_index=not force)
+    if update is None:
+        # No need to do anything if we're up-to-date for this node.
+        return False
+
+    apply_node_update(update)
+
+    return True
+
+
+@log_mysql_errors(default={})
+def get_last_changes():
+    """Return map of provider UUID to lastChange for all providers."""
+    return get_graph().get_last_changes()
+
+
+def get_node_update(node, force=False, last_changes=None, use_index=True):
+    """Return NodeUpdate for node, or None if node is up to date.
+
+    The node's stored lastChange is read from last_changes if given,
+    which should be a map as returned by get_last_changes. Otherwise
+    it is loaded from the database.
 
+    Always returns a NodeUpdate if force is True. See get_node_edges for
+    use_index.
+
+    """
+    uuid = IGlobalIdentifier(node).getGUID()
     last_changed = get_last_changed(node)
 
-    if not force and last_changed == provider.lastChange:
-        # No need to do anything if we're up-to-date for this node.
-        return False
+    if not force:
+        if last_changes is None:
+            provider = get_provider(uuid)
+            provider.load()
+            stored_last_changed = provider.lastChange
+        else:
+            stored_last_changed = last_changes.get(uuid)
+
+        if last_changed == stored_last_changed:
+            return None
+
+    # Edges stream straight into rows without an intermediate list.
+    return NodeUpdate(
+        id=node.id,
+        uuid=uuid,
+        edges=Provider.get_rows(get_node_edges(node, use_index=use_index)),
+        last_changed=last_changed)
+
+
+def get_node_edges(node, use_index=True):
+    """Generate (source, target, layers) edges for node.
+
+    Connections can be either Connection or Edge instances. Indexes
+    such as the interface index aren't used if use_index is False.
+
+    """
+    provider = IConnectionsProvider(node)
+    provider.use_index = use_index
 
-    edges = []
-    for connection in IConnectionsProvider(node).get_connections():
+    for connection in provider.get_connections():
+        entity_id = connection.entity_id
+        layers = connection.layers
         for connected_to in connection.connected_to:
-            edges.append((
-                connection.entity_id,
-                connected_to,
-                connection.layers))
+            yield (entity_id, connected_to, layers)
 
-    provider.update_edges(edges, last_changed)
 
-    return True
+def apply_node_update(update):
+    """Write edges in update (a NodeUpdate) to the graph.
+
+    Returns (added, removed) counts of edge rows in the graph.
+
+    """
+    provider = get_provider(update.uuid)
+    changes = provider.update_edges(update.edges, update.last_changed)
+    if any(changes):
+        update_layer2_neighbors(provider.changed_rows)
+        LAYER_CATALOG.invalidate()
+
+    return changes
+
+
+def diff_node_update(update):
+    """Return (added, removed) rows applying update would write."""
+    provider = get_provider(update.uuid)
+    return provider.diff_edges(update.edges)
+
+
+@log_mysql_errors(default={})
+def get_schedule():
+    """Return map of provider UUID to schedule row for all providers."""
+    return get_graph().get_schedule()
+
+
+@log_mysql_errors(default=None)
+def update_schedule(schedule):
+    """Save map of provider UUID to schedule row."""
+    return get_graph().update_schedule(schedule)
+
+
+@log_mysql_errors(default=None)
+def heartbeat(instance):
+    """Record that instance (a zenmapper instance ID) is running."""
+    return get_graph().heartbeat(instance)
+
+
+@log_mysql_errors(default=[])
+def get_instances(since):
+    """Return sorted list of instances seen since the given time."""
+    return get_graph().get_instances(since)
+
+
+@log_mysql_errors(default=None)
+def enqueue_node(node, priority=0):
+    """Queue node for zenmapper to update as soon as it can."""
+    return get_graph().enqueue(
+        IGlobalIdentifier(node).getGUID(),
+        node.getPrimaryId(),
+        priority=priority)
+
+
+@log_mysql_errors(default=[])
+def get_queued(limit):
+    """Return list of up to limit (uuid, path, queued) queued nodes."""
+    return get_graph().get_queued(limit)
+
+
+@log_mysql_errors(default=None)
+def remove_queued(rows):
+    """Remove queued nodes as returned by get_queued."""
+    return get_graph().remove_queued(rows)
 
 
 def is_switch(device):
@@ -196,9 +711,72 @@ def get_status(dmd, node):
         return True
 
 
+def get_statuses(dmd, nodes):
+    """Return map of node to False if node is "down", otherwise True.
+
+    Devices provided by DeviceConnectionsProvider are checked with a
+    single ZEP query instead of one query per node.
+
+    """
+    statuses = {}
+    uuids = {}
+
+    for node in nodes:
+        try:
+            provider = IConnectionsProvider(dmd.getObjByPath(node))
+        except Exception:
+            statuses[node] = True
+            continue
+
+        if type(provider) is DeviceConnectionsProvider:
+            uuids[node] = provider.context.getUUID()
+            continue
+
+        try:
+            statuses[node] = provider.get_status()
+        except Exception:
+            statuses[node] = True
+
+    if uuids:
+        try:
+            device_statuses = get_device_statuses(dmd, uuids.values())
+        except Exception:
+            device_statuses = {}
+
+        for node, uuid in uuids.iteritems():
+            statuses[node] = device_statuses.get(uuid, True)
+
+    return statuses
+
+
+def get_down_devices(dmd):
+    """Return set of nodes of all devices that are down, or None.
+
+    Devices are down if they have an open critical /Status/Ping event.
+    They're all found with one bulk ZEP query. None is returned if the
+    query fails.
+
+    """
+    try:
+        uuids = get_down_device_uuids(dmd)
+    except Exception as e:
+        LOG.warning("failed to get down devices: %s", e)
+        return None
+
+    guid_manager = IGUIDManager(dmd)
+    nodes = set()
+    for uuid in uuids:
+        path = guid_manager.getPath(uuid)
+        if path:
+            nodes.add(path)
+
+    return nodes
+
+
 @log_mysql_errors(default=None)
 def clear():
     """Clear all data."""
+    LAYER_CATALOG.invalidate()
     return get_graph().clear()
 
 
@@ -217,6 +795,7 @@ def optimize():
 @log_mysql_errors(default=None)
 def compact(providerUUIDs):
     """Clear data from providers not listed in providerUUIDs."""
+    LAYER_CATALOG.invalidate()
     return get_graph().compact(providerUUIDs)
 
 
@@ -20,6 +20,15 @@ Connection (also defined below) instances are created like this:
         layers: tuple of strings
     )
 
+Providers yielding many connections should yield Edge instances instead.
+Edge is a plain tuple with the same attributes as Connection, but its
+entity_id and connected_to must already be strings, and layers a tuple:
+    Edge(
+        entity_id: string,
+        connected_to: tuple of strings,
+        layers: tuple of strings
+    )
+
 Also it contains BaseConnectionsProvider which implements this interface. Your
 own connections provider should be inherited from it.
 
@@ -30,8 +39,12 @@ All connection providers should be registered in configure.zcml.
 For more details see README.mediawiki
 
 '''
+import collections
 import logging
+import zlib
 
+from Acquisition import aq_base
+from persistent import Persistent
 from zope.interface import Interface, implements, Attribute, invariant
 from zope.component import adapts
 
@@ -45,11 +58,21 @@ from zenoss.protocols.protobufs.zep_pb2 import (
     SEVERITY_CRITICAL,
     )
 
+from . import macs
 from .utils import ro_objects
 
 
 log = logging.getLogger('zen.Layer2')
 
+# Layers of layer 3 (IP network) connections.
+LAYER3_LAYERS = ('layer3', )
+
+# Most device UUIDs to include in each ZEP query by get_device_statuses.
+STATUS_BATCH = 500
+
+# Device attribute where the interface index is stored.
+INTERFACE_INDEX_ATTR = "l2_interface_index"
+
 
 class InterfaceConnections(object):
     implements(IIndexableWrapper)
@@ -71,15 +94,13 @@ class InterfaceConnections(object):
 
     @property
     def macaddress(self):
-        return (
-            getattr(self.interface, 'macaddress', '') or ''
-        ).upper().strip()
+        return macs.normalize(getattr(self.interface, 'macaddress', '')) or ''
 
     @property
     def clientmacs(self):
-        macs = getattr(self.interface, 'clientmacs')
-        if macs:
-            return [x.upper() for x in macs if x]
+        clientmacs = getattr(self.interface, 'clientmacs')
+        if clientmacs:
+            return macs.normalize_all(clientmacs)
         else:
             return []
 
@@ -156,6 +177,10 @@ class Connection(object):
         return '%s\t%s\t%s' % (self.entity_id, self.connected_to, self.layers)
 
 
+# Lightweight alternative to Connection. See module docstring.
+Edge = collections.namedtuple("Edge", ["entity_id", "connected_to", "layers"])
+
+
 class IConnectionsProvider(Interface):
 
     def __init__(context):
@@ -177,6 +202,10 @@ class IConnectionsProvider(Interface):
 class BaseConnectionsProvider(object):
     implements(IConnectionsProvider)
 
+    # False to extract connections from model objects even if they have
+    # current indexes. Set when updates are forced.
+    use_index = True
+
     def __init__(self, context):
         self.context = context
 
@@ -200,49 +229,235 @@ class DeviceConnectionsProvider(BaseConnectionsProvider):
     def get_status(self):
         device = self.context
         zep = getFacade('zep', device.getDmd())
-        event_filter = zep.createEventFilter(
-            tags=[device.getUUID()],
-            element_sub_identifier=[""],
-            event_class=[ZenEventClasses.Status_Ping],
-            severity=[SEVERITY_CRITICAL],
-            status=[STATUS_NEW, STATUS_ACKNOWLEDGED, STATUS_SUPPRESSED])
+        event_filter = get_ping_down_filter(zep, [device.getUUID()])
 
+        # Only the count is needed for one device.
         result = zep.getEventSummaries(0, filter=event_filter, limit=0)
         return int(result['total']) == 0
 
     def get_connections(self):
-        for interface in ro_objects(self.context.os.interfaces()):
-            ic = InterfaceConnections(interface)
-            layers = ic.layers
-            mac = ic.macaddress
-            if not mac or mac == "00:00:00:00:00:00":
+        device = self.context.getPrimaryId()
+
+        rows = None
+        if self.use_index:
+            rows = get_interface_index(self.context)
+
+        if rows is None:
+            rows = interface_index_rows(self.context)
+
+        for path, mac, clientmacs, layers, networks in rows:
+            if not mac:
                 continue
-            yield Connection(self.context, (mac, ), layers)
-            yield Connection(mac, (self.context, ), layers)
-            yield Connection(MACObject(interface), (mac, ), layers)
-            for cl in ic.clientmacs:
-                if cl.strip():
-                    yield Connection(mac, (cl, ), layers)
+            yield Edge(device, (mac, ), layers)
+            yield Edge(mac, (device, ), layers)
+            yield Edge("!" + path, (mac, ), layers)
 
-            # Layer 3 connections
-            for ip in ro_objects(interface.ipaddresses()):
-                net = ip.network()
-                if net is None or net.netmask == 32:
-                    continue
+            # One edge for all client MACs rather than one each. They're
+            # already normalized by interface_index_rows.
+            if clientmacs:
+                yield Edge(mac, tuple(clientmacs), layers)
 
-                yield Connection(self.context, (net, ), ['layer3', ])
-                yield Connection(net, (self.context, ), ['layer3', ])
+            # Layer 3 connections
+            for net in networks:
+                yield Edge(device, (net, ), LAYER3_LAYERS)
+                yield Edge(net, (device, ), LAYER3_LAYERS)
 
 
 class NetworkConnectionsProvider(BaseConnectionsProvider):
     def get_connections(self):
+        net = self.context.getPrimaryId()
         for ip in ro_objects(self.context.ipaddresses()):
             dev = ip.device()
             if not dev:
                 continue
-            net = self.context
-            yield Connection(net, (dev, ), ['layer3', ])
-            yield Connection(dev, (net, ), ['layer3', ])
+            dev = dev.getPrimaryId()
+            yield Edge(net, (dev, ), LAYER3_LAYERS)
+            yield Edge(dev, (net, ), LAYER3_LAYERS)
+
+
+def get_device_statuses(dmd, uuids):
+    """Return map of device UUID to True if up, False if down.
+
+    A device is down if it has an open critical /Status/Ping event. One
+    ZEP query is made for each STATUS_BATCH devices rather than one for
+    each device.
+
+    """
+    zep = getFacade('zep', dmd)
+    uuids = list(uuids)
+    down = set()
+
+    for i in xrange(0, len(uuids), STATUS_BATCH):
+        down.update(get_ping_down_uuids(zep, uuids[i:i + STATUS_BATCH]))
+
+    return {x: x not in down for x in uuids}
+
+
+def get_down_device_uuids(dmd):
+    """Return set of UUIDs of all devices that are down.
+
+    One paged ZEP query finds every device with an open critical
+    /Status/Ping event.
+
+    """
+    return get_ping_down_uuids(getFacade('zep', dmd))
+
+
+def get_ping_down_filter(zep, uuids=None):
+    """Return ZEP filter of open critical /Status/Ping events.
+
+    Only events for uuids are included if uuids is specified.
+
+    """
+    filter_args = {
+        "element_sub_identifier": [""],
+        "event_class": [ZenEventClasses.Status_Ping],
+        "severity": [SEVERITY_CRITICAL],
+        "status": [STATUS_NEW, STATUS_ACKNOWLEDGED, STATUS_SUPPRESSED],
+        }
+
+    if uuids is not None:
+        filter_args["tags"] = uuids
+
+    return zep.createEventFilter(**filter_args)
+
+
+def get_ping_down_uuids(zep, uuids=None):
+    """Return set of UUIDs with open critical /Status/Ping events.
+
+    Only events for uuids are considered if uuids is specified.
+
+    """
+    event_filter = get_ping_down_filter(zep, uuids)
+    down = set()
+    offset = 0
+
+    while True:
+        result = zep.getEventSummaries(
+            offset, filter=event_filter, limit=STATUS_BATCH)
+
+        # The ZEP facade returns events as a generator.
+        events = list(result.get('events') or ())
+        for event in events:
+            try:
+                down.add(event['occurrence'][0]['actor']['element_uuid'])
+            except (KeyError, IndexError):
+                continue
+
+        next_offset = result.get('next_offset')
+        if next_offset is None:
+            next_offset = offset + len(events)
+
+        total = int(result.get('total') or 0)
+        if not events or next_offset <= offset or next_offset >= total:
+            break
+
+        offset = next_offset
+
+    return down
+
+
+def interface_index_rows(device):
+    """Generate interface index rows for device's interfaces.
+
+    Each row is a (path, macaddress, clientmacs, layers, networks)
+    tuple. macaddress is empty for interfaces without a usable MAC
+    address, and networks are the paths of the interface's networks
+    excluding host networks.
+
+    """
+    for interface in ro_objects(device.os.interfaces()):
+        ic = InterfaceConnections(interface)
+        mac = ic.macaddress
+        if not mac or mac == macs.NULL_MAC_STR:
+            yield (interface.getPrimaryId(), "", (), (), ())
+            continue
+
+        networks = []
+        for ip in ro_objects(interface.ipaddresses()):
+            net = ip.network()
+            if net is None or net.netmask == 32:
+                continue
+
+            networks.append(net.getPrimaryId())
+
+        yield (
+            interface.getPrimaryId(),
+            mac,
+            tuple(ic.clientmacs),
+            tuple(ic.layers),
+            tuple(networks))
+
+
+def get_interface_index_stamp(device):
+    """Return value identifying device's last change and interfaces, or None.
+
+    Interfaces can be added or removed without changing the device's
+    last change, so their IDs are included. Reading them doesn't load
+    any interfaces.
+
+    """
+    try:
+        interface_ids = sorted(device.os.interfaces.objectIds())
+        return (
+            device.getLastChange().micros(),
+            len(interface_ids),
+            zlib.crc32("\n".join(interface_ids)))
+    except Exception:
+        return None
+
+
+class InterfaceIndex(Persistent):
+    """Interface index rows of a device as of its interface index stamp.
+
+    The index is its own persistent object rather than an attribute of
+    the device's pickle. Updating it doesn't rewrite the device, or
+    invalidate it for every ZEO client.
+
+    """
+
+    def __init__(self):
+        self.stamp = None
+        self.rows = ()
+
+    def update(self, stamp, rows):
+        """Set stamp and rows unless they're unchanged."""
+        if stamp != self.stamp or rows != self.rows:
+            self.stamp = stamp
+            self.rows = rows
+
+
+def update_interface_index(device):
+    """Store index of device's interfaces on device.
+
+    Intended to be called when the device is modeled, while its
+    interfaces are likely still in cache. The index lets connections be
+    extracted later without loading any interfaces, IP addresses or
+    networks. It's ignored once the device changes again, or interfaces
+    are added or removed, and when updates are forced.
+
+    """
+    rows = tuple(interface_index_rows(device))
+
+    index = getattr(aq_base(device), INTERFACE_INDEX_ATTR, None)
+    if not isinstance(index, InterfaceIndex):
+        # Only the first index, or one in the old format, changes device.
+        index = InterfaceIndex()
+        setattr(device, INTERFACE_INDEX_ATTR, index)
+
+    index.update(get_interface_index_stamp(device), rows)
+
+
+def get_interface_index(device):
+    """Return device's interface index rows, or None if not current."""
+    index = getattr(aq_base(device), INTERFACE_INDEX_ATTR, None)
+    if not isinstance(index, InterfaceIndex) or index.stamp is None:
+        return None
+
+    if index.stamp != get_interface_index_stamp(device):
+        return None
+
+    return index.rows
 
 
 def get_vlans(iface):
@@ -16,6 +16,7 @@ import sys
 import threading
 import time
 import warnings
+from uuid import uuid4
 
 # third-party imports
 import MySQLdb
@@ -34,6 +35,15 @@ warnings.filterwarnings("ignore", category=MySQLdb.Warning)
 # module caches
 THREAD_LOCAL = threading.local()
 
+# metadata names of versions
+EDGES_VERSION = "version"
+LAYERS_VERSION = "layers_version"
+
+# Most recent rows of the changes table kept by compact, and most rows
+# get_changes reads before reporting that everything changed.
+CHANGES_KEPT = 100000
+CHANGES_LIMIT = 10000
+
 
 def get_graph():
     """Return Graph singleton."""
@@ -51,6 +61,10 @@ def get_provider(uuid):
     return graph.get_provider(uuid)
 
 
+# (rows, layers, nodes) sets as returned by Provider.get_rows.
+EdgeRows = collections.namedtuple("EdgeRows", ["rows", "layers", "nodes"])
+
+
 def chunks(s, n):
     """Generate lists of size n from iterable s."""
     for chunk in (s[i:i + n] for i in range(0, len(s), n)):
@@ -99,6 +113,30 @@ class Graph(object):
     def edges_table(self):
         return self.get_table("edges")
 
+    @property
+    def layer_counts_table(self):
+        return self.get_table("layer_counts")
+
+    @property
+    def schedule_table(self):
+        return self.get_table("schedule")
+
+    @property
+    def instances_table(self):
+        return self.get_table("instances")
+
+    @property
+    def queue_table(self):
+        return self.get_table("queue")
+
+    @property
+    def neighbors_table(self):
+        return self.get_table("neighbors")
+
+    @property
+    def changes_table(self):
+        return self.get_table("changes")
+
     @property
     def edges_view(self):
         return self.get_table("edges_view")
@@ -117,6 +155,16 @@ class Graph(object):
                 "name": "lastOptimize",
                 "value": "0"})
 
+        # Readers cache what they load until a version changes, so each
+        # version must exist before anything bumps it.
+        for name in (EDGES_VERSION, LAYERS_VERSION):
+            self.db.insert(
+                table=self.metadata_table,
+                ignore=True,
+                values={
+                    "name": name,
+                    "value": uuid4().hex})
+
         self.db.create_table(
             table=self.providers_table,
             columns=[
@@ -155,6 +203,64 @@ class Graph(object):
                 ("target_id", self.nodes_table),
                 ("layer_id", self.layers_table)])
 
+        # Edge rows per layer, kept by update_edges so they're not counted.
+        count_layers = not self.db.table_exists(self.layer_counts_table)
+        self.db.create_table(
+            table=self.layer_counts_table,
+            columns=[
+                ("layer_id", "INT UNSIGNED NOT NULL PRIMARY KEY"),
+                ("edges", "INT NOT NULL")],
+            foreign_keys=[
+                ("layer_id", self.layers_table)])
+
+        if count_layers:
+            self.recount_layers()
+
+        self.db.create_table(
+            table=self.schedule_table,
+            columns=[
+                ("uuid", "CHAR(36) NOT NULL UNIQUE PRIMARY KEY"),
+                ("lastChecked", "DOUBLE NOT NULL"),
+                ("checkInterval", "INT UNSIGNED NOT NULL"),
+                ("checks", "INT UNSIGNED NOT NULL"),
+                ("changes", "INT UNSIGNED NOT NULL"),
+                ("lastCost", "DOUBLE NOT NULL")])
+
+        self.db.create_table(
+            table=self.instances_table,
+            columns=[
+                ("instance", "VARCHAR(255) NOT NULL UNIQUE PRIMARY KEY"),
+                ("lastSeen", "DOUBLE NOT NULL")])
+
+        self.db.create_table(
+            table=self.queue_table,
+            columns=[
+                ("uuid", "CHAR(36) NOT NULL UNIQUE PRIMARY KEY"),
+                ("path", "VARCHAR(1024) NOT NULL"),
+                ("priority", "INT NOT NULL"),
+                ("queued", "DOUBLE NOT NULL")],
+            indexes=[
+                ("INDEX", "byPriority", ("priority", "queued"))])
+
+        self.db.create_table(
+            table=self.neighbors_table,
+            columns=[
+                ("node_id", "INT UNSIGNED NOT NULL"),
+                ("neighbor_id", "INT UNSIGNED NOT NULL")],
+            indexes=[
+                ("UNIQUE INDEX", "allColumns", ("node_id", "neighbor_id")),
+                ("INDEX", "byNeighbor", ("neighbor_id",))],
+            foreign_keys=[
+                ("node_id", self.nodes_table),
+                ("neighbor_id", self.nodes_table)])
+
+        # Nodes whose edges changed. NULL node_id means every node's.
+        self.db.create_table(
+            table=self.changes_table,
+            columns=[
+                ("id", "BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY"),
+                ("node_id", "INT UNSIGNED")])
+
         self.db.execute(
             "CREATE OR REPLACE VIEW {edges_view} AS "
             "SELECT"
@@ -199,6 +305,138 @@ class Graph(object):
 
         return {x[1]: x[0] for x in rows}
 
+    def get_last_changes(self):
+        """Return map of provider UUID to lastChange for all providers."""
+        rows = self.db.execute(
+            "SELECT uuid, lastChange FROM {table}".format(
+                table=self.providers_table))
+
+        return {x[0]: x[1] for x in rows}
+
+    def get_schedule(self):
+        """Return map of provider UUID to schedule row for all providers.
+
+        Each schedule row is a (lastChecked, checkInterval, checks,
+        changes, lastCost) tuple.
+
+        """
+        rows = self.db.execute(
+            "SELECT uuid, lastChecked, checkInterval, checks, changes, lastCost"
+            "  FROM {table}".format(
+                table=self.schedule_table))
+
+        return {x[0]: tuple(x[1:]) for x in rows}
+
+    def update_schedule(self, schedule):
+        """Save map of provider UUID to schedule row.
+
+        See get_schedule for the format of schedule rows.
+
+        """
+        self.db.executemany(
+            "INSERT INTO {table}"
+            "    (uuid, lastChecked, checkInterval, checks, changes, lastCost)"
+            "  values (%s, %s, %s, %s, %s, %s)"
+            "  ON DUPLICATE KEY UPDATE"
+            "    lastChecked=VALUES(lastChecked),"
+            "    checkInterval=VALUES(checkInterval),"
+            "    checks=VALUES(checks),"
+            "    changes=VALUES(changes),"
+            "    lastCost=VALUES(lastCost)".format(
+                table=self.schedule_table),
+            [(k,) + tuple(v) for k, v in schedule.iteritems()])
+
+    def heartbeat(self, instance):
+        """Record that instance (a zenmapper instance ID) is running."""
+        self.db.execute(
+            "INSERT INTO {table} (instance, lastSeen)"
+            "  values (%s, %s)"
+            "  ON DUPLICATE KEY UPDATE lastSeen=VALUES(lastSeen)".format(
+                table=self.instances_table),
+            (instance, time.time()))
+
+    def get_instances(self, since):
+        """Return sorted list of instances seen since the given time."""
+        rows = self.db.execute(
+            "SELECT instance FROM {table}"
+            "  WHERE lastSeen >= %s"
+            "  ORDER BY instance ASC".format(
+                table=self.instances_table),
+            (since,))
+
+        return [x[0] for x in rows]
+
+    def enqueue(self, uuid, path, priority=0):
+        """Queue provider for zenmapper to update as soon as it can.
+
+        Queueing an already queued provider keeps the higher priority.
+
+        """
+        self.db.execute(
+            "INSERT INTO {table} (uuid, path, priority, queued)"
+            "  values (%s, %s, %s, %s)"
+            "  ON DUPLICATE KEY UPDATE"
+            "    path=VALUES(path),"
+            "    priority=GREATEST(priority, VALUES(priority)),"
+            "    queued=VALUES(queued)".format(
+                table=self.queue_table),
+            (uuid, path, priority, time.time()))
+
+    def get_queued(self, limit):
+        """Return list of up to limit (uuid, path, queued) queue rows.
+
+        Rows are ordered by highest priority, then longest queued.
+
+        """
+        rows = self.db.execute(
+            "SELECT uuid, path, queued FROM {table}"
+            "  ORDER BY priority DESC, queued ASC"
+            "  LIMIT %s".format(
+                table=self.queue_table),
+            (limit,))
+
+        return [tuple(x) for x in rows]
+
+    def remove_queued(self, rows):
+        """Remove queue rows as returned by get_queued.
+
+        Providers queued again since the rows were read stay queued.
+
+        """
+        if not rows:
+            return
+
+        self.db.executemany(
+            "DELETE FROM {table} WHERE uuid = %s AND queued <= %s".format(
+                table=self.queue_table),
+            [(uuid, queued) for uuid, _, queued in rows])
+
+    def get_version(self, name=EDGES_VERSION):
+        """Return value that changes whenever name changes, or None.
+
+        The EDGES_VERSION changes whenever edges change, and the
+        LAYERS_VERSION changes whenever layers are added or compact
+        removes edges. Both are recorded when the tables are created.
+        None is returned if no version has been recorded.
+
+        """
+        rows = self.db.execute(
+            "SELECT value FROM {table} WHERE name = %s LIMIT 1".format(
+                table=self.metadata_table),
+            (name,))
+
+        for version, in rows:
+            return version
+
+    def bump_version(self, name=EDGES_VERSION):
+        """Record that name has changed."""
+        self.db.execute(
+            "INSERT INTO {table} (name, value)"
+            "  values (%s, %s)"
+            "  ON DUPLICATE KEY UPDATE value=VALUES(value)".format(
+                table=self.metadata_table),
+            (name, uuid4().hex))
+
     def get_layers(self):
         """Return set of all layers in the graph."""
         rows = self.db.execute(
@@ -207,6 +445,49 @@ class Graph(object):
 
         return set(x[0] for x in rows)
 
+    def get_layer_counts(self):
+        """Return map of every layer in the graph to its count of edge rows.
+
+        Counts are read from the layer_counts table rather than counted.
+
+        """
+        rows = self.db.execute(
+            "SELECT layers.layer, COALESCE(counts.edges, 0)"
+            "  FROM {layers_table} layers"
+            "  LEFT JOIN {counts_table} counts"
+            "         ON counts.layer_id = layers.id".format(
+                layers_table=self.layers_table,
+                counts_table=self.layer_counts_table))
+
+        return {layer: int(count) for layer, count in rows}
+
+    def add_layer_counts(self, deltas):
+        """Add map of layer ID to change in its count of edge rows."""
+        rows = [(k, v) for k, v in deltas.items() if v]
+        if not rows:
+            return
+
+        self.db.executemany(
+            "INSERT INTO {table} (layer_id, edges)"
+            "  values (%s, %s)"
+            "  ON DUPLICATE KEY UPDATE edges = edges + VALUES(edges)".format(
+                table=self.layer_counts_table),
+            rows)
+
+    def recount_layers(self):
+        """Store every layer's count of edge rows by counting them all."""
+        self.db.execute(
+            "INSERT INTO {counts_table} (layer_id, edges)"
+            " SELECT layers.id, COUNT(edges.layer_id)"
+            "   FROM {layers_table} layers"
+            "   LEFT JOIN {edges_table} edges"
+            "          ON edges.layer_id = layers.id"
+            "  GROUP BY layers.id"
+            "  ON DUPLICATE KEY UPDATE edges = VALUES(edges)".format(
+                counts_table=self.layer_counts_table,
+                layers_table=self.layers_table,
+                edges_table=self.edges_table))
+
     def get_layer_ids(self, layers=None):
         """Return map of layer to layer ID for specified layers.
 
@@ -267,6 +548,221 @@ class Graph(object):
                 nodelist + layerlist + nodelist + layerlist),
             preferred_sources=nodes)
 
+    def get_neighbors_by_prefix(self, nodes, layer, prefix):
+        """Return map of node to set of its neighbors starting with prefix.
+
+        Only neighbors connected by an edge in layer are included. Nodes
+        without such neighbors aren't in the returned map.
+
+        """
+        neighbors = collections.defaultdict(set)
+
+        for nodes_chunk in chunks(list(nodes), 1000):
+            rows = self.db.execute(
+                "SELECT targets.node, sources.node"
+                "  FROM {edges_table} AS edges"
+                "    INNER JOIN {nodes_table} AS sources"
+                "            ON edges.source_id = sources.id"
+                "    INNER JOIN {nodes_table} AS targets"
+                "            ON edges.target_id = targets.id"
+                " WHERE targets.node IN ({node_subs})"
+                "   AND sources.node LIKE %s"
+                "   AND edges.layer_id ="
+                "     (SELECT id FROM {layers_table} WHERE layer = %s)"
+                " UNION "
+                "SELECT sources.node, targets.node"
+                "  FROM {edges_table} AS edges"
+                "    INNER JOIN {nodes_table} AS sources"
+                "            ON edges.source_id = sources.id"
+                "    INNER JOIN {nodes_table} AS targets"
+                "            ON edges.target_id = targets.id"
+                " WHERE sources.node IN ({node_subs})"
+                "   AND targets.node LIKE %s"
+                "   AND edges.layer_id ="
+                "     (SELECT id FROM {layers_table} WHERE layer = %s)".format(
+                    edges_table=self.edges_table,
+                    nodes_table=self.nodes_table,
+                    layers_table=self.layers_table,
+                    node_subs=",".join(["%s"] * len(nodes_chunk))),
+                2 * (nodes_chunk + [prefix + "%", layer]))
+
+            for node, neighbor in rows:
+                neighbors[node].add(neighbor)
+
+        return dict(neighbors)
+
+    def get_reachable(self, roots, layers, depth):
+        """Return set of nodes within depth hops of any of roots.
+
+        Only edges with one of layers are followed. roots are included.
+
+        """
+        seen = set(roots)
+        next_nodes = set(roots)
+
+        for _ in range(depth):
+            if not next_nodes:
+                break
+
+            found = set()
+            for nodes_chunk in chunks(list(next_nodes), 1000):
+                for source, target, _ in self.get_edges(nodes_chunk, layers):
+                    found.update((source, target))
+
+            next_nodes = found.difference(seen)
+            seen.update(next_nodes)
+
+        return seen
+
+    def get_layer_edges(self, layer):
+        """Return set of (source, target) tuples of all edges in layer."""
+        return set(
+            self.db.execute(
+                "SELECT sources.node, targets.node"
+                "  FROM {edges_table} AS edges"
+                "    INNER JOIN {nodes_table} AS sources"
+                "            ON edges.source_id = sources.id"
+                "    INNER JOIN {nodes_table} AS targets"
+                "            ON edges.target_id = targets.id"
+                " WHERE edges.layer_id ="
+                "     (SELECT id FROM {layers_table} WHERE layer = %s)".format(
+                    edges_table=self.edges_table,
+                    nodes_table=self.nodes_table,
+                    layers_table=self.layers_table),
+                [layer]))
+
+    def get_stored_neighbors(self, node):
+        """Return list of node's stored neighbors, or None if not stored.
+
+        See set_neighbors.
+
+        """
+        rows = self.db.execute(
+            "SELECT neighbors.node"
+            "  FROM {neighbors_table} AS nb"
+            "    INNER JOIN {nodes_table} AS nodes ON nb.node_id = nodes.id"
+            "    INNER JOIN {nodes_table} AS neighbors"
+            "            ON nb.neighbor_id = neighbors.id"
+            " WHERE nodes.node = %s".format(
+                neighbors_table=self.neighbors_table,
+                nodes_table=self.nodes_table),
+            [node])
+
+        if not rows:
+            return None
+
+        # Every stored node is its own neighbor to distinguish having no
+        # neighbors from not being stored.
+        return [x[0] for x in rows if x[0] != node]
+
+    def get_unstored_nodes(self, nodes):
+        """Return set of nodes in the graph without stored neighbors."""
+        unstored = set()
+
+        for nodes_chunk in chunks(list(nodes), 1000):
+            rows = self.db.execute(
+                "SELECT nodes.node"
+                "  FROM {nodes_table} AS nodes"
+                "    LEFT JOIN {neighbors_table} AS nb"
+                "           ON nb.node_id = nodes.id"
+                "          AND nb.neighbor_id = nodes.id"
+                " WHERE nodes.node IN ({node_subs})"
+                "   AND nb.node_id IS NULL".format(
+                    nodes_table=self.nodes_table,
+                    neighbors_table=self.neighbors_table,
+                    node_subs=",".join(["%s"] * len(nodes_chunk))),
+                nodes_chunk)
+
+            unstored.update(x[0] for x in rows)
+
+        return unstored
+
+    def get_referrers(self, nodes):
+        """Return set of nodes with any of nodes as stored neighbors."""
+        referrers = set()
+
+        for nodes_chunk in chunks(list(nodes), 1000):
+            rows = self.db.execute(
+                "SELECT DISTINCT nodes.node"
+                "  FROM {neighbors_table} AS nb"
+                "    INNER JOIN {nodes_table} AS nodes ON nb.node_id = nodes.id"
+                "    INNER JOIN {nodes_table} AS neighbors"
+                "            ON nb.neighbor_id = neighbors.id"
+                " WHERE neighbors.node IN ({node_subs})".format(
+                    neighbors_table=self.neighbors_table,
+                    nodes_table=self.nodes_table,
+                    node_subs=",".join(["%s"] * len(nodes_chunk))),
+                nodes_chunk)
+
+            referrers.update(x[0] for x in rows)
+
+        return referrers
+
+    def set_neighbors(self, neighbors_by_node):
+        """Store map of node to iterable of its neighbors.
+
+        Replaces any neighbors previously stored for each node. Nodes
+        and neighbors that aren't in the graph can't be stored, and are
+        ignored.
+
+        """
+        if not neighbors_by_node:
+            return
+
+        all_nodes = set(neighbors_by_node)
+        for neighbors in neighbors_by_node.itervalues():
+            all_nodes.update(neighbors)
+
+        node_ids = self.get_node_ids(all_nodes)
+
+        stored_ids = [
+            node_ids[x] for x in neighbors_by_node if x in node_ids]
+
+        if not stored_ids:
+            return
+
+        for ids_chunk in chunks(stored_ids, 1000):
+            self.db.execute(
+                "DELETE FROM {table} WHERE node_id IN ({id_subs})".format(
+                    table=self.neighbors_table,
+                    id_subs=",".join(["%s"] * len(ids_chunk))),
+                ids_chunk)
+
+        rows = []
+        for node, neighbors in neighbors_by_node.iteritems():
+            node_id = node_ids.get(node)
+            if node_id is None:
+                continue
+
+            rows.append((node_id, node_id))
+            rows.extend(
+                (node_id, node_ids[x]) for x in neighbors if x in node_ids)
+
+        self.db.bulk_insert(
+            table=self.neighbors_table,
+            columns=("node_id", "neighbor_id"),
+            rows=rows,
+            ignore=True)
+
+    def discard_neighbors(self, nodes):
+        """Remove stored neighbors of nodes.
+
+        Their neighbors are found by traversing the graph until they're
+        stored again.
+
+        """
+        node_ids = self.get_node_ids(nodes)
+        for ids_chunk in chunks(node_ids.values(), 1000):
+            self.db.execute(
+                "DELETE FROM {table} WHERE node_id IN ({id_subs})".format(
+                    table=self.neighbors_table,
+                    id_subs=",".join(["%s"] * len(ids_chunk))),
+                ids_chunk)
+
+    def clear_neighbors(self):
+        """Remove all stored neighbors."""
+        self.db.execute("DELETE FROM {}".format(self.neighbors_table))
+
     def count_edges(self):
         """Return count of (source, target, layers) edges."""
         return len(
@@ -370,6 +866,8 @@ class Graph(object):
             rows=[(x,) for x in providerUUIDs],
             ignore=True)
 
+        providers_before = self.count_providers()
+
         # Deleting from providers cascades to edges.
         self.db.execute(
             "DELETE p FROM {providers_table} p"
@@ -378,9 +876,28 @@ class Graph(object):
                 providers_table=self.providers_table,
                 keep_table=keep_table))
 
+        self.db.execute(
+            "DELETE s FROM {schedule_table} s"
+            "    LEFT JOIN {keep_table} k ON k.uuid = s.uuid"
+            "        WHERE k.uuid IS NULL".format(
+                schedule_table=self.schedule_table,
+                keep_table=keep_table))
+
         # Cleanup the temporary table.
         self.db.execute("DROP TEMPORARY TABLE {}".format(keep_table))
 
+        # Stored neighbors may have been reached through removed edges.
+        if self.count_providers() < providers_before:
+            self.clear_neighbors()
+            self.record_changes(None)
+            self.bump_version()
+            self.bump_version(LAYERS_VERSION)
+
+            # Cascaded deletes from providers don't update layer counts.
+            self.recount_layers()
+
+        self.prune_changes()
+
     def should_optimize(self, optimize_interval=0):
         """Return True if database should be optimized."""
         if optimize_interval <= 0:
@@ -402,7 +919,12 @@ class Graph(object):
 
     def optimize(self):
         """Optimize all layer2 tables in the database."""
-        for table in ("metadata", "providers", "layers", "nodes", "edges"):
+        tables = (
+            "metadata", "providers", "layers", "layer_counts", "nodes",
+            "edges", "schedule", "instances", "queue", "neighbors",
+            "changes")
+
+        for table in tables:
             self.db.execute(
                 "OPTIMIZE TABLE {table}".format(
                     table=self.get_table(table)))
@@ -414,12 +936,16 @@ class Graph(object):
 
     def clear(self):
         """Clear all layer2 information from the database."""
-        try:
-            self.db.execute("TRUNCATE TABLE {}".format(self.edges_table))
-        except Exception:
-            pass
+        for table in (self.edges_table, self.neighbors_table):
+            try:
+                self.db.execute("TRUNCATE TABLE {}".format(table))
+            except Exception:
+                pass
 
-        for table in ("metadata", "providers", "layers", "nodes"):
+        tables = (
+            "metadata", "providers", "layers", "nodes", "schedule", "queue")
+
+        for table in tables:
             try:
                 self.db.execute(
                     "DELETE FROM {table}".format(
@@ -429,6 +955,77 @@ class Graph(object):
 
         # Tables require optimization after emptying.
         self.optimize()
+        self.record_changes(None)
+        self.bump_version()
+        self.bump_version(LAYERS_VERSION)
+
+    def record_changes(self, node_ids):
+        """Record that edges of node_ids changed. None means all nodes."""
+        if node_ids is None:
+            rows = [(None,)]
+        else:
+            rows = [(x,) for x in node_ids]
+
+        self.db.bulk_insert(
+            table=self.changes_table,
+            columns=("node_id",),
+            rows=rows)
+
+    def get_changes(self, since, limit=CHANGES_LIMIT):
+        """Return (last, nodes) tuple of changes recorded after since.
+
+        since is the last from a previous call, or None to only get the
+        current last. nodes is the set of nodes whose edges changed, or
+        None if every node's may have. That's the case if everything
+        changed, more than limit changes were recorded, or changes after
+        since were already pruned.
+
+        """
+        rows = self.db.execute(
+            "SELECT MIN(id), MAX(id) FROM {table}".format(
+                table=self.changes_table))
+
+        first, last = rows[0] if rows else (None, None)
+        last = int(last or 0)
+
+        if since is None or since == last:
+            return last, set()
+
+        if since > last or last - since > limit or (
+                first is not None and int(first) > since + 1):
+            return last, None
+
+        rows = self.db.execute(
+            "SELECT changes.node_id, nodes.node"
+            "  FROM {changes_table} AS changes"
+            "    LEFT JOIN {nodes_table} AS nodes"
+            "           ON nodes.id = changes.node_id"
+            " WHERE changes.id > %s AND changes.id <= %s".format(
+                changes_table=self.changes_table,
+                nodes_table=self.nodes_table),
+            [since, last])
+
+        nodes = set()
+        for node_id, node in rows:
+            if node_id is None:
+                return last, None
+
+            if node is not None:
+                nodes.add(node)
+
+        return last, nodes
+
+    def prune_changes(self, keep=CHANGES_KEPT):
+        """Delete all but the most recent keep changes."""
+        rows = self.db.execute(
+            "SELECT MAX(id) FROM {table}".format(table=self.changes_table))
+
+        last = int(rows[0][0] or 0) if rows else 0
+        if last > keep:
+            self.db.execute(
+                "DELETE FROM {table} WHERE id <= %s".format(
+                    table=self.changes_table),
+                [last - keep])
 
     def migrate(self):
         """Migrate data from previous versions."""
@@ -449,6 +1046,9 @@ class Provider(object):
         self.id = None
         self.lastChange = None
 
+        # Set by update_edges.
+        self.changed_rows = set()
+
     def save(self, lastChange):
         """Save provider to database. Return provider.id or None."""
         if self.id is not None and lastChange == self.lastChange:
@@ -524,8 +1124,20 @@ class Provider(object):
 
         return state
 
-    def update_edges(self, edges, lastChange):
-        """Update list of (source, target, layers) edge triples."""
+    @staticmethod
+    def get_rows(edges):
+        """Return EdgeRows for iterable of (source, target, layers) edges.
+
+        Each row is a (source, target, layer) triple with source and
+        target sorted to avoid logically duplicate undirected edges.
+
+        edges is only iterated once, so it can be a generator. If edges
+        is already an EdgeRows it's returned as is.
+
+        """
+        if isinstance(edges, EdgeRows):
+            return edges
+
         rows, layers, nodes = set(), set(), set()
 
         for s, t, ls in edges:
@@ -541,6 +1153,33 @@ class Provider(object):
             for l in ls:
                 rows.add((s, t, l))
 
+        return EdgeRows(rows, layers, nodes)
+
+    def diff_edges(self, edges):
+        """Return (added, removed) sets of rows without writing anything.
+
+        added are (source, target, layer) rows that update_edges would
+        insert for edges, and removed are rows it would delete.
+
+        """
+        rows = self.get_rows(edges)[0]
+
+        self.load()
+        existing_rows = self.get_existing_state()["rows"]
+
+        return rows.difference(existing_rows), existing_rows.difference(rows)
+
+    def update_edges(self, edges, lastChange):
+        """Update list of (source, target, layers) edge triples.
+
+        edges can also be an EdgeRows as returned by get_rows.
+
+        Returns (added, removed) counts of (source, target, layer) rows.
+        Both are 0 if the provider's edges were already the same as edges.
+
+        """
+        rows, layers, nodes = self.get_rows(edges)
+
         # Ensure we have a provider ID.
         self.save(lastChange)
 
@@ -561,6 +1200,10 @@ class Provider(object):
 
         # Create any layers that don't already exist.
         new_layers = layers.difference(state["layer_ids"])
+        if new_layers:
+            state["layer_ids"].update(self.graph.get_layer_ids(new_layers))
+            new_layers.difference_update(state["layer_ids"])
+
         if new_layers:
             self.graph.db.bulk_insert(
                 table=self.graph.layers_table,
@@ -571,6 +1214,9 @@ class Provider(object):
             # Merge new layer ID mappings into state to complete map.
             state["layer_ids"].update(self.graph.get_layer_ids(new_layers))
 
+            # Cached layer catalogs must be reloaded.
+            self.graph.bump_version(LAYERS_VERSION)
+
         # Delete old edges.
         old_rows = state["rows"].difference(rows)
         if old_rows:
@@ -597,15 +1243,17 @@ class Provider(object):
                         ) for x in old_rows_chunk],
                     ignore=True)
 
-                # Delete all edges that exist in the temporary table.
+                # Delete this provider's edges in the temporary table.
                 self.graph.db.execute(
                     "DELETE FROM e USING {edges_table} e"
                     " INNER JOIN {delete_table} d ON ("
+                    "   e.provider_id = %s AND"
                     "   e.source_id = d.source_id AND"
                     "   e.target_id = d.target_id AND"
                     "   e.layer_id = d.layer_id)".format(
                         edges_table=self.graph.edges_table,
-                        delete_table=delete_table))
+                        delete_table=delete_table),
+                    [self.id])
 
                 # Cleanup the temporary table.
                 self.graph.db.execute("DROP TEMPORARY TABLE {}".format(delete_table))
@@ -624,14 +1272,47 @@ class Provider(object):
                     ) for x in new_rows],
                 ignore=True)
 
+        # Rows added or removed, for updating dependent data.
+        self.changed_rows = new_rows.union(old_rows)
+        if self.changed_rows:
+            layer_deltas = collections.Counter()
+            for row in new_rows:
+                layer_deltas[state["layer_ids"][row[2]]] += 1
+            for row in old_rows:
+                layer_deltas[state["layer_ids"][row[2]]] -= 1
+
+            self.graph.add_layer_counts(layer_deltas)
+            self.graph.record_changes(set(
+                state["node_ids"][x]
+                for row in self.changed_rows
+                for x in row[:2]))
+
+            self.graph.bump_version()
+
+        return len(new_rows), len(old_rows)
+
     def clear(self):
         """Remove this provider's data from the graph."""
+        rows = self.graph.db.execute(
+            "SELECT edges.layer_id, COUNT(*)"
+            "  FROM {providers_table} providers"
+            "    INNER JOIN {edges_table} edges"
+            "            ON edges.provider_id = providers.id"
+            " WHERE providers.uuid = %s"
+            " GROUP BY edges.layer_id".format(
+                providers_table=self.graph.providers_table,
+                edges_table=self.graph.edges_table),
+            [self.uuid])
+
         self.graph.db.execute(
             "DELETE FROM {table} WHERE uuid = %s".format(
                 table=self.graph.providers_table),
             [self.uuid])
 
-        # Delete from providers cascades to edges.
+        # Delete from providers cascades to edges, but not layer counts.
+        self.graph.add_layer_counts({x: -int(n) for x, n in rows})
+        self.graph.record_changes(None)
+        self.graph.bump_version()
 
         self.id = None
         self.lastChange = None
@@ -0,0 +1,151 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""MAC address parsing, validation and formatting.
+
+MAC addresses are parsed into 48-bit integers, and formatted as upper
+case colon-separated hex. This is the canonical form used for graph
+nodes, the interface index and comparisons.
+
+    01:23:45:67:89:ab -> 0x0123456789AB -> 01:23:45:67:89:AB
+
+Colon, hyphen or space separated octets of one or two digits, Cisco
+dotted and undelimited forms are accepted. The bulk functions take any
+iterable of MAC addresses, and are what hot loops over thousands of
+client MACs should use.
+
+Example usage:
+
+    to_int("01-23-45-67-89-ab")  # 1250999896491
+    normalize("0123.4567.89ab")  # "01:23:45:67:89:AB"
+    normalize("0:1b:21:a:b:c")  # "00:1B:21:0A:0B:0C"
+    normalize_all(["01:23:45:67:89:ab", "bogus"])  # ["01:23:45:67:89:AB"]
+
+"""
+
+import re
+
+# Value and canonical form of the all-zero MAC address.
+NULL_MAC = 0
+NULL_MAC_STR = "00:00:00:00:00:00"
+
+# Six octets of one or two digits with the same delimiter between each.
+OCTETS = re.compile(
+    r"\A[0-9A-F]{1,2}([:\- ])(?:[0-9A-F]{1,2}\1){4}[0-9A-F]{1,2}\Z",
+    re.IGNORECASE)
+
+DOTTED = re.compile(
+    r"\A[0-9A-F]{4}\.[0-9A-F]{4}\.[0-9A-F]{4}\Z", re.IGNORECASE)
+
+HEX_DIGITS = re.compile(r"\A[0-9A-F]{12}\Z", re.IGNORECASE)
+CANONICAL = re.compile(r"\A([0-9A-F]{2}:){5}[0-9A-F]{2}\Z", re.IGNORECASE)
+
+
+def to_int(mac):
+    """Return mac as a 48-bit integer, or None if it isn't a MAC address."""
+    if isinstance(mac, unicode):
+        try:
+            mac = mac.encode("ascii")
+        except UnicodeError:
+            return None
+    elif not isinstance(mac, str):
+        return None
+
+    mac = mac.strip(" ")
+    if HEX_DIGITS.match(mac):
+        return int(mac, 16)
+
+    match = OCTETS.match(mac)
+    if match:
+        octets = mac.split(match.group(1))
+        return int("".join(x.zfill(2) for x in octets), 16)
+
+    if DOTTED.match(mac):
+        return int(mac.replace(".", ""), 16)
+
+    return None
+
+
+def to_str(value):
+    """Return canonical MAC address string for 48-bit integer value."""
+    digits = "%012X" % value
+    return ":".join((
+        digits[0:2], digits[2:4], digits[4:6],
+        digits[6:8], digits[8:10], digits[10:12]))
+
+
+def normalize(mac):
+    """Return canonical form of mac, or None if it isn't a MAC address."""
+    value = to_int(mac)
+    if value is None:
+        return None
+
+    return to_str(value)
+
+
+def is_canonical(mac):
+    """Return True if mac is a colon-separated MAC address.
+
+    Only the separator and digit count are checked, so this is cheap
+    enough to call on every node of a graph.
+
+    """
+    return (
+        isinstance(mac, basestring)
+        and len(mac) == 17
+        and CANONICAL.match(mac) is not None)
+
+
+def from_bytes(value):
+    """Return canonical MAC address for a 6 byte string."""
+    return ":".join("%02X" % ord(c) for c in value)
+
+
+def from_octets(octets):
+    """Return canonical MAC address for a sequence of 6 integers.
+
+    Raises ValueError if there aren't 6 octets or any is out of range.
+
+    """
+    octets = [int(x) for x in octets]
+    if len(octets) != 6 or not all(0 <= x <= 255 for x in octets):
+        raise ValueError("invalid MAC address octets: {!r}".format(octets))
+
+    return ":".join("%02X" % x for x in octets)
+
+
+def to_ints(macs):
+    """Return set of integer values of the valid MAC addresses in macs."""
+    values = set()
+    for mac in macs:
+        value = to_int(mac)
+        if value is not None:
+            values.add(value)
+
+    return values
+
+
+def to_strs(values):
+    """Return sorted list of canonical MAC addresses for integer values."""
+    return [to_str(x) for x in sorted(values)]
+
+
+def normalize_all(macs):
+    """Return sorted list of unique canonical forms of valid macs."""
+    return to_strs(to_ints(macs))
+
+
+def subtract(macs, excluded):
+    """Return sorted canonical forms of macs that aren't in excluded.
+
+    Both macs and excluded may be any iterable of MAC addresses in any
+    accepted form. Invalid MAC addresses in either are ignored.
+
+    """
+    return to_strs(to_ints(macs) - to_ints(excluded))
@@ -0,0 +1,102 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Memory budget enforcement for long-running processes.
+
+ru_maxrss is the peak resident set size, and never shrinks. MemoryGovernor
+samples the current resident set size instead, so it can tell whether
+freeing memory worked.
+
+Example usage:
+
+    governor = MemoryGovernor(budget=1024 * 1024 * 1024)
+
+    for node in nodes:
+        ...
+        if governor.check(node._p_jar) is OVER:
+            # Stop and let a fresh process continue.
+            break
+
+"""
+
+import resource
+import time
+
+# States returned by MemoryGovernor.check.
+OK, MINIMIZED, OVER = "ok", "minimized", "over"
+
+# Fraction of the budget at which ZODB caches are minimized.
+DEFAULT_SOFT_RATIO = 0.8
+
+# Least seconds between minimizing ZODB caches under the budget.
+DEFAULT_MINIMIZE_SECONDS = 10
+
+
+def get_rss():
+    """Return current resident set size in bytes.
+
+    Falls back to the peak resident set size where the current size
+    isn't available.
+
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except Exception:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryGovernor(object):
+
+    """Keeps resident set size under a budget in bytes."""
+
+    def __init__(self, budget, soft_ratio=DEFAULT_SOFT_RATIO,
+                 minimize_seconds=DEFAULT_MINIMIZE_SECONDS,
+                 rss_fn=get_rss, time_fn=time.time):
+        self.budget = budget
+        self.soft_limit = budget * soft_ratio
+        self.minimize_seconds = minimize_seconds
+        self.rss_fn = rss_fn
+        self.time_fn = time_fn
+
+        self.minimized = None
+
+    def check(self, connection=None):
+        """Return OK, MINIMIZED or OVER after enforcing the budget.
+
+        Once resident set size reaches the soft limit, all unmodified
+        objects in connection's ZODB cache are deactivated rather than
+        leaving it to normal cache garbage collection, and MINIMIZED is
+        returned. Deactivated objects have to be loaded again, so this
+        is done at most every minimize_seconds unless the budget is
+        exceeded. OVER is returned if resident set size still exceeds
+        the budget after that.
+
+        """
+        rss = self.rss_fn()
+        if rss < self.soft_limit:
+            return OK
+
+        now = self.time_fn()
+        if connection is not None and (
+                rss > self.budget or
+                self.minimized is None or
+                self.minimized + self.minimize_seconds <= now):
+            try:
+                connection.cacheMinimize()
+            except Exception:
+                pass
+
+            self.minimized = now
+            rss = self.rss_fn()
+
+        if rss > self.budget:
+            return OVER
+
+        return MINIMIZED
@@ -0,0 +1,155 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""zenmapper cycle metrics.
+
+Each cycle's CycleStats are published as gauges in the Metrology
+registry. Under Control Center they're also posted to the metrics
+consumer the same way other Zenoss daemons post theirs, and they can be
+written to a JSON file for anything else that wants to scrape them.
+
+Example usage:
+
+    publisher = MetricsPublisher(filename="/opt/zenoss/var/zenmapper.json")
+
+    stats = CycleStats()
+    stats.add(devices_checked=1, edges_added=10)
+
+    publisher.publish(stats)
+
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from metrology import Metrology
+from metrology.instruments.gauge import Gauge
+
+try:
+    from Products.ZenUtils.MetricReporter import MetricReporter
+except ImportError:
+    # Zenoss 4 doesn't have MetricReporter. Metrics are still available
+    # in the Metrology registry and the metrics file.
+    MetricReporter = None
+
+LOG = logging.getLogger("zen.Layer2")
+
+# Prefix for metric names posted to Control Center.
+METRIC_PREFIX = "zenoss.zenmapper."
+
+
+class CycleStats(object):
+
+    """Thread-safe counters for one zenmapper cycle."""
+
+    FIELDS = (
+        "cycle_seconds",
+        "devices_checked",
+        "devices_updated",
+        "devices_skipped",
+        "devices_failed",
+        "edges_added",
+        "edges_removed",
+        "sql_seconds",
+        "queue_depth",
+        "worker_lag",
+        )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def add(self, **kwargs):
+        """Add each keyword argument's value to the field of that name."""
+        with self.lock:
+            for field, value in kwargs.iteritems():
+                setattr(self, field, getattr(self, field) + value)
+
+    def observe_queue(self, depth):
+        """Keep the deepest the writer queue has been."""
+        with self.lock:
+            self.queue_depth = max(self.queue_depth, depth)
+
+    def as_dict(self):
+        """Return dict of field names to values."""
+        with self.lock:
+            return {x: getattr(self, x) for x in self.FIELDS}
+
+
+# Most recently published CycleStats in this process.
+LAST_STATS = [CycleStats()]
+
+
+class CycleStatsGauge(Gauge):
+
+    """Metrology gauge for a field of the last published CycleStats."""
+
+    def __init__(self, field):
+        self.field = field
+
+    @property
+    def value(self):
+        return getattr(LAST_STATS[0], self.field)
+
+
+for _field in CycleStats.FIELDS:
+    Metrology.gauge(_field.replace("_", "-"), CycleStatsGauge(_field))
+
+
+class MetricsPublisher(object):
+
+    """Publishes CycleStats."""
+
+    def __init__(self, filename=None, tags=None):
+        self.filename = filename
+        self.tags = dict(tags or {})
+
+        self.reporter = None
+        if MetricReporter and os.environ.get("CONTROLPLANE") == "1":
+            try:
+                self.reporter = MetricReporter(
+                    prefix=METRIC_PREFIX,
+                    tags=self.tags)
+            except Exception:
+                LOG.exception("failed to create metric reporter")
+
+    def publish(self, stats):
+        """Publish stats (a CycleStats) as the latest cycle's metrics."""
+        LAST_STATS[0] = stats
+
+        if self.reporter:
+            try:
+                self.reporter.write()
+            except Exception:
+                LOG.exception("failed to post metrics")
+
+        if self.filename:
+            self.write_file(stats)
+
+    def write_file(self, stats):
+        """Atomically replace metrics file with stats as JSON."""
+        data = {
+            "timestamp": time.time(),
+            "tags": self.tags,
+            "metrics": stats.as_dict(),
+            }
+
+        tmp_filename = "{}.tmp".format(self.filename)
+
+        try:
+            with open(tmp_filename, "w") as tmp_file:
+                json.dump(data, tmp_file, indent=2, sort_keys=True)
+
+            os.rename(tmp_filename, self.filename)
+        except Exception:
+            LOG.exception("failed to write metrics to %s", self.filename)
@@ -21,6 +21,7 @@ from Products.ZenUtils.Driver import drive
 
 from twisted.internet.defer import inlineCallbacks, returnValue
 
+from ZenPacks.zenoss.Layer2 import macs
 from ZenPacks.zenoss.Layer2.utils import filterMacSet, is_valid_macaddr802
 
 
@@ -276,7 +277,7 @@ def mac_from_snmpindex(snmpindex):
             raise ValueError("snmpindex has fewer than 6 bytes")
 
         # Convert from "." delimited decimal to ":" delimited hex.
-        return ':'.join('%02X' % int(x) for x in mac_parts).upper()
+        return macs.from_octets(mac_parts)
     except Exception:
         raise ValueError("no MAC address in {!r}".format(snmpindex))
 
@@ -26,12 +26,12 @@ from zenoss.protocols.services.zep import ZepConnectionError
 import networkx
 
 from . import connections
+from .macs import is_canonical
 
 log = logging.getLogger('zen.Layer2')
 
 ZEP_BATCH_SIZE = 400
 MAX_NODES_COUNT = 1000
-MAC_REGEX = re.compile(r'(:?[0-9A-F]:?){12}', re.IGNORECASE)
 
 
 def get_connections_json(
@@ -81,10 +81,12 @@ def get_connections(rootnode, depth=1, layers=None, macs=False, dangling=False):
         layers.add(u"layer2")
 
     rootnode_uid = rootnode.getPrimaryId()
+
+    # The cached graph is shared. Copy it because it's modified below.
     g = connections.networkx_graph(
         root=rootnode_uid,
         layers=layers,
-        depth=depth)
+        depth=depth).copy()
 
     # This makes clicking MAC nodes navigate to their associated interface.
     add_path_to_macs(g)
@@ -164,7 +166,7 @@ def get_connections(rootnode, depth=1, layers=None, macs=False, dangling=False):
 
 def is_mac(n):
     """Return True if n is a MAC address."""
-    return MAC_REGEX.match(n)
+    return is_canonical(n)
 
 
 def is_connector(n):
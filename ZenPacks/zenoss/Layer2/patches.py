@@ -29,6 +29,7 @@ except ImportError:
     vSphereEndpoint = types.NoneType
 
 from . import connections
+from .connections_provider import update_interface_index
 from . import network_tree
 from .utils import get_cz_url_path
 
@@ -63,8 +64,11 @@ def get_clients_links(self):
     dmd = self._object.dmd
     links = defaultdict(lambda: defaultdict(dict))
 
+    # One query for all client MACs rather than one per MAC.
+    devices = connections.get_devices_by_macs(dmd, self._object.clientmacs)
+
     for mac in self._object.clientmacs:
-        device = connections.get_device_by_mac(dmd, mac)
+        device = devices.get(mac)
 
         if device:
             template = '<a href="{}">{}</a>'
@@ -111,10 +115,6 @@ def remote_applyDataMaps(self, device, maps, *args, **kwargs):
 
     if changed:
         try:
-            # If this impacts modeling performance too much we could remove
-            # it, and let zenmapper handle it on its next cycle. All this
-            # buys us is more immediate updating of Layer2 data after
-            # devices are remodeled.
             device = self.getPerformanceMonitor().findDeviceByIdExact(device)
             if not device:
                 return changed
@@ -122,8 +122,21 @@ def remote_applyDataMaps(self, device, maps, *args, **kwargs):
             if isinstance(device, vSphereEndpoint):
                 return changed
 
+            # Index interfaces while they're still in cache so zenmapper
+            # can extract connections without loading them.
+            try:
+                update_interface_index(device)
+            except Exception:
+                log.exception("%s: failed to index interfaces", device.id)
+
+            # Queue the device for zenmapper rather than updating its
+            # connections here. Extracting and writing edges for a large
+            # switch can take seconds that zenhub shouldn't spend.
             if device.getZ("zL2UpdateOnModel", True):
-                connections.update_node(device)
+                # Switches first because their edges affect more devices.
+                connections.enqueue_node(
+                    device,
+                    priority=1 if connections.is_switch(device) else 0)
 
         except Exception:
             # MySQL might not be available. We'll just let zenmapper add
@@ -197,7 +210,7 @@ def getNetworkLayersList(self):
     ''' Return existing network layers list for checkboxes options '''
     return network_tree.serialize([
         dict(boxLabel=x, inputValue='layer_' + x, id='layer_' + x)
-        for x in connections.get_layers()
+        for x in connections.get_sorted_layers()
     ])
 
 
@@ -0,0 +1,162 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Pipelined writing of node edges to the graph.
+
+Extracting a node's edges is bound by ZODB and CPU, while writing them is
+bound by MySQL latency. EdgeWriter lets the two overlap. The producer
+(usually zenmapper's main thread, which owns the ZODB connection) calls
+put() with NodeUpdate instances, and a pool of writer threads applies
+them to the graph.
+
+Example usage:
+
+    writer = EdgeWriter(LOG, threads=2, queue_size=10)
+
+    for node in nodes:
+        update = connections.get_node_update(node)
+        if update:
+            writer.put(update)
+
+    updated = writer.join()
+
+The queue between the producer and the writers is bounded. When writers
+fall behind, put() blocks until there's room, so no more than queue_size
+updates are ever held in memory waiting to be written.
+
+"""
+
+import datetime
+import logging
+import Queue
+import threading
+
+from . import connections
+
+# Default number of updates that may be waiting for a writer.
+DEFAULT_QUEUE_SIZE = 10
+
+# EdgeWriter will log at INFO level instead of DEBUG if it takes longer than
+# LONG_TIME seconds to write a node's edges.
+LONG_TIME = 300
+
+
+class EdgeWriter(object):
+
+    """Pool of threads writing NodeUpdate instances to the graph."""
+
+    def __init__(
+            self,
+            logger,
+            threads=1,
+            queue_size=DEFAULT_QUEUE_SIZE,
+            apply_fn=connections.apply_node_update,
+            callback=None):
+
+        self.logger = logger
+        self.threads = threads
+        self.apply_fn = apply_fn
+
+        # Called with (update, (added, removed), seconds) after each
+        # successful write.
+        self.callback = callback
+
+        self.queue = Queue.Queue(maxsize=max(queue_size, 1))
+        self.lock = threading.Lock()
+        self.workers = []
+
+        self.updated = 0
+
+    def start(self):
+        """Start writer threads that aren't already running."""
+        self.workers = [x for x in self.workers if x.is_alive()]
+
+        while len(self.workers) < self.threads:
+            worker = threading.Thread(
+                target=self.work,
+                name="edge-writer-{}".format(len(self.workers)))
+
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def put(self, update):
+        """Write update (a NodeUpdate) to the graph.
+
+        The update is queued for the writer threads. If the queue is
+        full this blocks until a writer takes an update off of it. With
+        no writer threads configured the update is written immediately.
+
+        """
+        if self.threads < 1:
+            self.write(update)
+            return
+
+        self.start()
+        self.queue.put(update)
+
+    def join(self):
+        """Wait for all queued updates to be written.
+
+        Returns the number of updates written successfully since the
+        last call to join.
+
+        """
+        self.queue.join()
+
+        with self.lock:
+            updated, self.updated = self.updated, 0
+
+        return updated
+
+    def work(self):
+        """Write updates from the queue until the process exits."""
+        while True:
+            update = self.queue.get()
+            try:
+                self.write(update)
+            finally:
+                self.queue.task_done()
+
+    def write(self, update):
+        """Write update to the graph. Log and count the outcome."""
+        start_time = datetime.datetime.now()
+
+        try:
+            changes = self.apply_fn(update)
+        except Exception:
+            self.logger.exception(
+                "%s: unexpected exception while updating", update.id)
+
+            return
+
+        duration = datetime.datetime.now() - start_time
+
+        if duration.total_seconds() > LONG_TIME:
+            log_level = logging.INFO
+        else:
+            log_level = logging.DEBUG
+
+        self.logger.log(
+            log_level,
+            "%s: updated (%s edges added, %s removed in %s)",
+            update.id,
+            changes[0],
+            changes[1],
+            duration)
+
+        if self.callback:
+            try:
+                self.callback(update, changes, duration.total_seconds())
+            except Exception:
+                self.logger.exception(
+                    "%s: unexpected exception after updating", update.id)
+
+        with self.lock:
+            self.updated += 1
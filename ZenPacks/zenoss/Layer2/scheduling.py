@@ -0,0 +1,150 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Adaptive scheduling of zenmapper device checks.
+
+Most devices' edges rarely change, but a few (usually access switches)
+change all the time. Scheduler keeps statistics for each device, and
+uses them to check devices whose edges change every cycle, and to back
+off exponentially on devices whose edges don't change, up to a maximum
+interval that bounds how stale a device's edges can get.
+
+Example usage:
+
+    scheduler = Scheduler(cycletime=300, max_interval=3600)
+    scheduler.load()
+
+    for path in scheduler.get_due(paths, uuids_by_path):
+        ...
+        scheduler.record(uuid, changed=True, cost=1.5)
+
+    scheduler.save()
+
+"""
+
+import collections
+import threading
+import time
+
+from . import connections
+
+# Per-device statistics as stored in the database.
+Stats = collections.namedtuple(
+    "Stats", [
+        "last_checked",
+        "interval",
+        "checks",
+        "changes",
+        "cost",
+        ])
+
+
+class Scheduler(object):
+
+    """Adaptive per-device check scheduling."""
+
+    def __init__(self, cycletime, max_interval):
+        self.cycletime = cycletime
+        self.max_interval = max(max_interval, cycletime)
+
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.unsaved = {}
+
+    def load(self):
+        """Load statistics for all devices from the database."""
+        with self.lock:
+            self.stats = {
+                k: Stats(*v) for k, v in connections.get_schedule().iteritems()}
+
+            self.unsaved = {}
+
+    def save(self):
+        """Save statistics recorded since the last load or save."""
+        with self.lock:
+            unsaved, self.unsaved = self.unsaved, {}
+
+        if unsaved:
+            connections.update_schedule(unsaved)
+
+    def is_due(self, uuid, now=None):
+        """Return True if uuid should be checked this cycle.
+
+        A device is due if it would become overdue before the next
+        cycle gets a chance to check it.
+
+        """
+        stats = self.stats.get(uuid)
+        if stats is None:
+            return True
+
+        if now is None:
+            now = time.time()
+
+        return stats.last_checked + stats.interval < now + self.cycletime
+
+    def get_due(self, paths, uuids_by_path, now=None):
+        """Return list of paths due to be checked this cycle.
+
+        Paths are ordered with the most overdue first so they'll be
+        checked first. Devices that are equally overdue are ordered with
+        the cheapest to check first.
+
+        """
+        if now is None:
+            now = time.time()
+
+        due = []
+        for path in paths:
+            uuid = uuids_by_path.get(path)
+            if uuid is None or uuid not in self.stats:
+                due.append((float("inf"), 0, path))
+            elif self.is_due(uuid, now=now):
+                stats = self.stats[uuid]
+                overdue = (now - stats.last_checked) / float(stats.interval)
+                due.append((overdue, stats.cost, path))
+
+        due.sort(key=lambda x: (-x[0], x[1]))
+
+        return [x[2] for x in due]
+
+    def record(self, uuid, changed, cost, now=None):
+        """Record that uuid was checked.
+
+        Set changed to True if the device's edges changed. Set cost to
+        the number of seconds it took to check the device.
+
+        """
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            stats = self.stats.get(uuid)
+            if stats is None:
+                interval, checks, changes = self.cycletime, 0, 0
+            else:
+                interval, checks, changes = (
+                    stats.interval, stats.checks, stats.changes)
+
+            if changed:
+                # Keep checking every cycle while edges are changing.
+                interval = self.cycletime
+                changes += 1
+            else:
+                interval = min(interval * 2, self.max_interval)
+
+            stats = Stats(
+                last_checked=now,
+                interval=interval,
+                checks=checks + 1,
+                changes=changes,
+                cost=cost)
+
+            self.stats[uuid] = stats
+            self.unsaved[uuid] = stats
@@ -0,0 +1,111 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Partitioning of devices between zenmapper instances.
+
+Each running instance records a heartbeat in the database. Instances
+whose heartbeat is recent are live, and each device is owned by exactly
+one live instance chosen by rendezvous hashing of the device's shard key.
+When an instance stops its heartbeat expires, and only the devices it
+owned are reassigned to the remaining instances.
+
+Shard keys depend on how devices are partitioned.
+
+* hash: The device's UUID.
+* collector: The ID of the collector the device is monitored by.
+* class: The device's device class path.
+
+The first live instance in sorted order is designated to run database
+maintenance such as compact and optimize.
+
+Example usage:
+
+    sharder = Sharder("zenmapper-1", timeout=900)
+    sharder.refresh()
+
+    if sharder.is_designated():
+        connections.compact(uuids)
+
+    paths = sharder.filter(paths, keys_by_path)
+
+"""
+
+import hashlib
+import time
+
+from ZenPacks.zenoss.Layer2 import connections
+
+# Supported ways of partitioning devices.
+SHARD_BY = ("hash", "collector", "class")
+
+
+def device_class_from_path(path):
+    """Return device class path of the device at path.
+
+    /zport/dmd/Devices/Network/Cisco/devices/sw1 -> /Network/Cisco
+
+    """
+    try:
+        prefix, _ = path.rsplit("/devices/", 1)
+        return prefix.split("/Devices", 1)[1] or "/"
+    except (ValueError, IndexError):
+        return path
+
+
+def weight(instance, key):
+    """Return rendezvous hashing weight of instance for key."""
+    return hashlib.md5("{}\0{}".format(instance, key)).hexdigest()
+
+
+def owner(key, instances):
+    """Return instance in instances that owns key."""
+    return max(instances, key=lambda x: weight(x, key))
+
+
+class Sharder(object):
+
+    """Decides which devices a zenmapper instance owns."""
+
+    def __init__(self, instance, timeout):
+        self.instance = instance
+        self.timeout = timeout
+        self.instances = [instance]
+
+    def refresh(self):
+        """Load live instances, first recording our own heartbeat.
+
+        This instance is always considered live.
+
+        """
+        connections.heartbeat(self.instance)
+
+        instances = set(connections.get_instances(time.time() - self.timeout))
+        instances.add(self.instance)
+        self.instances = sorted(instances)
+
+        return self.instances
+
+    def is_designated(self):
+        """Return True if this instance should run database maintenance."""
+        return self.instances[0] == self.instance
+
+    def owns(self, key):
+        """Return True if this instance owns devices with shard key."""
+        return owner(key, self.instances) == self.instance
+
+    def filter(self, paths, keys_by_path):
+        """Return paths of devices this instance owns.
+
+        Devices with no shard key in keys_by_path are sharded by path.
+
+        """
+        if len(self.instances) < 2:
+            return list(paths)
+
+        return [x for x in paths if self.owns(keys_by_path.get(x, x))]
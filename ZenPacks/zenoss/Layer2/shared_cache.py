@@ -0,0 +1,407 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Layer2 topology and statuses shared between processes.
+
+One process writes the layer2 adjacency and the set of down devices to
+a file. Any number of processes map the file read-only and look nodes
+up in place, so N zeneventd workers hold one copy of the topology in
+memory and start with it already loaded.
+
+Writers replace the file atomically by renaming a new one over it, so
+readers never need a lock. A reader keeps using the file it mapped
+until it sees that the file was replaced.
+
+File layout. All integers are unsigned 32-bit in native byte order.
+
+    header (see HEADER)
+    nodes: string table of all nodes sorted
+    adjacency: node_count + 1 offsets into neighbors, then neighbors
+               as indexes of nodes
+    down: string table of down devices sorted
+
+Each string table is count + 1 offsets into its data, then its data.
+
+The filename and the age after which readers stop using a file can be
+set in global.conf, so zenmapper and zeneventd on a host agree on them.
+
+    layer2-shared-cache /opt/zenoss/var/zenmapper-layer2.cache
+    layer2-shared-cache-max-age 900
+
+Example usage:
+
+    write(filename, [("/zport/dmd/Devices/devices/a", "00:00:00:00:00:01")])
+
+    cache = SharedCache(get_filename(), check_seconds=10, max_age=900)
+    snapshot = cache.get()
+    if snapshot is not None and node in snapshot:
+        neighbors = snapshot[node]
+
+"""
+
+import array
+import bisect
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+LOG = logging.getLogger("zen.Layer2")
+
+# Written by zenmapper --shared-cache, and read by event suppression.
+DEFAULT_FILENAME = os.path.join(
+    os.environ.get("ZENHOME", "/opt/zenoss"),
+    "var",
+    "zenmapper-layer2.cache")
+
+# Seconds after which readers stop using a file and fall back to MySQL.
+DEFAULT_MAX_AGE = 900
+
+# global.conf properties overriding the defaults.
+FILENAME_PROPERTY = "layer2-shared-cache"
+MAX_AGE_PROPERTY = "layer2-shared-cache-max-age"
+
+MAGIC = "L2SC"
+FORMAT_VERSION = 1
+
+# magic, format version, created, whether down devices are known,
+# node count, nodes offset, adjacency offset, down count, down offset.
+HEADER = struct.Struct("=4sIdIIIIII")
+
+UINT = struct.Struct("=I")
+UINT_CODE = "I"
+
+
+class Snapshot(object):
+    """Read-only view of a mapped shared cache file.
+
+    A snapshot can be used in place of a networkx.Graph by code that
+    only checks membership and iterates over neighbors. Neighbors are
+    returned as a tuple of nodes.
+
+    """
+
+    def __init__(self, buf):
+        """Initialize snapshot of buf (a str or mmap).
+
+        Raises ValueError if buf isn't a shared cache.
+
+        """
+        if len(buf) < HEADER.size:
+            raise ValueError("shared cache is truncated")
+
+        (magic, version, self.created, has_down, self.node_count,
+         nodes_offset, adjacency_offset, down_count, down_offset,
+         ) = HEADER.unpack_from(buf, 0)
+
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("not a version {} shared cache".format(
+                FORMAT_VERSION))
+
+        self.buf = buf
+        self.nodes = StringTable(buf, nodes_offset, self.node_count)
+        self.adjacency_offset = adjacency_offset
+        self.neighbors_offset = adjacency_offset + (
+            UINT.size * (self.node_count + 1))
+
+        if has_down:
+            self.down = StringTable(buf, down_offset, down_count)
+        else:
+            self.down = None
+
+    def __contains__(self, node):
+        return self.nodes.index(node) is not None
+
+    def __getitem__(self, node):
+        index = self.nodes.index(node)
+        if index is None:
+            raise KeyError(node)
+
+        return self.neighbors(index)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return self.node_count
+
+    def neighbors(self, index):
+        """Return tuple of neighbors of node at index."""
+        start, end = struct.unpack_from(
+            "=II", self.buf, self.adjacency_offset + UINT.size * index)
+
+        indexes = struct.unpack_from(
+            "={}I".format(end - start),
+            self.buf,
+            self.neighbors_offset + UINT.size * start)
+
+        return tuple(self.nodes[x] for x in indexes)
+
+    def get_down(self):
+        """Return set of down devices, or None if they weren't known."""
+        if self.down is None:
+            return None
+
+        return set(self.down)
+
+
+class StringTable(object):
+    """Sorted strings in a buffer, found by binary search in place."""
+
+    def __init__(self, buf, offset, count):
+        self.buf = buf
+        self.offset = offset
+        self.count = count
+        self.data_offset = offset + UINT.size * (count + 1)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        start, end = struct.unpack_from(
+            "=II", self.buf, self.offset + UINT.size * index)
+
+        return self.buf[self.data_offset + start:self.data_offset + end]
+
+    def __iter__(self):
+        for index in xrange(self.count):
+            yield self[index]
+
+    def index(self, value):
+        """Return index of value, or None if it isn't in the table."""
+        if isinstance(value, unicode):
+            value = value.encode("utf-8")
+
+        index = bisect.bisect_left(self, value)
+        if index < self.count and self[index] == value:
+            return index
+
+        return None
+
+
+def pack_strings(strings):
+    """Return string table of sorted strings as a str."""
+    offsets = array.array(UINT_CODE, [0])
+    for string in strings:
+        offsets.append(offsets[-1] + len(string))
+
+    return offsets.tostring() + "".join(strings)
+
+
+def pad(data):
+    """Return data padded to a multiple of UINT.size bytes."""
+    return data + "\0" * (-len(data) % UINT.size)
+
+
+def encode(node):
+    """Return node as a str."""
+    if isinstance(node, unicode):
+        return node.encode("utf-8")
+
+    return node
+
+
+def dumps(edges, down=None, created=None):
+    """Return shared cache of edges and down devices as a str.
+
+    edges is an iterable of (source, target) tuples. They're treated as
+    undirected. down is an iterable of down devices, or None if they
+    aren't known.
+
+    """
+    adjacency = {}
+    for source, target in edges:
+        source, target = encode(source), encode(target)
+        if source == target:
+            continue
+
+        adjacency.setdefault(source, set()).add(target)
+        adjacency.setdefault(target, set()).add(source)
+
+    nodes = sorted(adjacency)
+    indexes = {x: i for i, x in enumerate(nodes)}
+
+    offsets = array.array(UINT_CODE, [0])
+    neighbors = array.array(UINT_CODE)
+    for node in nodes:
+        neighbors.extend(sorted(indexes[x] for x in adjacency[node]))
+        offsets.append(len(neighbors))
+
+    nodes_data = pad(pack_strings(nodes))
+    adjacency_data = offsets.tostring() + neighbors.tostring()
+
+    if down is None:
+        down_nodes = []
+    else:
+        down_nodes = sorted(set(encode(x) for x in down))
+
+    nodes_offset = HEADER.size
+    adjacency_offset = nodes_offset + len(nodes_data)
+    down_offset = adjacency_offset + len(adjacency_data)
+
+    header = HEADER.pack(
+        MAGIC,
+        FORMAT_VERSION,
+        time.time() if created is None else created,
+        down is not None,
+        len(nodes),
+        nodes_offset,
+        adjacency_offset,
+        len(down_nodes),
+        down_offset)
+
+    return "".join((
+        header,
+        nodes_data,
+        adjacency_data,
+        pack_strings(down_nodes)))
+
+
+def write(filename, edges, down=None):
+    """Atomically replace filename with shared cache of edges and down.
+
+    See dumps for edges and down.
+
+    """
+    data = dumps(edges, down)
+
+    dirname, basename = os.path.split(os.path.abspath(filename))
+    fd, tmp_filename = tempfile.mkstemp(prefix=basename, dir=dirname)
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+
+        # Readers can't map the temporary file by its name.
+        os.chmod(tmp_filename, 0o644)
+        os.rename(tmp_filename, filename)
+    except Exception:
+        try:
+            os.unlink(tmp_filename)
+        except OSError:
+            pass
+
+        raise
+
+
+def get_global_config():
+    """Return global.conf properties as a dict."""
+    from Products.ZenUtils.GlobalConfig import getGlobalConfiguration
+    return getGlobalConfiguration()
+
+
+def get_filename():
+    """Return shared cache filename configured in global.conf."""
+    return get_global_config().get(FILENAME_PROPERTY) or DEFAULT_FILENAME
+
+
+def get_max_age():
+    """Return shared cache max age configured in global.conf."""
+    value = get_global_config().get(MAX_AGE_PROPERTY)
+    if not value:
+        return DEFAULT_MAX_AGE
+
+    try:
+        return int(value)
+    except ValueError:
+        LOG.warning(
+            "invalid %s %r: using %s",
+            MAX_AGE_PROPERTY,
+            value,
+            DEFAULT_MAX_AGE)
+
+        return DEFAULT_MAX_AGE
+
+
+def load(filename):
+    """Return Snapshot of filename mapped into memory.
+
+    Raises EnvironmentError if filename can't be mapped, and ValueError
+    if it isn't a shared cache.
+
+    """
+    with open(filename, "rb") as f:
+        # The mapping remains valid after the file is closed or replaced.
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return Snapshot(buf)
+
+
+class SharedCache(object):
+    """Reader of the latest Snapshot of a shared cache file.
+
+    The file is checked for replacement at most every check_seconds.
+    Snapshots older than max_age seconds aren't used, so readers fall
+    back to other sources when the writer stops. A missing or stale
+    file is logged once until a usable one is loaded.
+
+    """
+
+    def __init__(self, filename, check_seconds, max_age):
+        self.filename = filename
+        self.check_seconds = check_seconds
+        self.max_age = max_age
+
+        self.snapshot = None
+        self.stat_key = None
+        self.checked = 0
+        self.unusable = False
+
+    def get(self):
+        """Return current Snapshot, or None if there isn't one."""
+        now = time.time()
+        if self.checked + self.check_seconds <= now:
+            self.checked = now
+            self.refresh()
+
+        if self.snapshot is None:
+            return None
+
+        if self.snapshot.created + self.max_age < now:
+            self.set_unusable(
+                "%s is older than %s seconds", self.filename, self.max_age)
+
+            return None
+
+        self.unusable = False
+        return self.snapshot
+
+    def set_unusable(self, msg, *args):
+        """Log why the file can't be used unless already logged."""
+        if not self.unusable:
+            self.unusable = True
+            LOG.info(msg + ": not using it", *args)
+
+    def refresh(self):
+        """Map the file again if it was replaced."""
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            self.set_unusable("%s doesn't exist", self.filename)
+            self.snapshot = None
+            self.stat_key = None
+            return
+
+        stat_key = (stat.st_ino, stat.st_mtime, stat.st_size)
+        if stat_key == self.stat_key:
+            return
+
+        self.stat_key = stat_key
+
+        try:
+            self.snapshot = load(self.filename)
+        except (EnvironmentError, ValueError) as e:
+            LOG.warning("failed to load %s: %s", self.filename, e)
+            self.snapshot = None
+        else:
+            LOG.info(
+                "loaded %s nodes from %s",
+                len(self.snapshot),
+                self.filename)
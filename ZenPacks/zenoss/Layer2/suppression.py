@@ -24,7 +24,13 @@ Entry point for event suppression. The expected usage is as follows.
 """
 
 import collections
+import contextlib
 import datetime
+import functools
+import heapq
+import itertools
+import random
+import re
 import time
 import types
 import sys
@@ -37,20 +43,14 @@ from zenoss.protocols.protobufs.zep_pb2 import (
     SEVERITY_CLEAR, SEVERITY_CRITICAL,
     )
 
-try:
-    from networkx import shortest_simple_paths
-except ImportError:
-    # The networkx version shipped with Zenoss 4 (1.3) doesn't have
-    # shortest_simple_paths. So we have a compatible copy of the algorithm
-    # locally.
-    from .nx.simple_paths import shortest_simple_paths
-
 from . import connections
+from . import shared_cache
 
 import logging
 LOG = logging.getLogger("zen.Layer2")
 
 from metrology import Metrology
+from metrology.instruments.gauge import Gauge
 s_meter = Metrology.meter("events-suppressed")
 
 # Default exports.
@@ -68,6 +68,59 @@ ENABLED, DISABLED = True, False
 # Singleton to keep state for callers who can't keep their own state.
 SUPPRESSOR = None
 
+# Most entries to keep in each of the Suppressor's caches. Graphs can be
+# large, so few are kept.
+STATUS_CACHE_SIZE = 100000
+SETTINGS_CACHE_SIZE = 100000
+GATEWAYS_CACHE_SIZE = 100000
+REGIONS_CACHE_SIZE = 100000
+PATHS_CACHE_SIZE = 100000
+GRAPHS_CACHE_SIZE = 100
+ABSENT_CACHE_SIZE = 100000
+
+# Seconds between checks of which cached component graphs changed.
+GRAPH_CHANGES_CHECK_SECONDS = 60
+
+# Most equal-length shortest paths to check between a device and gateway.
+MAX_SHORTEST_PATHS = 1000
+
+# Seconds between reconciliations of the status index with ZEP.
+STATUS_RECONCILE_SECONDS = 300
+
+# Seconds statuses set from events take precedence over reconciliation.
+# ZEP may not have stored the events the plugin just saw.
+STATUS_GRACE_SECONDS = 60
+
+# Seconds between checks for a new shared cache written by zenmapper. Its
+# filename and the age after which it isn't used are set in global.conf.
+SHARED_CACHE_CHECK_SECONDS = 10
+
+# Primary paths of devices.
+DEVICE_PATH_REGEX = re.compile(r"^/zport/dmd/Devices/(.+/)?devices/[^/]+$")
+
+# Suppressor caches with hit ratios published as Metrology gauges.
+# Gauge names are suppression-<name>-hit-ratio.
+METERED_CACHES = (
+    "status",
+    "settings",
+    "gateways",
+    "regions",
+    "paths",
+    "dominators",
+    "root_causes",
+    )
+
+# Events taking longer than this many seconds to process are slow. None
+# disables tracing of slow events.
+TRACE_SLOW_SECONDS = 1.0
+
+# Fraction of slow events to log a trace of phase timings for.
+TRACE_SAMPLE_RATE = 0.1
+
+# Slow event traces are logged here. Set its level to WARNING to disable
+# them.
+TRACE_LOG = logging.getLogger("zen.Layer2.trace")
+
 Settings = collections.namedtuple(
     "Settings", [
         "enabled",
@@ -85,11 +138,34 @@ def get_suppressor(dmd):
     return SUPPRESSOR
 
 
+def timed(phase):
+    """Time decorated Suppressor method as phase. See PhaseTimer."""
+    def wrap(f):
+        @functools.wraps(f)
+        def wrapper(self, *args, **kwargs):
+            with self.timer.phase(phase):
+                return f(self, *args, **kwargs)
+
+        return wrapper
+
+    return wrap
+
+
 class Suppressor(object):
     """Supressor singleton. Get instance using get_suppressor(dmd)."""
 
     def __init__(self, dmd):
         self.dmd = dmd
+        self.timer = PhaseTimer(
+            slow_seconds=TRACE_SLOW_SECONDS,
+            sample_rate=TRACE_SAMPLE_RATE)
+
+        # Topology and statuses shared by all processes on the host.
+        self.shared = shared_cache.SharedCache(
+            shared_cache.get_filename(),
+            check_seconds=SHARED_CACHE_CHECK_SECONDS,
+            max_age=shared_cache.get_max_age())
+
         self.clear_caches()
 
     def process_event(self, event):
@@ -109,36 +185,108 @@ class Suppressor(object):
         event.rootCauses will not be set.
 
         """
-        device, settings = self.get_device_and_settings(event.device)
-        if not device or not settings.enabled:
-            return
+        self.process_events([event])
 
-        device_entity = device.getPrimaryId()
+    @timed("events")
+    def process_events(self, events):
+        """Set eventState and rootCauses of each event in events.
 
-        if event.eventClass == Status_Ping and not event.component:
-            if event.severity == SEVERITY_CRITICAL:
-                # Ping down. Cache DOWN status.
-                self.set_status(device_entity, DOWN)
+        This is equivalent to calling process_event for each event,
+        except that the status changes from all ping events are cached
+        before any event is checked. Settings and root causes are looked
+        up once per device, and statuses of all devices and gateways the
+        events involve are prefetched in bulk.
+
+        """
+        # device id -> (device, settings, entity)
+        contexts = {}
+
+        # entity -> (device, settings) of devices with ping down events.
+        pings_down = collections.OrderedDict()
+
+        # (event, entity, is_ping_down) for events that may be suppressed.
+        checks = []
+
+        for event in events:
+            context = contexts.get(event.device)
+            if context is None:
+                device, settings = self.get_device_and_settings(event.device)
+                if device and settings.enabled:
+                    entity = device.getPrimaryId()
+                else:
+                    entity = None
 
-                # Ping down events get the L2 root cause treatment.
-                if settings.paths:
-                    root_causes = self.root_causes(device, settings)
-                    if root_causes:
-                        event.eventState = STATUS_SUPPRESSED
-                        event.rootCauses = ",".join(sorted(x.id for x in root_causes))
-                        s_meter.mark()
+                context = contexts[event.device] = (device, settings, entity)
 
-            elif event.severity == SEVERITY_CLEAR:
-                # Ping clear. Cache UP status. No suppression necessary
-                self.set_status(device_entity, UP)
+            device, settings, entity = context
+            if entity is None:
+                continue
 
-        # Suppress non-ping events if the device is known to be down.
-        elif event.severity > SEVERITY_CLEAR and settings.device is ENABLED:
-            if self.get_status(device_entity) is DOWN:
+            if event.eventClass == Status_Ping and not event.component:
+                if event.severity == SEVERITY_CRITICAL:
+                    # Ping down. Cache DOWN status.
+                    self.set_status(entity, DOWN)
+
+                    # Ping down events get the L2 root cause treatment.
+                    if settings.paths:
+                        pings_down[entity] = (device, settings)
+                        checks.append((event, entity, True))
+
+                elif event.severity == SEVERITY_CLEAR:
+                    # Ping clear. Cache UP status. No suppression necessary
+                    self.set_status(entity, UP)
+
+            # Suppress non-ping events if the device is known to be down.
+            elif event.severity > SEVERITY_CLEAR and settings.device is ENABLED:
+                checks.append((event, entity, False))
+
+        self.timer.describe(
+            "events for {} devices: {}".format(
+                len(contexts), ",".join(sorted(contexts)[:10])))
+
+        if len(contexts) > 1:
+            self.warm_statuses(x[1] for x in checks if not x[2])
+            self.warm_root_causes(pings_down.values())
+
+        root_causes = {
+            entity: self.root_causes(device, settings)
+            for entity, (device, settings) in pings_down.iteritems()}
+
+        for event, entity, is_ping_down in checks:
+            if is_ping_down:
+                if root_causes[entity]:
+                    event.eventState = STATUS_SUPPRESSED
+                    event.rootCauses = ",".join(
+                        sorted(x.id for x in root_causes[entity]))
+                    s_meter.mark()
+
+            elif self.get_status(entity) is DOWN:
                 event.eventState = STATUS_SUPPRESSED
                 event.rootCauses = event.device
                 s_meter.mark()
 
+    def warm_root_causes(self, devices):
+        """Cache statuses root_causes will need for devices.
+
+        devices is an iterable of (device, settings) tuples. Statuses of
+        each device's gateways, and of each device's dominators toward
+        multi-hop gateways, are looked up together.
+
+        """
+        entities = set()
+        for device, settings in devices:
+            device_entity = device.getPrimaryId()
+            for gateway in self.get_gateways(device, settings):
+                gateway_entity = self.to_entity(gateway)
+                entities.add(gateway_entity)
+
+                if getattr(gateway, "_v_multihop", False):
+                    entities.update(
+                        self.get_dominators(gateway_entity).dominators(
+                            device_entity))
+
+        self.warm_statuses(entities)
+
     def root_causes(self, device, settings):
         """Return a set() of root cause Device instances.
 
@@ -153,6 +301,7 @@ class Suppressor(object):
         # At least one gateway, and all gateways are down? This is a
         # shortcut that allows us to avoid more expensive path walking.
         gateway_entities = [self.to_entity(x) for x in gateways]
+        self.warm_statuses(gateway_entities)
         gateway_statuses = [self.get_status(x) for x in gateway_entities]
         if gateway_statuses and UP not in gateway_statuses:
             return set(gateways)
@@ -164,6 +313,7 @@ class Suppressor(object):
             # The shortcut above was enough to find single-hop root causes.
             return set()
 
+    @timed("gateways")
     def get_gateways(self, device, settings):
         """Return a list of gateways (Device instances) for device.
 
@@ -207,24 +357,114 @@ class Suppressor(object):
 
         The returned set of gateways will be Device instances.
 
+        """
+        device_entity = self.to_entity(device)
+
+        # Devices in the same region of the topology share results until
+        # a status in the region's component flips.
+        key = self.root_causes_key(device_entity, gateways)
+        if key is not None:
+            root_causes = self.root_causes_cache.get(key)
+            if root_causes is not None:
+                return set(self.to_objs(root_causes))
+
+        root_causes = self.l2_root_cause_entities(device, gateways)
+        if key is not None:
+            self.root_causes_cache.set(key, root_causes)
+
+        return set(self.to_objs(root_causes))
+
+    @timed("paths")
+    def l2_root_cause_entities(self, device, gateways):
+        """Return frozenset() of root cause entities for device.
+
+        Results are the same as path_root_causes for each gateway.
+        Dominators are only used to skip walking paths when a down
+        dominator is the closest-to-gateway failure on every path.
+
         """
         root_causes = set()
+        device_entity = self.to_entity(device)
 
         for gateway in gateways:
-            for path in self.get_shortest_paths(device, gateway):
-                for entity in reversed(path[1:]):
-                    if not entity.startswith("/"):
-                        # Don't bother checking non-object entities.
-                        continue
-
-                    if self.get_status(entity) is DOWN:
-                        # Found the closest-to-gateway failure on this path.
-                        root_causes.add(entity)
-                        break
-                else:
-                    return set()
+            # Every shortest path starts from the gateway with its leading
+            # dominators of device. If one is down it's the closest-to-
+            # gateway failure on all paths. Other dominators aren't. A
+            # failure nearer the gateway on some paths can precede them.
+            tree = self.get_dominators(gateway)
+            dominators = [
+                x for x in tree.leading_dominators(device_entity)
+                if x.startswith("/")]
+
+            self.warm_statuses(dominators)
+
+            for entity in dominators:
+                if self.get_status(entity) is DOWN:
+                    root_causes.add(entity)
+                    break
+            else:
+                # Otherwise check each path for a failure.
+                path_root_causes = self.path_root_causes(device, gateway)
+                if path_root_causes is None:
+                    return frozenset()
 
-        return set(self.to_objs(root_causes))
+                root_causes.update(path_root_causes)
+
+        return frozenset(root_causes)
+
+    def root_causes_key(self, device_entity, gateways):
+        """Return root_causes_cache key for device_entity, or None.
+
+        Root causes only depend on the statuses of entities between the
+        gateways and the first entity every path from device_entity
+        reaches: its anchor. So devices with the same anchors toward
+        the same gateways share a key. The key includes the epoch of
+        each gateway's DominatorTree, which changes whenever a status
+        on one of its paths flips.
+
+        None is returned if device_entity has no anchor toward a gateway.
+
+        """
+        parts = []
+        for gateway in gateways:
+            gateway_entity = self.to_entity(gateway)
+            tree = self.get_dominators(gateway_entity)
+            anchor = tree.anchors.get(device_entity)
+            if anchor is None:
+                return None
+
+            parts.append((gateway_entity, anchor, tree.serial, tree.epoch))
+
+        return tuple(sorted(parts))
+
+    def path_root_causes(self, device, gateway):
+        """Return set() of root cause entities on paths to gateway.
+
+        The closest-to-gateway failure on each shortest path from device
+        to gateway is a root cause. None is returned if any path has no
+        failures.
+
+        """
+        root_causes = set()
+        paths = self.get_shortest_paths(device, gateway)
+
+        # One bulk status lookup instead of one per entity below.
+        self.warm_statuses(x for path in paths for x in path[1:])
+
+        for path in paths:
+            for entity in reversed(path[1:]):
+                if not entity.startswith("/"):
+                    # Don't bother checking non-object entities.
+                    continue
+
+                if self.get_status(entity) is DOWN:
+                    # Found the closest-to-gateway failure on this path.
+                    root_causes.add(entity)
+                    break
+            else:
+                return None
+
+        return root_causes
 
     # -- Graph Algorithms ----------------------------------------------------
 
@@ -234,38 +474,77 @@ class Suppressor(object):
         Each gateway in the list is a Device object. An empty list
         indicates that no devices are known to be connected to device.
 
+        The device's layer2 graph is walked directly. Device neighbors
+        are checked directly. Non-device neighbors lead into regions of
+        non-device nodes whose gateways are found once and shared by
+        every device connected to the region. See get_region_gateways.
+
         """
         entity = self.to_entity(device)
-        visited = collections.deque([entity])
-        stack = collections.deque([self.get_neighbors(entity)])
+        g = self.get_graph(entity)
+        if entity not in g:
+            return []
 
         # Deduplicate gateways in case they can be reached via multiple paths.
-        gateways = set()
-
-        while stack:
-            neighbors = stack[-1]
-            neighbor = next(neighbors, None)
-            if not neighbor:
-                stack.pop()
-                visited.pop()
-                continue
+        gateway_entities = set()
 
-            if neighbor in visited:
+        for neighbor in g[entity]:
+            if neighbor == entity or neighbor in gateway_entities:
                 continue
 
             if neighbor.startswith("/"):
-                visited.append(neighbor)
-                neighbor_obj = self.to_obj(neighbor)
-                if neighbor_obj:
-                    if neighbor_obj.getProperty("zL2PotentialRootCause"):
-                        gateways.add(neighbor_obj)
+                if self.is_potential_gateway(neighbor):
+                    gateway_entities.add(neighbor)
+            else:
+                gateway_entities.update(self.get_region_gateways(neighbor, g))
 
-                continue
+        gateway_entities.discard(entity)
+        return list(self.to_objs(gateway_entities))
+
+    def get_region_gateways(self, entity, g):
+        """Return frozenset of gateway entities reachable from entity.
 
-            visited.append(neighbor)
-            stack.append(self.get_neighbors(neighbor))
+        entity must be a non-device entity in g, its component's graph.
+        Its region is every non-device entity reachable from it through
+        other non-device entities. The region is walked breadth-first
+        once, and each of its entities is cached with the same result
+        until the component changes. This makes finding gateways for all
+        devices in a component linear in its size rather than walking
+        shared regions again for each device.
 
-        return list(gateways)
+        """
+        cached = self.regions_cache.get(entity)
+        if cached is not None and cached[0] is g:
+            return cached[1]
+
+        region = [entity]
+        visited = {entity}
+        gateway_entities = set()
+        queue = collections.deque(region)
+
+        while queue:
+            for neighbor in g[queue.popleft()]:
+                if neighbor in visited:
+                    continue
+
+                visited.add(neighbor)
+                if neighbor.startswith("/"):
+                    if self.is_potential_gateway(neighbor):
+                        gateway_entities.add(neighbor)
+                else:
+                    region.append(neighbor)
+                    queue.append(neighbor)
+
+        gateway_entities = frozenset(gateway_entities)
+        for node in region:
+            self.regions_cache.set(node, (g, gateway_entities))
+
+        return gateway_entities
+
+    def is_potential_gateway(self, entity):
+        """Return True if entity is a device that may be a gateway."""
+        obj = self.to_obj(entity)
+        return bool(obj and obj.getProperty("zL2PotentialRootCause"))
 
     def get_shortest_paths(self, device, gateway):
         """Return list of shortest paths from device to gateway.
@@ -285,35 +564,62 @@ class Suppressor(object):
         gateway_entity = self.to_entity(gateway)
         cache_key = (device_entity, gateway_entity)
 
+        # Getting the graph first forgets paths in changed components.
+        g = self.get_graph(gateway_entity)
+
         cached_paths = self.paths_cache.get(cache_key)
         if cached_paths is not None:
             return cached_paths
 
-        g = self.get_graph(gateway_entity)
-
         # No paths if the device or gateway isn't in the gateway's graph.
         if device_entity not in g or gateway_entity not in g:
             return []
 
-        shortest_path = None
-        shortest_paths = []
+        distances = shortest_path_distances(g, gateway_entity, device_entity)
+        paths = list(
+            itertools.islice(
+                shortest_paths(g, device_entity, distances),
+                MAX_SHORTEST_PATHS))
 
-        for path in shortest_simple_paths(g, device_entity, gateway_entity):
-            path_len = len(path)
-            if not shortest_path or path_len <= shortest_path:
-                # Interested in all paths the same length as the shortest.
-                shortest_path = path_len
-                shortest_paths.append(path)
-            else:
-                # Not interested in paths longer than the shortest.
-                break
+        if len(paths) == MAX_SHORTEST_PATHS:
+            LOG.info(
+                "checking %s of %s shortest paths from %s to %s",
+                MAX_SHORTEST_PATHS,
+                count_shortest_paths(g, device_entity, distances),
+                device_entity,
+                gateway_entity)
+
+        # Paths are forgotten when the gateway's component changes.
+        self.paths_cache.set(cache_key, paths)
+        self.components.depend(gateway_entity, cache_key)
+
+        return paths
+
+    def forget_paths(self, keys):
+        """Remove paths cached for keys."""
+        for key in keys:
+            self.paths_cache.invalidate(key)
 
-        self.paths_cache.set(cache_key, shortest_paths)
+    def get_dominators(self, gateway):
+        """Return DominatorTree of shortest paths from gateway.
+
+        Trees are cached until the gateway's component graph changes.
+
+        """
+        gateway_entity = self.to_entity(gateway)
+        g = self.get_graph(gateway_entity)
 
-        return shortest_paths
+        cached = self.dominators_cache.get(gateway_entity)
+        if cached is not None and cached[0] is g:
+            return cached[1]
+
+        tree = DominatorTree(g, gateway_entity)
+        self.dominators_cache.set(gateway_entity, (g, tree))
+        return tree
 
     # -- Conversions ---------------------------------------------------------
 
+    @timed("to-obj")
     def to_obj(self, thing):
         """Return ZODB object from any kind of thing."""
         if isinstance(thing, types.StringTypes):
@@ -355,13 +661,43 @@ class Suppressor(object):
 
     def clear_caches(self):
         """Clear status, neighbors, and paths caches."""
-        self.status_cache = ExpiringCache(50)
-        self.settings_cache = ExpiringCache(600)
-        self.gateways_cache = ExpiringCache(600)
-        self.neighbors_cache = ExpiringCache(3300)
-        self.paths_cache = ExpiringCache(3300)
-        self.graphs_cache = ExpiringCache(3300)
+        self.status_cache = ExpiringCache(50, size=STATUS_CACHE_SIZE)
+        self.status_index = StatusIndex(
+            reconcile_seconds=STATUS_RECONCILE_SECONDS,
+            grace_seconds=STATUS_GRACE_SECONDS)
+        self.settings_cache = ExpiringCache(600, size=SETTINGS_CACHE_SIZE)
+        self.gateways_cache = ExpiringCache(600, size=GATEWAYS_CACHE_SIZE)
+        self.regions_cache = ExpiringCache(600, size=REGIONS_CACHE_SIZE)
+        self.paths_cache = ExpiringCache(3300, size=PATHS_CACHE_SIZE)
+        self.dominators_cache = ExpiringCache(3300, size=GRAPHS_CACHE_SIZE)
+        self.root_causes_cache = ExpiringCache(50, size=PATHS_CACHE_SIZE)
+
+        # Last known status of each entity to detect flips.
+        self.last_statuses = {}
+        self.components = ComponentRegistry(
+            3300,
+            size=GRAPHS_CACHE_SIZE,
+            absent_size=ABSENT_CACHE_SIZE,
+            check_seconds=GRAPH_CHANGES_CHECK_SECONDS,
+            remove_fn=self.forget_paths)
+
+    def cache_stats(self):
+        """Return dict of cache names to their stats.
+
+        Names are those in METERED_CACHES, components for the component
+        graphs, and status_index for statuses answered by the index.
+        Index answers aren't counted in the status cache's stats.
+
+        """
+        stats = {
+            x: getattr(self, "{}_cache".format(x)).stats()
+            for x in METERED_CACHES}
 
+        stats["components"] = self.components.stats()
+        stats["status_index"] = self.status_index.stats()
+        return stats
+
+    @timed("settings")
     def get_device_and_settings(self, device_id):
         """Return (device, settings) tuple.
 
@@ -413,6 +749,13 @@ class Suppressor(object):
         status_cache in the clear_caches method for how long.
 
         """
+        # Device statuses come from the status index once it's seeded.
+        self.reconcile_statuses()
+        status = self.status_index.get(entity)
+        if status is not None:
+            self.track_status(entity, status)
+            return status
+
         status = self.status_cache.get(entity)
         if status is None:
             status = connections.get_status(self.dmd, entity)
@@ -420,6 +763,56 @@ class Suppressor(object):
 
         return status
 
+    def reconcile_statuses(self):
+        """Reconcile status index with ZEP if it's due.
+
+        The first reconciliation seeds the index. Statuses that differ
+        from the index are cached as if set by set_status.
+
+        Down devices are read from the shared cache instead of ZEP if
+        it was written since the last reconciliation was due.
+
+        """
+        now = time.time()
+        if not self.status_index.is_due(now):
+            return
+
+        down, asof = None, now
+        snapshot = self.shared.get()
+        if snapshot is not None and (
+                snapshot.created + STATUS_RECONCILE_SECONDS > now):
+            down, asof = snapshot.get_down(), snapshot.created
+
+        if down is None:
+            down, asof = connections.get_down_devices(self.dmd), now
+
+        changes = self.status_index.reconcile(down, now, asof=asof)
+        for entity, status in changes.iteritems():
+            self.cache_status(entity, status)
+
+    @timed("statuses")
+    def warm_statuses(self, entities):
+        """Cache status of entities that aren't already cached.
+
+        Statuses are looked up in bulk by connections.get_statuses
+        rather than one entity at a time by get_status. Non-object
+        entities are ignored.
+
+        """
+        self.reconcile_statuses()
+        missing = set(
+            x for x in entities
+            if x and x.startswith("/")
+            and self.status_index.get(x) is None
+            and self.status_cache.get(x) is None)
+
+        if not missing:
+            return
+
+        statuses = connections.get_statuses(self.dmd, missing)
+        for entity, status in statuses.iteritems():
+            self.set_status(entity, bool(status))
+
     def set_status(self, entity, status, asof=None):
         """Set status of entity: True if up, False if down.
 
@@ -432,13 +825,47 @@ class Suppressor(object):
         expire after a certain amount of time. See status_cache in the
         clear_caches method for how long.
 
+        Device statuses are also recorded in the status index.
+
         """
+        self.status_index.set(entity, status, asof=asof)
+        self.cache_status(entity, status, asof=asof)
+
+    def cache_status(self, entity, status, asof=None):
+        """Set status of entity in status_cache, tracking flips."""
         self.status_cache.set(
             key=entity,
             value=status,
             asof=asof,
             set_fn=self.status_set_fn)
 
+        # The index has the newest status of entities it covers. These
+        # aren't lookups, so they're left out of hit ratios.
+        status = self.status_index.peek(entity)
+        if status is None:
+            status = self.status_cache.peek(entity)
+
+        self.track_status(entity, status)
+
+    def track_status(self, entity, status):
+        """Record status of entity, invalidating root causes if it flipped.
+
+        Every status root causes are found from must be recorded here.
+        Otherwise its first flip won't invalidate memoized root causes.
+
+        """
+        if status is None:
+            return
+
+        previous = self.last_statuses.get(entity)
+        if previous != status:
+            if previous is not None:
+                for _, tree in self.dominators_cache.values():
+                    if entity in tree.transit:
+                        tree.epoch += 1
+
+            self.last_statuses[entity] = status
+
     @staticmethod
     def status_set_fn(old_time, old_value, new_time, new_value):
         """Custom set function for status_cache.
@@ -455,23 +882,6 @@ class Suppressor(object):
 
         return (old_time, old_value)
 
-    def get_neighbors(self, entity):
-        """Return iterator of neighbors for entity.
-
-        This behaves as a standard read-through cache to
-        connections.get_layer2_neighbors().
-
-        Cached entries expire after a certain amount of time. See
-        neighbors_cache in the clear_caches method for how long.
-
-        """
-        neighbors = self.neighbors_cache.get(entity)
-        if neighbors is None:
-            neighbors = connections.get_layer2_neighbors(entity)
-            self.neighbors_cache.set(entity, neighbors)
-
-        return iter(neighbors)
-
     def get_paths(self, source_entity, target_entities):
         """Return list of cached paths from source to targets.
 
@@ -484,6 +894,9 @@ class Suppressor(object):
         and there were no paths found.
 
         """
+        # Forget paths in changed components first.
+        self.components.check(time.time())
+
         paths = []
         for target_entity in target_entities:
             target_paths = self.paths_cache.get((source_entity, target_entity))
@@ -495,24 +908,29 @@ class Suppressor(object):
             return paths
 
     def get_graph(self, entity):
-        """Return full networkx.Graph starting at entity.
+        """Return full networkx.Graph of the component containing entity.
 
         This behaves as a read-through cache to connections.networkx_graph().
-        
-        Cached entries expire after a certain amount of time. See
-        gateways_cache in the clear_caches method for how long.
+        Each connected component's graph is cached once, and shared by
+        all of its entities.
+
+        Cached components expire after a certain amount of time, or when
+        edges of any of their nodes change. See components in the
+        clear_caches method for how long.
+
+        The shared cache's Snapshot of the whole graph is returned
+        instead if it's current and contains entity.
 
         """
-        # Maybe a graph is already cached for entity.
-        cached_graph = self.graphs_cache.get(entity)
-        if cached_graph:
-            return cached_graph
+        snapshot = self.shared.get()
+        if snapshot is not None and entity in snapshot:
+            return snapshot
 
-        # Maybe entity exists in a graph cached for a different entity.
-        for g in self.graphs_cache.values():
-            if g and entity in g:
-                return g
+        return self.components.get(entity, self.build_graph)
 
+    @timed("graph")
+    def build_graph(self, entity):
+        """Return full networkx.Graph starting at entity."""
         # I don't know how big these graphs can get. So it's important to
         # log when we're building graphs, how long it takes, and how much
         # memory caching them is going to consume.
@@ -534,18 +952,514 @@ class Suppressor(object):
             convToUnits(number=size, divby=1024.0, unitstr="B"),
             elapsed)
 
-        self.graphs_cache.set(entity, g)
         return g
 
 
+def shortest_path_distances(g, target, source=None):
+    """Return map of nodes in g to their distance in hops from target.
+
+    The breadth-first search stops once source is reached. At that point
+    every node closer to target than source has its distance mapped,
+    which is all shortest_paths needs to find paths from source.
+
+    """
+    distances = {target: 0}
+    queue = collections.deque([target])
+
+    while queue:
+        node = queue.popleft()
+        distance = distances[node] + 1
+        for neighbor in g[node]:
+            if neighbor not in distances:
+                distances[neighbor] = distance
+                if neighbor == source:
+                    return distances
+
+                queue.append(neighbor)
+
+    return distances
+
+
+def next_hops(g, node, distances):
+    """Return sorted neighbors of node one hop closer to the target."""
+    distance = distances[node] - 1
+    return sorted(x for x in g[node] if distances.get(x) == distance)
+
+
+def shortest_paths(g, source, distances):
+    """Generate every shortest path in g from source to the target.
+
+    distances must be as returned by shortest_path_distances for the
+    target. Each path is a list of nodes starting with source and ending
+    with the target. Paths are generated by walking the predecessor DAG
+    that the distances define, so only shortest paths are ever visited.
+
+    """
+    if source not in distances:
+        return
+
+    path = [source]
+    stack = [iter(next_hops(g, source, distances))]
+
+    while stack:
+        if distances[path[-1]] == 0:
+            yield list(path)
+            path.pop()
+            stack.pop()
+            continue
+
+        node = next(stack[-1], None)
+        if node is None:
+            path.pop()
+            stack.pop()
+            continue
+
+        path.append(node)
+        stack.append(iter(next_hops(g, node, distances)))
+
+
+def count_shortest_paths(g, source, distances):
+    """Return number of shortest paths in g from source to the target.
+
+    Paths are counted without being enumerated, so this is cheap even
+    when there are too many paths to generate.
+
+    """
+    if source not in distances:
+        return 0
+
+    counts = {}
+    for node in sorted(
+            (x for x in distances if distances[x] <= distances[source]),
+            key=distances.get):
+        if distances[node] == 0:
+            counts[node] = 1
+        else:
+            counts[node] = sum(
+                counts[x] for x in g[node]
+                if distances.get(x) == distances[node] - 1)
+
+    return counts[source]
+
+
+class DominatorTree(object):
+    """Dominators in the DAG of shortest paths from root.
+
+    A node's dominators are the nodes that every shortest path from
+    root to it goes through. The tree is built in one pass over the
+    nodes in order of distance from root. Each node's immediate
+    dominator is the nearest common dominator of its next hops toward
+    root.
+
+    """
+
+    # Serial numbers distinguish trees in cache keys.
+    serials = itertools.count()
+
+    def __init__(self, g, root):
+        self.root = root
+        self.idoms = {}
+        self.depths = {}
+        self.distances = {}
+
+        # node -> entity every path from node reaches first, or None.
+        self.anchors = {}
+
+        # Entities that are next hops of other nodes.
+        self.transit = set()
+
+        # Bumped when a status of a transit entity flips.
+        self.serial = next(self.serials)
+        self.epoch = 0
+
+        if root not in g:
+            return
+
+        distances = shortest_path_distances(g, root)
+        self.distances = distances
+        self.idoms[root] = None
+        self.depths[root] = 0
+
+        for node in sorted(distances, key=distances.get):
+            if node == root:
+                continue
+
+            distance = distances[node] - 1
+            idom = None
+            anchors = set()
+            for neighbor in g[node]:
+                if distances.get(neighbor) == distance:
+                    if idom is None:
+                        idom = neighbor
+                    else:
+                        idom = self.common_dominator(idom, neighbor)
+
+                    if neighbor.startswith("/"):
+                        anchors.add(neighbor)
+                        self.transit.add(neighbor)
+                    else:
+                        anchors.add(self.anchors.get(neighbor))
+
+            self.idoms[node] = idom
+            self.depths[node] = self.depths[idom] + 1
+            if len(anchors) == 1:
+                self.anchors[node] = anchors.pop()
+
+    def __contains__(self, node):
+        return node in self.idoms
+
+    def common_dominator(self, a, b):
+        """Return nearest node that dominates or is both a and b."""
+        while a != b:
+            if self.depths[a] >= self.depths[b]:
+                a = self.idoms[a]
+            else:
+                b = self.idoms[b]
+
+        return a
+
+    def dominators(self, node):
+        """Return list of node's dominators starting with root.
+
+        node itself isn't included. An empty list is returned if node
+        can't be reached from root.
+
+        """
+        chain = []
+        dominator = self.idoms.get(node)
+        while dominator is not None:
+            chain.append(dominator)
+            dominator = self.idoms[dominator]
+
+        chain.reverse()
+        return chain
+
+    def leading_dominators(self, node):
+        """Return node's dominators that every shortest path starts with.
+
+        These are the dominators starting with root up to the first that
+        isn't adjacent to the one before it. Shortest paths don't go
+        through any other nodes before reaching them.
+
+        """
+        leading = []
+        for distance, dominator in enumerate(self.dominators(node)):
+            if self.distances.get(dominator) != distance:
+                break
+
+            leading.append(dominator)
+
+        return leading
+
+
+class StatusIndex(object):
+    """Authoritative set of devices that are ping down.
+
+    The set is seeded by the first reconciliation with ZEP, then kept up
+    to date with set as ping events are seen. It's reconciled with ZEP
+    again every reconcile_seconds in case events were missed. Statuses
+    set within grace_seconds of a reconciliation take precedence over
+    ZEP.
+
+    Only device statuses are indexed. get returns None for any other
+    entity, and for devices until the index is seeded.
+
+    """
+
+    def __init__(self, reconcile_seconds, grace_seconds):
+        self.reconcile_seconds = reconcile_seconds
+        self.grace_seconds = grace_seconds
+
+        self.seeded = False
+        self.reconciled = 0
+        self.down = set()
+
+        # entity -> (asof, status) set since the last reconciliation.
+        self.updated = {}
+
+        # Lookups of covered entities, and whether they were answered.
+        self.hits = 0
+        self.misses = 0
+
+    def covers(self, entity):
+        """Return True if entity's status is indexed."""
+        return DEVICE_PATH_REGEX.match(entity) is not None
+
+    def get(self, entity):
+        """Return status of entity: True if up, False if down, or None."""
+        status = self.peek(entity)
+        if status is not None:
+            self.hits += 1
+        elif self.covers(entity):
+            self.misses += 1
+
+        return status
+
+    def peek(self, entity):
+        """Return status of entity like get without counting a lookup."""
+        if not self.seeded or not self.covers(entity):
+            return None
+
+        return entity not in self.down
+
+    def set(self, entity, status, asof=None):
+        """Set status of entity unless a newer status is already set."""
+        if not self.covers(entity):
+            return
+
+        if asof is None:
+            asof = time.time()
+
+        previous = self.updated.get(entity)
+        if previous and previous[0] > asof:
+            return
+
+        self.updated[entity] = (asof, status)
+        if status:
+            self.down.discard(entity)
+        else:
+            self.down.add(entity)
+
+    def is_due(self, now):
+        """Return True if reconciliation is due."""
+        return self.reconciled + self.reconcile_seconds <= now
+
+    def reconcile(self, down, now, asof=None):
+        """Replace down set with down, and return changed statuses.
+
+        down is the set of entities ZEP considers down, or None if
+        ZEP couldn't be queried. asof is when down was current if not
+        now. The returned dict maps entities whose status changed to
+        their new status.
+
+        """
+        self.reconciled = now
+        if down is None:
+            return {}
+
+        down = set(down)
+        cutoff = (now if asof is None else asof) - self.grace_seconds
+        for entity, (asof, status) in self.updated.items():
+            if asof < cutoff:
+                del self.updated[entity]
+            elif status:
+                down.discard(entity)
+            else:
+                down.add(entity)
+
+        changes = dict.fromkeys(down - self.down, DOWN)
+        if self.seeded:
+            changes.update(dict.fromkeys(self.down - down, UP))
+
+        self.down = down
+        self.seeded = True
+        return changes
+
+    def stats(self):
+        """Return dict of hits, misses and size (count of down devices)."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.down),
+            }
+
+
+class ComponentRegistry(object):
+    """Cache of connected component graphs indexed by their nodes.
+
+    Every node of a cached component maps to the component's ID, so
+    finding the graph containing a node is O(1) and no component is
+    cached more than once. Components are removed as a unit when they
+    expire, when edges of any of their nodes change, or least recently
+    used first when there are more than size of them.
+
+    Nodes that aren't in the graph built for them are cached as absent
+    the same way, so they aren't built again on every lookup.
+
+    Other cached data can depend on a component. remove_fn is called
+    with the keys it depends on when the component is removed.
+
+    """
+
+    def __init__(self, seconds, size, absent_size, check_seconds,
+                 changes_fn=None, remove_fn=None):
+        """Initialize registry.
+
+        Set seconds to seconds before expiration, size to the most
+        components to keep, absent_size to the most absent nodes to
+        keep, and check_seconds to the seconds between checks of which
+        nodes' edges changed.
+
+        """
+        self.seconds = seconds
+        self.size = size
+        self.check_seconds = check_seconds
+        self.changes_fn = changes_fn or connections.get_changes
+        self.remove_fn = remove_fn
+
+        # component ID -> (added, graph, dependent keys) from least to
+        # most recently used.
+        self.components = collections.OrderedDict()
+
+        # node -> component ID
+        self.component_ids = {}
+
+        # node -> graph built for node that doesn't contain it.
+        self.absent = ExpiringCache(seconds, size=absent_size)
+
+        self.next_id = itertools.count()
+        self.changes_id = None
+        self.checked = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.components)
+
+    def check(self, now):
+        """Remove components with changed nodes at most every check_seconds."""
+        if self.checked + self.check_seconds >= now:
+            return
+
+        self.checked = now
+        changes = self.changes_fn(self.changes_id)
+        if changes is None:
+            return
+
+        self.changes_id, nodes = changes
+        if nodes is None:
+            self.clear()
+        else:
+            self.invalidate(nodes)
+
+    def get(self, node, build_fn):
+        """Return graph of component containing node.
+
+        build_fn(node) is called to build the graph if no current
+        component contains node.
+
+        """
+        now = time.time()
+        self.check(now)
+
+        component_id = self.component_ids.get(node)
+        if component_id is not None:
+            entry = self.components.pop(component_id)
+            if entry[0] + self.seconds >= now:
+                # Reinsert to make component the most recently used.
+                self.components[component_id] = entry
+                self.hits += 1
+                return entry[1]
+
+            self.remove(component_id, entry)
+
+        graph = self.absent.get(node)
+        if graph is not None:
+            self.hits += 1
+            return graph
+
+        self.misses += 1
+        graph = build_fn(node)
+        if graph is not None:
+            if node in graph:
+                self.add(graph, now)
+            else:
+                self.absent.set(node, graph, asof=now)
+
+        return graph
+
+    def depend(self, node, key):
+        """Record that key depends on the component containing node."""
+        component_id = self.component_ids.get(node)
+        if component_id is not None:
+            self.components[component_id][2].add(key)
+
+    def add(self, graph, now):
+        """Add graph as a component."""
+        # A node can only be in one component. Remove any other that
+        # shares nodes with graph.
+        for node in graph:
+            component_id = self.component_ids.get(node)
+            if component_id is not None:
+                self.remove(component_id, self.components.pop(component_id))
+
+        component_id = next(self.next_id)
+        self.components[component_id] = (now, graph, set())
+        for node in graph:
+            self.component_ids[node] = component_id
+
+        while len(self.components) > self.size:
+            self.remove(*self.components.popitem(last=False))
+
+    def invalidate(self, nodes):
+        """Remove components containing, and absent entries of, nodes."""
+        for node in nodes:
+            self.absent.invalidate(node)
+            component_id = self.component_ids.get(node)
+            if component_id is not None:
+                self.remove(component_id, self.components.pop(component_id))
+
+    def clear(self):
+        """Remove all components and absent entries."""
+        while self.components:
+            self.remove(*self.components.popitem(last=False))
+
+        self.absent = ExpiringCache(self.absent.seconds, size=self.absent.size)
+
+    def remove(self, component_id, entry):
+        """Remove index entries of component already popped from components."""
+        for node in entry[1]:
+            if self.component_ids.get(node) == component_id:
+                del self.component_ids[node]
+
+        if entry[2] and self.remove_fn:
+            self.remove_fn(entry[2])
+
+    def stats(self):
+        """Return dict of hits, misses, components, nodes and absent."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "components": len(self.components),
+            "nodes": len(self.component_ids),
+            "absent": len(self.absent),
+            }
+
+
 class ExpiringCache(object):
-    """Cache where entries expire after a defined duration."""
+    """Cache where entries expire after a defined duration.
+
+    Entries are also evicted least recently used first when there are
+    more than size of them. get and set are O(1). Expired entries are
+    removed incrementally in order of age rather than by sweeping the
+    whole cache.
+
+    """
+
+    def __init__(self, seconds, size=None):
+        """Initialize cache.
+
+        Set seconds to seconds before expiration, and size to the most
+        entries to keep. There is no limit if size is None.
 
-    def __init__(self, seconds):
-        """Initialize cache. Set seconds to seconds before expiration."""
+        """
         self.seconds = seconds
-        self.data = {}
-        self.last_cleanse = time.time()
+        self.size = size
+
+        # key -> (added, value) ordered from least to most recently used.
+        self.data = collections.OrderedDict()
+
+        # (added, key) heap. Entries are stale if key has since been set.
+        self.expiry = []
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.data)
 
     def update(self, d, asof=None, set_fn=None):
         """Update the cache from a dict of keys and values.
@@ -579,40 +1493,199 @@ class ExpiringCache(object):
         else:
             new = (asof, value)
 
-        if new != old:
-            self.data[key] = new
+        if new == old:
+            return
+
+        # Reinsert to make key the most recently used.
+        self.data.pop(key, None)
+        self.data[key] = new
+        heapq.heappush(self.expiry, (new[0], key))
+
+        self.expire(time.time())
+
+        while self.size is not None and len(self.data) > self.size:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+        # Stale heap entries are only dropped as they reach the top, so
+        # rebuild the heap if they've come to dominate it.
+        if len(self.expiry) > 2 * len(self.data) + 64:
+            self.expiry = [(x[0], k) for k, x in self.data.iteritems()]
+            heapq.heapify(self.expiry)
+
+    def peek(self, key, default=None):
+        """Return current value of key without counting a lookup.
+
+        Unlike get, key doesn't become the most recently used.
+
+        """
+        entry = self.data.get(key)
+        if entry is None or entry[0] + self.seconds < time.time():
+            return default
+
+        return entry[1]
 
     def get(self, key, default=None):
         """Return current value of key from cache."""
-        now = time.time()
-        self.cleanse(now)
+        entry = self.data.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return default
 
-        try:
-            added, value = self.data[key]
-            if added + self.seconds < now:
-                self.invalidate(key)
-                return default
-            else:
-                return value
-        except KeyError:
+        if entry[0] + self.seconds < time.time():
+            self.expirations += 1
+            self.misses += 1
             return default
 
+        # Reinsert to make key the most recently used.
+        self.data[key] = entry
+        self.hits += 1
+        return entry[1]
+
     def invalidate(self, key):
         """Remove key from cache."""
-        try:
-            del self.data[key]
-        except Exception:
-            pass
-
-    def cleanse(self, asof):
-        """Remove all expired entries from cache."""
-        if self.last_cleanse + self.seconds < asof:
-            self.last_cleanse = asof
-            for key, (added, _) in self.data.items():
-                if added + self.seconds < asof:
-                    self.invalidate(key)
+        self.data.pop(key, None)
+
+    def expire(self, asof):
+        """Remove entries that expired as of asof, oldest first."""
+        cutoff = asof - self.seconds
+        while self.expiry and self.expiry[0][0] < cutoff:
+            added, key = heapq.heappop(self.expiry)
+            entry = self.data.get(key)
+            if entry is not None and entry[0] == added:
+                del self.data[key]
+                self.expirations += 1
 
     def values(self):
-        """Generate all values in cache."""
-        for key in self.data.iterkeys():
-            yield self.get(key)
+        """Generate all unexpired values in cache."""
+        cutoff = time.time() - self.seconds
+        for added, value in self.data.values():
+            if added >= cutoff:
+                yield value
+
+    def stats(self):
+        """Return dict of hits, misses, evictions, expirations and size."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "size": len(self.data),
+            }
+
+
+class PhaseTimer(object):
+    """Times phases of event processing.
+
+    Each phase's durations update a Metrology timer named
+    suppression-<phase>. Phases may nest, and a phase's duration
+    includes that of phases nested in it.
+
+    The outermost phase is a trace. Durations and counts of each phase
+    are totalled per trace. A sample_rate fraction of traces taking at
+    least slow_seconds are logged to TRACE_LOG with those totals.
+
+    """
+
+    def __init__(self, slow_seconds=None, sample_rate=1.0):
+        """Initialize timer.
+
+        Set slow_seconds to None to disable tracing of slow events.
+
+        """
+        self.slow_seconds = slow_seconds
+        self.sample_rate = sample_rate
+        self.timers = {}
+        self.depth = 0
+
+        # Totals for the current or last trace.
+        self.durations = collections.defaultdict(float)
+        self.counts = collections.Counter()
+        self.description = None
+
+        # Slow traces since one was logged.
+        self.slow = 0
+
+    def get_timer(self, phase):
+        """Return Metrology timer for phase."""
+        timer = self.timers.get(phase)
+        if timer is None:
+            timer = self.timers[phase] = Metrology.timer(
+                "suppression-{}".format(phase))
+
+        return timer
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        """Time the with block as phase."""
+        if self.depth == 0:
+            self.durations.clear()
+            self.counts.clear()
+            self.description = None
+
+        self.depth += 1
+        start = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - start
+            self.depth -= 1
+            self.get_timer(phase).update(duration)
+            self.durations[phase] += duration
+            self.counts[phase] += 1
+
+            if self.depth == 0:
+                self.trace(phase, duration)
+
+    def describe(self, description):
+        """Set description of current trace to log if it's slow."""
+        self.description = description
+
+    def trace(self, phase, duration):
+        """Log totals of trace that took duration if sampled and slow."""
+        if self.slow_seconds is None or duration < self.slow_seconds:
+            return
+
+        self.slow += 1
+        if random.random() >= self.sample_rate:
+            return
+
+        TRACE_LOG.info(
+            "slow %s took %.3fs (%s slow since last trace): %s [%s]",
+            phase,
+            duration,
+            self.slow,
+            self.description or "no description",
+            ", ".join(
+                "{}={:.3f}s/{}".format(x, self.durations[x], self.counts[x])
+                for x in sorted(
+                    self.durations,
+                    key=self.durations.get,
+                    reverse=True)))
+
+        self.slow = 0
+
+
+class CacheHitRatioGauge(Gauge):
+    """Metrology gauge for the hit ratio of a Suppressor cache."""
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def value(self):
+        if not SUPPRESSOR:
+            return 0.0
+
+        stats = SUPPRESSOR.cache_stats()[self.name]
+        lookups = stats["hits"] + stats["misses"]
+        if not lookups:
+            return 0.0
+
+        return float(stats["hits"]) / lookups
+
+
+for _name in METERED_CACHES + ("components", "status_index"):
+    Metrology.gauge(
+        "suppression-{}-hit-ratio".format(_name.replace("_", "-")),
+        CacheHitRatioGauge(_name))
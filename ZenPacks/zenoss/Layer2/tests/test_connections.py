@@ -0,0 +1,202 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Test cases for connections module."""
+
+# stdlib imports
+import unittest
+
+# third-party imports
+import networkx
+from mock import Mock, patch
+
+# zenpack imports
+from ZenPacks.zenoss.Layer2.connections import (
+    GraphCache,
+    LayerCatalog,
+    update_layer2_neighbors,
+    )
+
+
+class TestGraphCache(unittest.TestCase):
+    """GraphCache class tests."""
+
+    def setUp(self):
+        super(TestGraphCache, self).setUp()
+        self.cache = GraphCache(
+            size=2, nodes=4, seconds=300, unversioned_seconds=30,
+            check_seconds=10)
+        self.graph = networkx.Graph()
+        self.graph.add_edge("a", "b")
+
+    def test_version(self):
+        self.cache.set("k", "v1", self.graph)
+        self.assertItemsEqual(self.cache.get("k", "v1").nodes(), ["a", "b"])
+        self.assertIsNone(self.cache.get("k", "v2"))
+        self.assertEqual(
+            self.cache.stats(),
+            {"hits": 1, "misses": 1, "size": 0, "nodes": 0})
+
+    def test_shared(self):
+        self.cache.set("k", "v1", self.graph)
+
+        # Graphs aren't copied in or out.
+        self.assertIs(self.cache.get("k", "v1"), self.graph)
+        self.assertIs(self.cache.get("k", "v1"), self.cache.get("k", "v1"))
+
+    def test_get_version(self):
+        version_fn = Mock(return_value="v1")
+        self.assertEqual(self.cache.get_version(version_fn), "v1")
+
+        # The version isn't checked again until check_seconds pass.
+        version_fn.return_value = "v2"
+        self.assertEqual(self.cache.get_version(version_fn), "v1")
+        self.assertEqual(version_fn.call_count, 1)
+
+        self.cache.checked -= 10
+        self.assertEqual(self.cache.get_version(version_fn), "v2")
+        self.assertEqual(version_fn.call_count, 2)
+
+    def test_lru(self):
+        for key in ("k1", "k2"):
+            self.cache.set(key, "v1", self.graph)
+
+        # k1 becomes more recently used than k2, and k2 is evicted.
+        self.cache.get("k1", "v1")
+        self.cache.set("k3", "v1", self.graph)
+        self.assertIsNone(self.cache.get("k2", "v1"))
+        self.assertIsNotNone(self.cache.get("k1", "v1"))
+
+    def test_nodes(self):
+        big = networkx.Graph()
+        big.add_edges_from([("a", "b"), ("b", "c")])
+        self.cache.set("k1", "v1", self.graph)
+        self.cache.set("k2", "v1", big)
+
+        # Nodes in all graphs are bounded, not only the number of graphs.
+        self.assertIsNone(self.cache.get("k1", "v1"))
+        self.assertEqual(self.cache.stats()["nodes"], 3)
+
+        # Graphs larger than the bound aren't cached at all.
+        big.add_edges_from([("c", "d"), ("d", "e")])
+        self.cache.set("k3", "v1", big)
+        self.assertIsNone(self.cache.get("k3", "v1"))
+        self.assertIsNotNone(self.cache.get("k2", "v1"))
+
+    def test_expiration(self):
+        self.cache.set("k1", "v1", self.graph)
+        self.cache.set("k2", None, self.graph)
+
+        # Age both entries by a minute.
+        for key, (added, version, graph) in self.cache.data.items():
+            self.cache.data[key] = (added - 60, version, graph)
+
+        # Unversioned entries expire sooner.
+        self.assertIsNotNone(self.cache.get("k1", "v1"))
+        self.assertIsNone(self.cache.get("k2", None))
+
+
+class TestLayerCatalog(unittest.TestCase):
+    """LayerCatalog class tests."""
+
+    def setUp(self):
+        super(TestLayerCatalog, self).setUp()
+        self.graph = Mock()
+        self.graph.get_version.return_value = "v1"
+        self.graph.get_layer_counts.return_value = {
+            "layer2": 3, "vlan1": 1, "cdp": 2}
+
+        patcher = patch(
+            "ZenPacks.zenoss.Layer2.connections.get_graph",
+            return_value=self.graph)
+
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.catalog = LayerCatalog(check_seconds=300)
+
+    def test_refresh(self):
+        self.catalog.refresh()
+        self.assertEqual(self.catalog.layers, ["cdp", "layer2", "vlan1"])
+        self.assertEqual(self.catalog.default_layers, {"cdp", "layer2"})
+        self.assertEqual(self.catalog.counts["layer2"], 3)
+
+        # The version isn't checked again until check_seconds pass.
+        self.catalog.refresh()
+        self.assertEqual(self.graph.get_version.call_count, 1)
+
+    def test_invalidate(self):
+        self.catalog.refresh()
+
+        # An unchanged version doesn't reload layers.
+        self.catalog.invalidate()
+        self.catalog.refresh()
+        self.assertEqual(self.graph.get_version.call_count, 2)
+        self.assertEqual(self.graph.get_layer_counts.call_count, 1)
+
+        # A changed version does.
+        self.graph.get_version.return_value = "v2"
+        self.graph.get_layer_counts.return_value = {"layer2": 1}
+        self.catalog.invalidate()
+        self.catalog.refresh()
+        self.assertEqual(self.catalog.layers, ["layer2"])
+
+    def test_unversioned(self):
+        self.graph.get_version.return_value = None
+        self.catalog.refresh()
+
+        # Layers of a graph without a version are loaded once.
+        self.catalog.invalidate()
+        self.catalog.refresh()
+        self.assertEqual(self.graph.get_layer_counts.call_count, 1)
+
+        # Recording a version reloads them.
+        self.graph.get_version.return_value = "v1"
+        self.catalog.invalidate()
+        self.catalog.refresh()
+        self.assertEqual(self.graph.get_layer_counts.call_count, 2)
+
+
+class TestUpdateLayer2Neighbors(unittest.TestCase):
+    """update_layer2_neighbors function tests."""
+
+    def setUp(self):
+        super(TestUpdateLayer2Neighbors, self).setUp()
+        nxg = networkx.Graph()
+        nxg.add_edges_from([("/d1", "m1"), ("m1", "/d2")])
+
+        self.graph = Mock()
+        self.graph.get_reachable.return_value = {"/d1", "m1", "/d2"}
+        self.graph.get_referrers.return_value = set()
+        self.graph.networkx_graph.return_value = nxg
+
+        patcher = patch(
+            "ZenPacks.zenoss.Layer2.connections.get_graph",
+            return_value=self.graph)
+
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.rows = [("/d1", "m1", "layer2")]
+
+    def test_unchanged(self):
+        self.graph.get_version.return_value = "v1"
+        update_layer2_neighbors(self.rows)
+
+        neighbors = self.graph.set_neighbors.call_args[0][0]
+        self.assertItemsEqual(neighbors["/d1"], ["/d2"])
+        self.assertFalse(self.graph.discard_neighbors.called)
+
+    def test_changed(self):
+        # Another writer changed edges while neighbors were found.
+        self.graph.get_version.side_effect = ["v1", "v2"]
+        update_layer2_neighbors(self.rows)
+
+        self.assertFalse(self.graph.set_neighbors.called)
+        self.graph.discard_neighbors.assert_called_once_with({"/d1", "/d2"})
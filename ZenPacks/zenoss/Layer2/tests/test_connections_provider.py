@@ -0,0 +1,124 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Test cases for connections_provider module."""
+
+# stdlib imports
+import unittest
+
+# third-party imports
+from mock import Mock, patch
+
+# zenpack imports
+from ZenPacks.zenoss.Layer2 import connections_provider
+from ZenPacks.zenoss.Layer2.connections_provider import (
+    DeviceConnectionsProvider,
+    InterfaceIndex,
+    INTERFACE_INDEX_ATTR,
+    get_device_statuses,
+    get_interface_index,
+    get_interface_index_stamp,
+    get_ping_down_uuids,
+    )
+
+
+def ping_event(uuid):
+    return {"occurrence": [{"actor": {"element_uuid": uuid}}]}
+
+
+def summaries(pages):
+    """Return getEventSummaries mock returning pages of UUIDs.
+
+    Events are returned as generators like the ZEP facade does.
+
+    """
+    total = sum(len(x) for x in pages)
+    results = []
+    offset = 0
+    for page in pages:
+        offset += len(page)
+        results.append({
+            "events": (ping_event(x) for x in page),
+            "total": total,
+            "next_offset": offset if offset < total else None,
+            })
+
+    return Mock(side_effect=results)
+
+
+class TestDeviceStatuses(unittest.TestCase):
+    """connections_provider device status tests."""
+
+    def setUp(self):
+        super(TestDeviceStatuses, self).setUp()
+        self.zep = Mock()
+
+        patcher = patch.object(
+            connections_provider, "getFacade", return_value=self.zep)
+
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_generator(self):
+        self.zep.getEventSummaries = summaries([["u1", "u2"], ["u3"]])
+        self.assertEqual(get_ping_down_uuids(self.zep), {"u1", "u2", "u3"})
+        self.assertEqual(self.zep.getEventSummaries.call_count, 2)
+        self.assertEqual(self.zep.getEventSummaries.call_args[0], (2,))
+
+    def test_statuses(self):
+        self.zep.getEventSummaries = summaries([["u1"]])
+        self.assertEqual(
+            get_device_statuses(Mock(), ["u1", "u2"]),
+            {"u1": False, "u2": True})
+
+    def test_single_device(self):
+        self.zep.getEventSummaries.return_value = {"events": [], "total": 1}
+        device = Mock()
+        device.getUUID.return_value = "u1"
+
+        self.assertIs(DeviceConnectionsProvider(device).get_status(), False)
+
+        # One device's status is only counted, not fetched.
+        self.assertEqual(
+            self.zep.getEventSummaries.call_args[1]["limit"], 0)
+
+
+class TestInterfaceIndex(unittest.TestCase):
+    """connections_provider interface index tests."""
+
+    def setUp(self):
+        super(TestInterfaceIndex, self).setUp()
+        self.device = Mock()
+        self.device.getPrimaryId.return_value = "/devices/d1"
+        self.device.getLastChange.return_value.micros.return_value = 1
+        self.device.os.interfaces.objectIds.return_value = ["eth0"]
+
+        self.rows = (("/devices/d1/os/interfaces/eth0", "m1", (), (), ()),)
+        index = InterfaceIndex()
+        index.update(get_interface_index_stamp(self.device), self.rows)
+        setattr(self.device, INTERFACE_INDEX_ATTR, index)
+
+    def test_interfaces_changed(self):
+        self.assertEqual(get_interface_index(self.device), self.rows)
+
+        # Interfaces can be added without changing the device.
+        self.device.os.interfaces.objectIds.return_value = ["eth0", "eth1"]
+        self.assertIsNone(get_interface_index(self.device))
+
+    def test_use_index(self):
+        provider = DeviceConnectionsProvider(self.device)
+        with patch.object(
+                connections_provider, "interface_index_rows",
+                return_value=[]) as interface_index_rows:
+            self.assertEqual(len(list(provider.get_connections())), 3)
+
+            # Forced updates load interfaces.
+            provider.use_index = False
+            self.assertEqual(list(provider.get_connections()), [])
+            self.assertEqual(interface_index_rows.call_count, 1)
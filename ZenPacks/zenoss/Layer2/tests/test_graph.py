@@ -14,7 +14,7 @@ import time
 import unittest
 
 # zenpack imports
-from ZenPacks.zenoss.Layer2.graph import get_graph
+from ZenPacks.zenoss.Layer2.graph import LAYERS_VERSION, get_graph
 from ZenPacks.zenoss.Layer2.graph import MySQL
 
 
@@ -197,6 +197,175 @@ class TestGraph(unittest.TestCase):
             self.graph.get_layers(),
             {"cdp", "layer2", "layer3"})
 
+    def test_get_layer_counts(self):
+        provider = self.graph.get_provider("p1")
+        provider.update_edges([
+            ("s1", "t1", ["layer1", "layer2"]),
+            ("s1", "t2", ["layer1"]),
+            ], 1)
+
+        version = self.graph.get_version(LAYERS_VERSION)
+        self.assertIsNotNone(version)
+        self.assertEqual(
+            self.graph.get_layer_counts(),
+            {"layer1": 2, "layer2": 1})
+
+        # Existing layers don't change the layers version.
+        self.graph.get_provider("p2").update_edges(
+            [("s2", "t2", ["layer2"])], 1)
+        self.assertEqual(self.graph.get_version(LAYERS_VERSION), version)
+
+        # Layers without edges are counted as 0.
+        provider.update_edges([("s1", "t1", ["layer3"])], 2)
+        self.assertNotEqual(self.graph.get_version(LAYERS_VERSION), version)
+        self.assertEqual(
+            self.graph.get_layer_counts(),
+            {"layer1": 0, "layer2": 1, "layer3": 1})
+
+        # Removing an edge leaves other providers' copies of it.
+        self.graph.get_provider("p2").update_edges(
+            [("s1", "t1", ["layer3"])], 2)
+        provider.update_edges([], 3)
+        self.assertEqual(
+            self.graph.get_layer_counts(),
+            {"layer1": 0, "layer2": 0, "layer3": 1})
+        self.assertEqual(self.graph.count_edges(), 1)
+
+        # Clearing and compacting providers removes their counts.
+        provider.update_edges([("s1", "t1", ["layer1"])], 4)
+        provider.clear()
+        self.assertEqual(self.graph.get_layer_counts()["layer1"], 0)
+        self.graph.compact(["p1"])
+        self.assertEqual(self.graph.get_layer_counts()["layer3"], 0)
+
+    def test_get_neighbors_by_prefix(self):
+        create_topology(self.graph)
+
+        # Neighbors are found whichever end of the edge they're on.
+        self.assertEqual(
+            self.graph.get_neighbors_by_prefix(
+                ["h1", "h2", "n1"], "layer2", "sw"),
+            {"h1": {"sw1", "sw2"}, "h2": {"sw1", "sw2"}})
+
+        self.assertEqual(
+            self.graph.get_neighbors_by_prefix(["sw1"], "cdp", "r"),
+            {"sw1": {"r1", "r2"}})
+
+    def test_get_rows(self):
+        edges = (x for x in [
+            ("s1", "t1", ("layer1", "layer2")),
+            ("t1", "s1", ("layer1",)),
+            ("s1", "", ("layer1",)),
+            ])
+
+        rows = self.graph.get_provider("p1").get_rows(edges)
+        self.assertEqual(
+            rows.rows,
+            {("s1", "t1", "layer1"), ("s1", "t1", "layer2")})
+        self.assertEqual(rows.layers, {"layer1", "layer2"})
+        self.assertEqual(rows.nodes, {"s1", "t1"})
+
+        # Rows can be passed where edges are expected.
+        self.assertIs(self.graph.get_provider("p1").get_rows(rows), rows)
+        self.graph.get_provider("p1").update_edges(rows, 1)
+        self.assertEqual(self.graph.count_edges(), 1)
+
+    def test_version(self):
+        self.graph.bump_version()
+        version = self.graph.get_version()
+        self.assertIsNotNone(version)
+
+        # Unchanged edges don't change the version.
+        provider = self.graph.get_provider("p1")
+        provider.update_edges([("s1", "t1", ["layer1"])], 1)
+        version = self.graph.get_version()
+        provider.update_edges([("s1", "t1", ["layer1"])], 2)
+        self.assertEqual(self.graph.get_version(), version)
+
+        provider.update_edges([("s1", "t2", ["layer1"])], 3)
+        self.assertNotEqual(self.graph.get_version(), version)
+
+    def test_changes(self):
+        provider = self.graph.get_provider("p1")
+        provider.update_edges([("s1", "t1", ["layer1"])], 1)
+        last, nodes = self.graph.get_changes(None)
+        self.assertEqual(nodes, set())
+
+        # Only nodes of changed edges are reported.
+        provider.update_edges(
+            [("s1", "t1", ["layer1"]), ("s2", "t2", ["layer1"])], 2)
+        last, nodes = self.graph.get_changes(last)
+        self.assertEqual(nodes, {"s2", "t2"})
+        self.assertEqual(self.graph.get_changes(last), (last, set()))
+
+        # Clearing a provider may change any node.
+        provider.clear()
+        self.assertIsNone(self.graph.get_changes(last)[1])
+
+        # So does missing pruned changes.
+        provider.update_edges([("s3", "t3", ["layer1"])], 3)
+        provider.update_edges([("s4", "t4", ["layer1"])], 4)
+        last, _ = self.graph.get_changes(None)
+        self.graph.prune_changes(keep=2)
+        self.assertEqual(
+            self.graph.get_changes(last - 2), (last, {"s4", "t4"}))
+        self.assertIsNone(self.graph.get_changes(last - 4)[1])
+
+    def test_get_reachable(self):
+        create_topology(self.graph)
+
+        self.assertEqual(
+            self.graph.get_reachable(["h1"], ["layer2"], 1),
+            {"h1", "sw1", "sw2"})
+
+        self.assertEqual(
+            self.graph.get_reachable(["h1", "n1"], ["layer3"], 2),
+            {"h1", "h2", "n1", "r1", "r2", "n2"})
+
+    def test_get_layer_edges(self):
+        create_topology(self.graph)
+
+        self.assertEqual(
+            self.graph.get_layer_edges("cdp"),
+            {("sw1", "r1"), ("sw1", "r2"), ("sw2", "r1"), ("sw2", "r2"),
+             ("r1", "sw1"), ("r1", "sw2"), ("r2", "sw1"), ("r2", "sw2")})
+
+        self.assertEqual(self.graph.get_layer_edges("unknown"), set())
+
+    def test_stored_neighbors(self):
+        create_topology(self.graph)
+        self.assertIsNone(self.graph.get_stored_neighbors("h1"))
+
+        # Empty neighbors are stored too. Unknown nodes are ignored.
+        self.graph.set_neighbors({
+            "h1": ["sw1", "sw2", "unknown"],
+            "h2": [],
+            "unknown": ["sw1"]})
+
+        self.assertItemsEqual(
+            self.graph.get_stored_neighbors("h1"), ["sw1", "sw2"])
+        self.assertEqual(self.graph.get_stored_neighbors("h2"), [])
+        self.assertIsNone(self.graph.get_stored_neighbors("unknown"))
+        self.assertEqual(self.graph.get_referrers(["sw2"]), {"h1"})
+
+        # Storing again replaces.
+        self.graph.set_neighbors({"h1": ["sw1"]})
+        self.assertEqual(self.graph.get_stored_neighbors("h1"), ["sw1"])
+
+        # Discarding leaves them unstored.
+        self.graph.discard_neighbors(["h1", "unknown"])
+        self.assertIsNone(self.graph.get_stored_neighbors("h1"))
+        self.assertEqual(self.graph.get_stored_neighbors("h2"), [])
+
+    def test_get_unstored_nodes(self):
+        create_topology(self.graph)
+        self.graph.set_neighbors({"h1": ["sw1"]})
+
+        # Nodes not in the graph can't be stored, so they're not listed.
+        self.assertEqual(
+            self.graph.get_unstored_nodes(["h1", "h2", "unknown"]),
+            {"h2"})
+
     def test_networkx_graph(self):
         create_topology(self.graph)
 
@@ -0,0 +1,84 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Test cases for macs module."""
+
+# stdlib imports
+import unittest
+
+# zenpack imports
+from ZenPacks.zenoss.Layer2 import macs
+
+
+class TestMacs(unittest.TestCase):
+    """macs module tests."""
+
+    def test_to_int(self):
+        value = 0x0123456789AB
+        self.assertEqual(macs.to_int("01:23:45:67:89:ab"), value)
+        self.assertEqual(macs.to_int("01-23-45-67-89-AB"), value)
+        self.assertEqual(macs.to_int("0123.4567.89ab"), value)
+        self.assertEqual(macs.to_int(" 0123456789AB "), value)
+        self.assertEqual(macs.to_int(u"01:23:45:67:89:AB"), value)
+        self.assertEqual(macs.to_int("01 23 45 67 89 ab"), value)
+        self.assertEqual(macs.to_int("1:23:45:67:89:ab"), value)
+
+    def test_to_int_invalid(self):
+        for mac in (None, "", "foo", "01:23:45:67:89", "0x23456789AB",
+                    "01:23:45:67:89:AB:CD", u"01:23:45:67:89:\xe9\xe9", 42,
+                    "01:23:45:67:89:AB\n", "01:23-45:67:89:AB",
+                    "0123:4567:89AB", "01:23:45:67:89:ABC", "1.2.3.4.5.6"):
+            self.assertIsNone(macs.to_int(mac), mac)
+
+    def test_to_str(self):
+        self.assertEqual(macs.to_str(0x0123456789AB), "01:23:45:67:89:AB")
+        self.assertEqual(macs.to_str(macs.NULL_MAC), macs.NULL_MAC_STR)
+
+    def test_normalize(self):
+        self.assertEqual(macs.normalize("0123.4567.89ab"), "01:23:45:67:89:AB")
+        self.assertEqual(macs.normalize("0:1b:21:a:b:c"), "00:1B:21:0A:0B:0C")
+        self.assertIsNone(macs.normalize("bogus"))
+
+    def test_is_canonical(self):
+        self.assertTrue(macs.is_canonical("01:23:45:67:89:AB"))
+        self.assertTrue(macs.is_canonical("01:23:45:67:89:ab"))
+        self.assertFalse(macs.is_canonical("0123.4567.89ab"))
+        self.assertFalse(macs.is_canonical("/zport/dmd/Devices"))
+        self.assertFalse(macs.is_canonical("01:23:45:67:89:AB\n"))
+        self.assertFalse(macs.is_canonical(None))
+
+    def test_from_bytes(self):
+        self.assertEqual(
+            macs.from_bytes("\x01\x23\x45\x67\x89\xab"),
+            "01:23:45:67:89:AB")
+
+    def test_from_octets(self):
+        self.assertEqual(
+            macs.from_octets(["1", "35", "69", "103", "137", "171"]),
+            "01:23:45:67:89:AB")
+
+        self.assertRaises(ValueError, macs.from_octets, [1, 2, 3])
+        self.assertRaises(ValueError, macs.from_octets, [1, 2, 3, 4, 5, 256])
+
+    def test_normalize_all(self):
+        self.assertEqual(
+            macs.normalize_all([
+                "01:23:45:67:89:ab",
+                "01:23:45:67:89:AB",
+                "00:00:00:00:00:01",
+                "bogus",
+                ]),
+            ["00:00:00:00:00:01", "01:23:45:67:89:AB"])
+
+    def test_subtract(self):
+        self.assertEqual(
+            macs.subtract(
+                ["01:23:45:67:89:AB", "00:00:00:00:00:00"],
+                ["0000.0000.0000", "invalid_mac"]),
+            ["01:23:45:67:89:AB"])
@@ -0,0 +1,86 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Test cases for memory module."""
+
+# stdlib imports
+import unittest
+
+# zenpack imports
+from ZenPacks.zenoss.Layer2.memory import (
+    MemoryGovernor, OK, MINIMIZED, OVER, get_rss,
+    )
+
+
+class FakeConnection(object):
+    def __init__(self, rss, freed):
+        self.rss = rss
+        self.freed = freed
+        self.minimized = 0
+
+    def cacheMinimize(self):
+        self.minimized += 1
+        self.rss[0] -= self.freed
+
+
+class TestMemoryGovernor(unittest.TestCase):
+    """MemoryGovernor class tests."""
+
+    def governor(self, rss, now=None):
+        return MemoryGovernor(
+            budget=1000,
+            minimize_seconds=10,
+            rss_fn=lambda: rss[0],
+            time_fn=lambda: (now or [0])[0])
+
+    def test_get_rss(self):
+        self.assertGreater(get_rss(), 0)
+
+    def test_ok(self):
+        rss = [500]
+        connection = FakeConnection(rss, freed=0)
+        self.assertIs(self.governor(rss).check(connection), OK)
+        self.assertEqual(connection.minimized, 0)
+
+    def test_minimized(self):
+        rss = [900]
+        connection = FakeConnection(rss, freed=0)
+        self.assertIs(self.governor(rss).check(connection), MINIMIZED)
+        self.assertEqual(connection.minimized, 1)
+
+    def test_minimize_rate(self):
+        rss, now = [900], [100]
+        connection = FakeConnection(rss, freed=0)
+        governor = self.governor(rss, now)
+        self.assertIs(governor.check(connection), MINIMIZED)
+
+        # Caches aren't minimized again until minimize_seconds pass.
+        now[0] = 105
+        self.assertIs(governor.check(connection), MINIMIZED)
+        self.assertEqual(connection.minimized, 1)
+
+        now[0] = 110
+        governor.check(connection)
+        self.assertEqual(connection.minimized, 2)
+
+        # Unless the budget is exceeded.
+        rss[0] = 1100
+        governor.check(connection)
+        self.assertEqual(connection.minimized, 3)
+
+    def test_minimizing_avoids_over(self):
+        rss = [1100]
+        connection = FakeConnection(rss, freed=200)
+        self.assertIs(self.governor(rss).check(connection), MINIMIZED)
+
+    def test_over(self):
+        rss = [1100]
+        connection = FakeConnection(rss, freed=50)
+        self.assertIs(self.governor(rss).check(connection), OVER)
+        self.assertIs(self.governor(rss).check(), OVER)
@@ -0,0 +1,64 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Test cases for metrics module."""
+
+# stdlib imports
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+# zenpack imports
+from ZenPacks.zenoss.Layer2.metrics import (
+    CycleStats, CycleStatsGauge, MetricsPublisher,
+    )
+
+
+class TestMetrics(unittest.TestCase):
+    """CycleStats and MetricsPublisher class tests."""
+
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(TestMetrics, self).tearDown()
+
+    def test_cycle_stats(self):
+        stats = CycleStats()
+        stats.add(devices_checked=2, edges_added=10)
+        stats.add(devices_checked=1)
+        stats.observe_queue(3)
+        stats.observe_queue(1)
+
+        data = stats.as_dict()
+        self.assertEqual(data["devices_checked"], 3)
+        self.assertEqual(data["edges_added"], 10)
+        self.assertEqual(data["queue_depth"], 3)
+        self.assertEqual(data["devices_failed"], 0)
+
+    def test_publish(self):
+        filename = os.path.join(self.tmpdir, "zenmapper.json")
+        publisher = MetricsPublisher(filename=filename, tags={"worker": 1})
+
+        stats = CycleStats()
+        stats.add(devices_updated=5)
+        publisher.publish(stats)
+
+        # Gauges report the last published cycle.
+        self.assertEqual(CycleStatsGauge("devices_updated").value, 5)
+
+        with open(filename) as metrics_file:
+            data = json.load(metrics_file)
+
+        self.assertEqual(data["tags"], {"worker": 1})
+        self.assertEqual(data["metrics"]["devices_updated"], 5)
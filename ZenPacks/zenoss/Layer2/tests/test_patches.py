@@ -17,6 +17,10 @@ from Products.ZenTestCase.BaseTestCase import BaseTestCase
 
 import ZenPacks.zenoss.Layer2
 from ZenPacks.zenoss.Layer2 import connections
+from ZenPacks.zenoss.Layer2.connections_provider import (
+    INTERFACE_INDEX_ATTR, InterfaceIndex,
+    get_interface_index, update_interface_index,
+    )
 from ZenPacks.zenoss.Layer2.patches import get_ifinfo_for_layer2
 
 
@@ -80,9 +84,12 @@ class TestPatches(BaseTestCase):
                         "macaddress": eth0_mac,
                         "clientmacs": [client_mac]}])])
 
+        self.assertEqual(connections.get_queued(10), [])
+
+        # Interfaces are indexed regardless.
         self.assertEqual(
-            connections.get_device_by_mac(self.dmd, eth0_mac),
-            None)
+            [(x[1], x[2]) for x in get_interface_index(device)],
+            [(eth0_mac, (client_mac,))])
 
         # Test that enabling zL2UpdateOnModel works.
         device.setZenProperty("zL2UpdateOnModel", True)
@@ -99,9 +106,23 @@ class TestPatches(BaseTestCase):
                         "macaddress": eth0_mac,
                         "clientmacs": [client_mac]}])])
 
+        # Connections are left for zenmapper to update.
+        self.assertEqual(
+            [x[1] for x in connections.get_queued(10)],
+            [device.getPrimaryId()])
+
         self.assertEqual(
             connections.get_device_by_mac(self.dmd, eth0_mac),
-            device)
+            None)
+
+        # The index is kept in its own persistent object, not the device.
+        index = getattr(device, INTERFACE_INDEX_ATTR)
+        self.assertIsInstance(index, InterfaceIndex)
+        update_interface_index(device)
+        self.assertIs(getattr(device, INTERFACE_INDEX_ATTR), index)
+        self.assertEqual(
+            [(x[1], x[2]) for x in get_interface_index(device)],
+            [(eth0_mac, (client_mac,))])
 
 
 def test_suite():
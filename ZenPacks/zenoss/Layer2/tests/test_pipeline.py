@@ -0,0 +1,83 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Test cases for pipeline module."""
+
+# stdlib imports
+import logging
+import threading
+import unittest
+
+# zenpack imports
+from ZenPacks.zenoss.Layer2.connections import NodeUpdate
+from ZenPacks.zenoss.Layer2.pipeline import EdgeWriter
+
+LOG = logging.getLogger("zen.Layer2.tests")
+
+
+def fake_update(i):
+    return NodeUpdate(
+        id="device{}".format(i),
+        uuid="uuid{}".format(i),
+        edges=[("a{}".format(i), "b{}".format(i), ("layer2",))],
+        last_changed=str(i))
+
+
+class TestEdgeWriter(unittest.TestCase):
+    """EdgeWriter class tests."""
+
+    def setUp(self):
+        super(TestEdgeWriter, self).setUp()
+        self.applied = []
+        self.lock = threading.Lock()
+
+    def apply_fn(self, update):
+        with self.lock:
+            self.applied.append(update.uuid)
+
+        return len(update.edges), 0
+
+    def test_threaded(self):
+        writer = EdgeWriter(
+            LOG, threads=2, queue_size=1, apply_fn=self.apply_fn)
+
+        for i in range(20):
+            writer.put(fake_update(i))
+
+        self.assertEqual(writer.join(), 20)
+        self.assertItemsEqual(
+            self.applied, ["uuid{}".format(i) for i in range(20)])
+
+        # Counts are per join, and threads are reused.
+        writer.put(fake_update(20))
+        self.assertEqual(writer.join(), 1)
+        self.assertEqual(len(writer.workers), 2)
+
+    def test_inline(self):
+        writer = EdgeWriter(LOG, threads=0, apply_fn=self.apply_fn)
+        writer.put(fake_update(0))
+
+        # Written before put returns. No threads started.
+        self.assertEqual(self.applied, ["uuid0"])
+        self.assertEqual(writer.workers, [])
+        self.assertEqual(writer.join(), 1)
+
+    def test_failures_not_counted(self):
+        def apply_fn(update):
+            if update.uuid == "uuid1":
+                raise Exception("simulated failure")
+
+            return self.apply_fn(update)
+
+        writer = EdgeWriter(LOG, threads=1, apply_fn=apply_fn)
+        for i in range(3):
+            writer.put(fake_update(i))
+
+        self.assertEqual(writer.join(), 2)
+        self.assertItemsEqual(self.applied, ["uuid0", "uuid2"])
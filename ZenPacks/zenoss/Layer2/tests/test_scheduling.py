@@ -0,0 +1,68 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Test cases for scheduling module."""
+
+# stdlib imports
+import unittest
+
+# zenpack imports
+from ZenPacks.zenoss.Layer2.scheduling import Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    """Scheduler class tests."""
+
+    def setUp(self):
+        super(TestScheduler, self).setUp()
+        self.scheduler = Scheduler(cycletime=300, max_interval=3600)
+
+    def test_unknown_is_due(self):
+        self.assertTrue(self.scheduler.is_due("u1", now=0))
+
+    def test_backoff(self):
+        now = 0
+        intervals = []
+        for _ in range(6):
+            self.scheduler.record("u1", changed=False, cost=1, now=now)
+            intervals.append(self.scheduler.stats["u1"].interval)
+
+        # Doubles for each unchanged check up to max_interval.
+        self.assertEqual(intervals, [600, 1200, 2400, 3600, 3600, 3600])
+
+        # Not due until it would be overdue by the next cycle.
+        self.assertFalse(self.scheduler.is_due("u1", now=3000))
+        self.assertTrue(self.scheduler.is_due("u1", now=3400))
+
+        # A change brings it back to every cycle.
+        self.scheduler.record("u1", changed=True, cost=1, now=now)
+        self.assertEqual(self.scheduler.stats["u1"].interval, 300)
+        self.assertTrue(self.scheduler.is_due("u1", now=now + 1))
+
+        stats = self.scheduler.stats["u1"]
+        self.assertEqual((stats.checks, stats.changes), (7, 1))
+
+    def test_get_due(self):
+        uuids_by_path = {"/a": "ua", "/b": "ub", "/c": "uc", "/d": "ud"}
+
+        self.scheduler.record("ua", changed=True, cost=5, now=0)
+        self.scheduler.record("ub", changed=True, cost=1, now=0)
+        self.scheduler.record("uc", changed=False, cost=1, now=0)
+        self.scheduler.record("uc", changed=False, cost=1, now=0)
+
+        # Unknown first, then equally overdue by cost. /c isn't due.
+        self.assertEqual(
+            self.scheduler.get_due(
+                ["/a", "/b", "/c", "/d"], uuids_by_path, now=300),
+            ["/d", "/b", "/a"])
+
+    def test_unsaved(self):
+        self.scheduler.record("u1", changed=False, cost=1, now=0)
+        self.scheduler.record("u2", changed=True, cost=1, now=0)
+        self.assertItemsEqual(self.scheduler.unsaved, ["u1", "u2"])
@@ -0,0 +1,79 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Test cases for sharding module."""
+
+# stdlib imports
+import unittest
+
+# zenpack imports
+from ZenPacks.zenoss.Layer2.sharding import (
+    Sharder, device_class_from_path, owner,
+    )
+
+PATHS = [
+    "/zport/dmd/Devices/Network/Cisco/devices/sw{}".format(i)
+    for i in range(100)]
+
+
+class TestSharding(unittest.TestCase):
+    """Sharding tests."""
+
+    def sharders(self, instances):
+        sharders = []
+        for instance in instances:
+            sharder = Sharder(instance, timeout=900)
+            sharder.instances = sorted(instances)
+            sharders.append(sharder)
+
+        return sharders
+
+    def test_device_class_from_path(self):
+        self.assertEqual(
+            device_class_from_path(
+                "/zport/dmd/Devices/Network/Cisco/devices/sw1"),
+            "/Network/Cisco")
+
+        self.assertEqual(
+            device_class_from_path("/zport/dmd/Devices/devices/sw1"),
+            "/")
+
+    def test_partition(self):
+        sharders = self.sharders(["a", "b", "c"])
+        owned = [x.filter(PATHS, {}) for x in sharders]
+
+        # Every path is owned by exactly one instance.
+        self.assertItemsEqual(sum(owned, []), PATHS)
+        self.assertTrue(all(owned))
+
+    def test_keys(self):
+        sharders = self.sharders(["a", "b"])
+        keys = {x: "/Network/Cisco" for x in PATHS}
+
+        # Devices with the same key are owned by the same instance.
+        owned = sorted(len(x.filter(PATHS, keys)) for x in sharders)
+        self.assertEqual(owned, [0, len(PATHS)])
+
+    def test_reassignment(self):
+        before = {x: owner(x, ["a", "b", "c"]) for x in PATHS}
+        after = {x: owner(x, ["a", "b"]) for x in PATHS}
+
+        # Only the departed instance's devices move.
+        for path in PATHS:
+            if before[path] != "c":
+                self.assertEqual(before[path], after[path])
+
+    def test_designated(self):
+        designated = [x.is_designated() for x in self.sharders(["b", "a"])]
+        self.assertEqual(designated, [False, True])
+
+    def test_alone(self):
+        sharder = Sharder("a", timeout=900)
+        self.assertTrue(sharder.is_designated())
+        self.assertEqual(sharder.filter(PATHS, {}), PATHS)
@@ -0,0 +1,149 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2016, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Test cases for shared_cache module."""
+
+# stdlib imports
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# third-party imports
+from mock import patch
+
+# zenpack imports
+from ZenPacks.zenoss.Layer2 import shared_cache
+
+EDGES = [
+    ("/gw", "00:00:00:00:00:01"),
+    ("00:00:00:00:00:01", "/sw"),
+    (u"/sw", "/h1"),
+    ("/h1", "/sw"),
+    ("/h1", "/h1"),
+    ]
+
+
+class TestSnapshot(unittest.TestCase):
+    """shared_cache.Snapshot tests."""
+
+    def test_adjacency(self):
+        snapshot = shared_cache.Snapshot(shared_cache.dumps(EDGES))
+
+        self.assertEqual(len(snapshot), 4)
+        self.assertEqual(
+            list(snapshot),
+            ["/gw", "/h1", "/sw", "00:00:00:00:00:01"])
+
+        # Edges are undirected, and self-loops are ignored.
+        self.assertEqual(snapshot["/sw"], ("/h1", "00:00:00:00:00:01"))
+        self.assertEqual(snapshot[u"/h1"], ("/sw",))
+
+        self.assertIn("/gw", snapshot)
+        self.assertNotIn("/zz", snapshot)
+        self.assertNotIn("", snapshot)
+        self.assertRaises(KeyError, snapshot.__getitem__, "/zz")
+
+    def test_down(self):
+        snapshot = shared_cache.Snapshot(shared_cache.dumps(EDGES))
+        self.assertIsNone(snapshot.get_down())
+
+        snapshot = shared_cache.Snapshot(
+            shared_cache.dumps(EDGES, down=["/sw", "/other", "/sw"]))
+
+        self.assertEqual(snapshot.get_down(), {"/sw", "/other"})
+
+    def test_empty(self):
+        snapshot = shared_cache.Snapshot(shared_cache.dumps([], down=[]))
+        self.assertEqual(len(snapshot), 0)
+        self.assertNotIn("/gw", snapshot)
+        self.assertEqual(snapshot.get_down(), set())
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, shared_cache.Snapshot, "")
+        self.assertRaises(
+            ValueError,
+            shared_cache.Snapshot,
+            "XXXX" + shared_cache.dumps(EDGES)[4:])
+
+
+class TestSharedCache(unittest.TestCase):
+    """shared_cache.SharedCache tests."""
+
+    def setUp(self):
+        super(TestSharedCache, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "layer2.cache")
+        self.cache = shared_cache.SharedCache(
+            self.filename, check_seconds=0, max_age=900)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(TestSharedCache, self).tearDown()
+
+    def test_missing(self):
+        self.assertIsNone(self.cache.get())
+
+    def test_replaced(self):
+        shared_cache.write(self.filename, EDGES)
+        snapshot = self.cache.get()
+        self.assertIn("/gw", snapshot)
+
+        # Unchanged files aren't mapped again.
+        self.assertIs(self.cache.get(), snapshot)
+
+        # Readers see the new file, and can still use the old one.
+        shared_cache.write(self.filename, [("/a", "/b")], down=["/a"])
+        replacement = self.cache.get()
+        self.assertIsNot(replacement, snapshot)
+        self.assertEqual(replacement["/a"], ("/b",))
+        self.assertEqual(replacement.get_down(), {"/a"})
+        self.assertEqual(snapshot["/gw"], ("00:00:00:00:00:01",))
+
+        self.assertEqual(os.listdir(self.tmpdir), ["layer2.cache"])
+
+    def test_stale(self):
+        with open(self.filename, "wb") as f:
+            f.write(shared_cache.dumps(EDGES, created=time.time() - 1000))
+
+        self.assertIsNone(self.cache.get())
+
+    def test_invalid(self):
+        with open(self.filename, "wb") as f:
+            f.write("not a shared cache")
+
+        self.assertIsNone(self.cache.get())
+
+
+class TestConfig(unittest.TestCase):
+    """shared_cache global.conf tests."""
+
+    def config(self, **properties):
+        return patch.object(
+            shared_cache, "get_global_config", return_value=properties)
+
+    def test_defaults(self):
+        with self.config():
+            self.assertEqual(
+                shared_cache.get_filename(), shared_cache.DEFAULT_FILENAME)
+
+            self.assertEqual(
+                shared_cache.get_max_age(), shared_cache.DEFAULT_MAX_AGE)
+
+    def test_configured(self):
+        with self.config(**{
+                shared_cache.FILENAME_PROPERTY: "/tmp/layer2.cache",
+                shared_cache.MAX_AGE_PROPERTY: "60"}):
+            self.assertEqual(shared_cache.get_filename(), "/tmp/layer2.cache")
+            self.assertEqual(shared_cache.get_max_age(), 60)
+
+        with self.config(**{shared_cache.MAX_AGE_PROPERTY: "bogus"}):
+            self.assertEqual(
+                shared_cache.get_max_age(), shared_cache.DEFAULT_MAX_AGE)
@@ -14,9 +14,16 @@ import contextlib
 import copy
 import itertools
 import logging
+import os
 import re
+import shutil
 import socket
 import struct
+import tempfile
+import time
+import unittest
+
+from mock import Mock, patch
 
 from zope.event import notify
 
@@ -28,9 +35,12 @@ from Products.Zuul.catalog.events import IndexingEvent
 
 from zenoss.protocols.protobufs.zep_pb2 import STATUS_SUPPRESSED
 
+import networkx
+
 import ZenPacks.zenoss.Layer2
 from ZenPacks.zenoss.Layer2 import connections
 from ZenPacks.zenoss.Layer2 import progresslog
+from ZenPacks.zenoss.Layer2 import shared_cache
 from ZenPacks.zenoss.Layer2 import suppression
 from ZenPacks.zenoss.Layer2.zep import Layer2PostEventPlugin
 
@@ -408,6 +418,701 @@ class TestSuppression(BaseTestCase):
         Layer2PostEventPlugin.apply(np_event, self.dmd)
         self._assert_suppression(np_event, suppressed=False, root_causes="host-1-1-1")
 
+    def test_batch(self):
+        suppressor = suppression.get_suppressor(self.dmd)
+        suppressor.clear_caches()
+
+        self.dmd.Devices.findDeviceByIdExact("host-3-1-1").setZenProperty(
+            "zL2Gateways", ["row-3a"])
+
+        events = [
+            MockEvent(device="host-3-1-1", eventClass="/Perf", severity=3),
+            MockEvent(
+                device="host-3-1-1", eventClass="/Status/Ping", severity=5),
+            MockEvent(
+                device="host-3-1-1", eventClass="/Status/Ping", severity=5),
+            MockEvent(device="host-2-1-1", eventClass="/Perf", severity=3),
+            ]
+
+        with downed_devices(["rack-3-1a"]):
+            Layer2PostEventPlugin.apply_batch(events, self.dmd)
+
+        # The ping down event in the batch makes the device down for all.
+        self._assert_suppression(
+            events[0], suppressed=True, root_causes="host-3-1-1")
+        self._assert_suppression(
+            events[1], suppressed=True, root_causes="rack-3-1a")
+        self._assert_suppression(
+            events[2], suppressed=True, root_causes="rack-3-1a")
+        self._assert_suppression(
+            events[3], suppressed=False, root_causes=None)
+
+
+class TestExpiringCache(unittest.TestCase):
+    """suppression.ExpiringCache tests."""
+
+    def test_expiration(self):
+        cache = suppression.ExpiringCache(60)
+        cache.set("old", 1, asof=time.time() - 120)
+        cache.set("new", 2)
+
+        self.assertIsNone(cache.get("old"))
+        self.assertEqual(cache.get("new"), 2)
+        self.assertEqual(list(cache.values()), [2])
+
+        # Expired entries are removed as other entries are set.
+        cache.set("old", 1, asof=time.time() - 120)
+        cache.set("newer", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats()["expirations"], 2)
+
+    def test_lru(self):
+        cache = suppression.ExpiringCache(60, size=2)
+        cache.update({"a": 1, "b": 2})
+
+        # a becomes more recently used than b, and b is evicted.
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(
+            cache.stats(), {
+                "hits": 2,
+                "misses": 1,
+                "evictions": 1,
+                "expirations": 0,
+                "size": 2,
+                })
+
+    def test_peek(self):
+        cache = suppression.ExpiringCache(60, size=2)
+        cache.update({"a": 1, "b": 2})
+        cache.set("old", 3, asof=time.time() - 120)
+
+        # Peeking isn't a lookup, and doesn't make a recently used.
+        self.assertEqual(cache.peek("a"), 1)
+        self.assertIsNone(cache.peek("old"))
+        self.assertEqual(cache.stats()["hits"], 0)
+        cache.set("c", 3)
+        self.assertIsNone(cache.peek("a"))
+
+    def test_set_fn(self):
+        cache = suppression.ExpiringCache(60)
+        set_fn = suppression.Suppressor.status_set_fn
+
+        cache.set("a", True, asof=100, set_fn=set_fn)
+        cache.set("a", False, asof=50, set_fn=set_fn)
+        self.assertEqual(cache.get("a"), True)
+
+        cache.set("a", False, asof=time.time() + 1, set_fn=set_fn)
+        self.assertEqual(cache.get("a"), False)
+
+
+class TestComponentRegistry(unittest.TestCase):
+    """suppression.ComponentRegistry tests."""
+
+    def setUp(self):
+        super(TestComponentRegistry, self).setUp()
+        self.changes = (1, set())
+        self.built = []
+        self.removed = []
+        self.registry = suppression.ComponentRegistry(
+            60,
+            size=2,
+            absent_size=10,
+            check_seconds=0,
+            changes_fn=self.get_changes,
+            remove_fn=self.removed.extend)
+
+    def get_changes(self, since):
+        last, nodes = self.changes
+        return last, set() if since == last else nodes
+
+    def build(self, node):
+        self.built.append(node)
+        g = networkx.Graph()
+        if node != "missing":
+            g.add_edge(node, node + "-neighbor")
+
+        return g
+
+    def test_shared(self):
+        g = self.registry.get("a", self.build)
+
+        # Every node of a component gets the same graph.
+        self.assertIs(self.registry.get("a-neighbor", self.build), g)
+        self.assertEqual(self.built, ["a"])
+        self.assertEqual(
+            self.registry.stats(), {
+                "hits": 1,
+                "misses": 1,
+                "components": 1,
+                "nodes": 2,
+                "absent": 0,
+                })
+
+    def test_changes(self):
+        self.registry.get("a", self.build)
+        self.registry.get("b", self.build)
+        self.registry.depend("a", ("h1", "a"))
+        self.changes = (2, {"a-neighbor"})
+        self.registry.get("a-neighbor", self.build)
+        self.registry.get("b", self.build)
+
+        # Only the component with a changed node is replaced, as a unit,
+        # and keys depending on it are removed with it.
+        self.assertEqual(self.built, ["a", "b", "a-neighbor"])
+        self.assertEqual(self.registry.stats()["components"], 2)
+        self.assertNotIn("a", self.registry.component_ids)
+        self.assertEqual(self.removed, [("h1", "a")])
+
+    def test_everything_changed(self):
+        self.registry.get("a", self.build)
+        self.registry.get("missing", self.build)
+        self.changes = (2, None)
+        self.registry.get("a", self.build)
+        self.registry.get("missing", self.build)
+
+        self.assertEqual(self.built, ["a", "missing", "a", "missing"])
+
+    def test_absent(self):
+        self.registry.get("missing", self.build)
+        self.registry.get("missing", self.build)
+
+        # Nodes missing from their graph aren't built again until their
+        # edges change.
+        self.assertEqual(self.built, ["missing"])
+        self.assertEqual(self.registry.stats()["absent"], 1)
+
+        self.changes = (2, {"missing"})
+        self.registry.get("missing", self.build)
+        self.assertEqual(self.built, ["missing", "missing"])
+
+    def test_lru(self):
+        for node in ("a", "b", "a", "c"):
+            self.registry.get(node, self.build)
+
+        # b's component is evicted with all of its nodes.
+        self.assertEqual(len(self.registry), 2)
+        self.assertNotIn("b-neighbor", self.registry.component_ids)
+        self.assertIn("a-neighbor", self.registry.component_ids)
+
+
+class TestShortestPaths(unittest.TestCase):
+    """suppression shortest path function tests."""
+
+    def setUp(self):
+        super(TestShortestPaths, self).setUp()
+
+        # Two equal-cost paths from h1 to gw, and a longer third path.
+        self.g = networkx.Graph()
+        self.g.add_edges_from([
+            ("h1", "sw1"), ("h1", "sw2"),
+            ("sw1", "core"), ("sw2", "core"),
+            ("core", "gw"),
+            ("h1", "sw3"), ("sw3", "sw4"), ("sw4", "sw5"), ("sw5", "gw"),
+            ("isolated-a", "isolated-b"),
+            ])
+
+    def test_shortest_paths(self):
+        distances = suppression.shortest_path_distances(self.g, "gw", "h1")
+        self.assertEqual(
+            list(suppression.shortest_paths(self.g, "h1", distances)), [
+                ["h1", "sw1", "core", "gw"],
+                ["h1", "sw2", "core", "gw"],
+                ])
+
+        self.assertEqual(
+            suppression.count_shortest_paths(self.g, "h1", distances), 2)
+
+    def test_no_paths(self):
+        distances = suppression.shortest_path_distances(
+            self.g, "gw", "isolated-a")
+
+        self.assertEqual(
+            list(suppression.shortest_paths(self.g, "isolated-a", distances)),
+            [])
+
+        self.assertEqual(
+            suppression.count_shortest_paths(self.g, "isolated-a", distances),
+            0)
+
+    def test_mesh(self):
+        # 10 layers of 4 fully meshed switches has 4 ** 10 paths.
+        g = networkx.Graph()
+        layers = [["h1"]] + [
+            ["sw{}-{}".format(i, j) for j in range(4)]
+            for i in range(10)] + [["gw"]]
+
+        for upper, lower in zip(layers, layers[1:]):
+            g.add_edges_from((a, b) for a in upper for b in lower)
+
+        distances = suppression.shortest_path_distances(g, "gw", "h1")
+        self.assertEqual(
+            suppression.count_shortest_paths(g, "h1", distances), 4 ** 10)
+
+        paths = itertools.islice(
+            suppression.shortest_paths(g, "h1", distances), 100)
+
+        self.assertTrue(all(len(x) == 12 for x in paths))
+
+
+class TestSuppressorPaths(unittest.TestCase):
+    """suppression.Suppressor.get_shortest_paths tests."""
+
+    def setUp(self):
+        super(TestSuppressorPaths, self).setUp()
+        self.g = networkx.Graph()
+        self.g.add_edges_from([
+            ("/gw", "/sw1"), ("/gw", "/sw2"),
+            ("/sw1", "/h1"), ("/sw2", "/h1"),
+            ("/isolated", "/other"),
+            ])
+
+        for name, value in (
+                ("networkx_graph", Mock(return_value=self.g)),
+                ("get_changes", Mock(return_value=(1, set())))):
+            patcher = patch.object(connections, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.suppressor = suppression.Suppressor(Mock())
+
+    def test_get_shortest_paths(self):
+        expected = [["/h1", "/sw1", "/gw"], ["/h1", "/sw2", "/gw"]]
+        self.assertEqual(
+            self.suppressor.get_shortest_paths("/h1", "/gw"), expected)
+
+        # Paths are cached.
+        self.assertEqual(
+            self.suppressor.get_shortest_paths("/h1", "/gw"), expected)
+        self.assertEqual(connections.networkx_graph.call_count, 1)
+
+    def test_no_paths(self):
+        self.assertEqual(
+            self.suppressor.get_shortest_paths("/missing", "/gw"), [])
+
+    def test_changed_component(self):
+        self.suppressor.get_shortest_paths("/h1", "/gw")
+        g = networkx.Graph()
+        g.add_edges_from([("/gw", "/sw1"), ("/gw", "/sw2"), ("/sw1", "/h1")])
+        connections.networkx_graph.return_value = g
+        connections.get_changes.return_value = (2, {"/sw2"})
+        self.suppressor.components.checked = 0
+
+        # Paths through a changed component are found again.
+        self.assertEqual(
+            self.suppressor.get_shortest_paths("/h1", "/gw"),
+            [["/h1", "/sw1", "/gw"]])
+
+
+class TestRootCauseFlips(unittest.TestCase):
+    """Memoized root causes are invalidated by status flips."""
+
+    def setUp(self):
+        super(TestRootCauseFlips, self).setUp()
+        self.gw, self.sw, self.h1, self.h2 = (
+            "/zport/dmd/Devices/devices/{}".format(x)
+            for x in ("gw", "sw", "h1", "h2"))
+
+        g = networkx.Graph()
+        g.add_edges_from([
+            (self.gw, self.sw),
+            (self.sw, self.h1), (self.sw, self.h2),
+            ])
+
+        for name, value in (
+                ("networkx_graph", Mock(return_value=g)),
+                ("get_changes", Mock(return_value=(1, set()))),
+                ("get_down_devices", Mock(return_value=set()))):
+            patcher = patch.object(connections, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.devices = {
+            x: Mock(id=x.rsplit("/", 1)[-1], getPrimaryId=Mock(return_value=x))
+            for x in (self.gw, self.sw, self.h1, self.h2)}
+
+        self.devices[self.gw]._v_multihop = True
+        self.suppressor = suppression.Suppressor(
+            Mock(getObjByPath=self.devices.get))
+
+    def root_causes(self, entity):
+        return sorted(
+            x.id for x in self.suppressor.l2_root_causes(
+                self.devices[entity], [self.devices[self.gw]]))
+
+    def test_transit_down(self):
+        # Statuses from the index are memoized as all up.
+        self.assertEqual(self.root_causes(self.h1), [])
+        self.assertEqual(self.root_causes(self.h2), [])
+
+        # The first time the transit switch goes down is a flip.
+        self.suppressor.set_status(self.sw, suppression.DOWN)
+        self.assertEqual(self.root_causes(self.h1), ["sw"])
+        self.assertEqual(self.root_causes(self.h2), ["sw"])
+
+        self.suppressor.set_status(self.sw, suppression.UP)
+        self.assertEqual(self.root_causes(self.h1), [])
+
+
+class TestRootCauseDominators(unittest.TestCase):
+    """Dominators don't change root causes found by walking paths."""
+
+    def setUp(self):
+        super(TestRootCauseDominators, self).setUp()
+        self.gw, self.a, self.b, self.d, self.h1 = (
+            "/zport/dmd/Devices/devices/{}".format(x)
+            for x in ("gw", "a", "b", "d", "h1"))
+
+        # Paths from h1 go through d, then a or b.
+        g = networkx.Graph()
+        g.add_edges_from([
+            (self.gw, self.a), (self.gw, self.b),
+            (self.a, self.d), (self.b, self.d),
+            (self.d, self.h1),
+            ])
+
+        for name, value in (
+                ("networkx_graph", Mock(return_value=g)),
+                ("get_changes", Mock(return_value=(1, set()))),
+                ("get_down_devices", Mock(return_value=set()))):
+            patcher = patch.object(connections, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.devices = {
+            x: Mock(id=x.rsplit("/", 1)[-1], getPrimaryId=Mock(return_value=x))
+            for x in (self.gw, self.a, self.b, self.d, self.h1)}
+
+        self.suppressor = suppression.Suppressor(
+            Mock(getObjByPath=self.devices.get))
+
+    def root_causes(self):
+        return sorted(
+            x.rsplit("/", 1)[-1]
+            for x in self.suppressor.l2_root_cause_entities(
+                self.devices[self.h1], [self.devices[self.gw]]))
+
+    def test_dominator_down(self):
+        self.suppressor.set_status(self.d, suppression.DOWN)
+        self.assertEqual(self.root_causes(), ["d"])
+
+    def test_failure_before_dominator(self):
+        self.suppressor.set_status(self.a, suppression.DOWN)
+        self.suppressor.set_status(self.d, suppression.DOWN)
+
+        # d dominates h1, but a is closer to the gateway on one path.
+        # Taking the first down dominator would only return d.
+        tree = self.suppressor.get_dominators(self.gw)
+        self.assertEqual(tree.dominators(self.h1), [self.gw, self.d])
+        self.assertEqual(self.root_causes(), ["a", "d"])
+        self.assertEqual(
+            self.root_causes(),
+            sorted(
+                x.rsplit("/", 1)[-1]
+                for x in self.suppressor.path_root_causes(
+                    self.devices[self.h1], self.devices[self.gw])))
+
+
+class TestDominatorTree(unittest.TestCase):
+    """suppression.DominatorTree tests."""
+
+    def test_dominators(self):
+        g = networkx.Graph()
+        g.add_edges_from([
+            ("gw", "core"),
+            ("core", "sw1"), ("core", "sw2"),
+            ("sw1", "access"), ("sw2", "access"),
+            ("access", "h1"),
+            ("access", "h2"), ("core", "h2"),
+            ("isolated-a", "isolated-b"),
+            ])
+
+        tree = suppression.DominatorTree(g, "gw")
+        self.assertEqual(tree.dominators("gw"), [])
+        self.assertEqual(tree.dominators("sw1"), ["gw", "core"])
+
+        # Both paths through sw1 and sw2 go through access.
+        self.assertEqual(tree.dominators("h1"), ["gw", "core", "access"])
+
+        # h2's shortest path skips access.
+        self.assertEqual(tree.dominators("h2"), ["gw", "core"])
+
+        self.assertNotIn("isolated-a", tree)
+        self.assertEqual(tree.dominators("isolated-a"), [])
+
+    def test_leading_dominators(self):
+        g = networkx.Graph()
+        g.add_edges_from([
+            ("gw", "core"),
+            ("core", "sw1"), ("core", "sw2"),
+            ("sw1", "access"), ("sw2", "access"),
+            ("access", "h1"),
+            ])
+
+        tree = suppression.DominatorTree(g, "gw")
+
+        # Paths go through sw1 or sw2 between core and access.
+        self.assertEqual(tree.leading_dominators("h1"), ["gw", "core"])
+        self.assertEqual(tree.leading_dominators("sw1"), ["gw", "core"])
+        self.assertEqual(tree.leading_dominators("gw"), [])
+
+    def test_missing_root(self):
+        tree = suppression.DominatorTree(networkx.Graph(), "gw")
+        self.assertEqual(tree.dominators("h1"), [])
+
+    def test_anchors(self):
+        g = networkx.Graph()
+        g.add_edges_from([
+            ("/gw", "/sw1"), ("/gw", "/sw2"),
+            ("/sw1", "mac-sw1"), ("mac-sw1", "mac-h1"), ("mac-h1", "/h1"),
+            ("/sw1", "mac-sw1b"), ("mac-sw1b", "mac-h2"), ("mac-h2", "/h2"),
+            ("/sw1", "/h3"), ("/sw2", "/h3"),
+            ])
+
+        tree = suppression.DominatorTree(g, "/gw")
+
+        # Hosts behind the same switch share an anchor.
+        self.assertEqual(tree.anchors["/h1"], "/sw1")
+        self.assertEqual(tree.anchors["/h2"], "/sw1")
+
+        # Paths from h3 reach different switches first.
+        self.assertIsNone(tree.anchors.get("/h3"))
+
+        # Only entities that paths go through are transit.
+        self.assertEqual(tree.transit, {"/gw", "/sw1", "/sw2"})
+
+
+class TestStatusIndex(unittest.TestCase):
+    """suppression.StatusIndex tests."""
+
+    def setUp(self):
+        super(TestStatusIndex, self).setUp()
+        self.index = suppression.StatusIndex(
+            reconcile_seconds=300, grace_seconds=60)
+
+        self.sw1 = "/zport/dmd/Devices/Network/devices/sw1"
+        self.sw2 = "/zport/dmd/Devices/Network/devices/sw2"
+
+    def test_covers(self):
+        self.assertTrue(self.index.covers(self.sw1))
+        self.assertTrue(self.index.covers("/zport/dmd/Devices/devices/h1"))
+        self.assertFalse(self.index.covers(self.sw1 + "/os/interfaces/eth0"))
+        self.assertFalse(self.index.covers("00:00:00:00:00:01"))
+
+    def test_seeding(self):
+        # Nothing is known until seeded.
+        self.assertIsNone(self.index.get(self.sw1))
+        self.assertTrue(self.index.is_due(time.time()))
+
+        self.assertEqual(
+            self.index.reconcile({self.sw1}, time.time()),
+            {self.sw1: False})
+
+        self.assertFalse(self.index.is_due(time.time()))
+        self.assertIs(self.index.get(self.sw1), False)
+        self.assertIs(self.index.get(self.sw2), True)
+        self.assertIsNone(self.index.get("00:00:00:00:00:01"))
+
+        # Only lookups of indexed entities are counted.
+        self.assertEqual(
+            self.index.stats(), {"hits": 2, "misses": 1, "size": 1})
+
+    def test_events(self):
+        now = time.time()
+        self.index.reconcile(set(), now - 600)
+        self.index.set(self.sw1, False, asof=now - 120)
+        self.index.set(self.sw2, False, asof=now - 10)
+
+        # Older statuses don't replace newer ones.
+        self.index.set(self.sw2, True, asof=now - 20)
+        self.assertIs(self.index.get(self.sw2), False)
+
+        # Recent events take precedence over ZEP, and older ones don't.
+        self.assertEqual(self.index.reconcile(set(), now), {self.sw1: True})
+        self.assertIs(self.index.get(self.sw1), True)
+        self.assertIs(self.index.get(self.sw2), False)
+
+    def test_asof(self):
+        now = time.time()
+        self.index.reconcile(set(), now - 600)
+        self.index.set(self.sw1, False, asof=now - 100)
+
+        # Events since an older down set take precedence over it.
+        self.index.reconcile(set(), now, asof=now - 120)
+        self.assertIs(self.index.get(self.sw1), False)
+        self.assertFalse(self.index.is_due(now))
+
+
+class TestDiscoverGateways(unittest.TestCase):
+    """suppression.Suppressor.discover_gateways tests."""
+
+    def setUp(self):
+        super(TestDiscoverGateways, self).setUp()
+
+        # Two hosts share a region of MACs leading to /gw and /sw. /far
+        # is only reachable through /sw.
+        self.graph = networkx.Graph()
+        self.graph.add_edges_from([
+            ("/h1", "/sw"),
+            ("/h1", "00:00:00:00:00:01"),
+            ("00:00:00:00:00:01", "00:00:00:00:00:02"),
+            ("/h2", "00:00:00:00:00:02"),
+            ("00:00:00:00:00:02", "/gw"),
+            ("/sw", "00:00:00:00:00:03"),
+            ("00:00:00:00:00:03", "/far"),
+            ])
+
+        devices = {
+            x: Mock(id=x, getProperty=Mock(return_value=x != "/h2"))
+            for x in ("/h1", "/h2", "/sw", "/gw", "/far")}
+
+        dmd = Mock(getObjByPath=devices.get)
+        self.suppressor = suppression.Suppressor(dmd)
+        self.suppressor.get_graph = Mock(return_value=self.graph)
+        self.devices = devices
+
+    def discover(self, entity):
+        return sorted(
+            x.id for x in self.suppressor.discover_gateways(entity))
+
+    def test_discover(self):
+        self.assertEqual(self.discover("/h1"), ["/gw", "/sw"])
+        self.assertEqual(self.discover("/none"), [])
+
+    def test_region_only(self):
+        # /h2's only neighbor is a MAC. Its gateways are all found
+        # through the region of MACs.
+        self.assertEqual(self.discover("/h2"), ["/gw", "/h1"])
+
+    def test_shared_region(self):
+        checked = collections.Counter()
+        is_potential_gateway = self.suppressor.is_potential_gateway
+
+        def count(entity):
+            checked[entity] += 1
+            return is_potential_gateway(entity)
+
+        self.suppressor.is_potential_gateway = count
+        self.discover("/h1")
+        self.discover("/h2")
+        self.discover("/h2")
+
+        # The region is walked once, so each entity is checked once.
+        self.assertEqual(max(checked.values()), 1)
+        self.assertIs(
+            self.suppressor.regions_cache.get("00:00:00:00:00:01")[1],
+            self.suppressor.regions_cache.get("00:00:00:00:00:02")[1])
+
+        # A changed component's regions are walked again.
+        self.suppressor.get_graph.return_value = self.graph.copy()
+        self.discover("/h2")
+        self.assertEqual(checked["/gw"], 2)
+
+
+class TestSharedSnapshot(unittest.TestCase):
+    """suppression.Suppressor use of the shared cache."""
+
+    def setUp(self):
+        super(TestSharedSnapshot, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+        self.gw = "/zport/dmd/Devices/devices/gw"
+        self.sw = "/zport/dmd/Devices/devices/sw"
+        self.h1 = "/zport/dmd/Devices/devices/h1"
+
+        filename = os.path.join(self.tmpdir, "layer2.cache")
+        shared_cache.write(
+            filename,
+            [(self.gw, self.sw), (self.sw, "00:00:00:00:00:01"),
+             ("00:00:00:00:00:01", self.h1)],
+            down=[self.sw])
+
+        self.suppressor = suppression.Suppressor(Mock())
+        self.suppressor.shared = shared_cache.SharedCache(
+            filename, check_seconds=0, max_age=900)
+
+    def test_graph(self):
+        g = self.suppressor.get_graph(self.h1)
+        self.assertIsInstance(g, shared_cache.Snapshot)
+        self.assertEqual(
+            self.suppressor.get_dominators(self.gw).dominators(self.h1),
+            [self.gw, self.sw, "00:00:00:00:00:01"])
+
+    def test_statuses(self):
+        with patch.object(connections, "get_down_devices") as get_down:
+            self.suppressor.reconcile_statuses()
+
+        # Statuses are seeded without querying ZEP.
+        self.assertFalse(get_down.called)
+        self.assertIs(self.suppressor.status_index.get(self.sw), False)
+        self.assertIs(self.suppressor.status_index.get(self.h1), True)
+
+    def test_status_stats(self):
+        eth0 = self.sw + "/os/interfaces/eth0"
+        with patch.object(connections, "get_status", return_value=True):
+            self.assertIs(self.suppressor.get_status(self.sw), False)
+            self.assertIs(self.suppressor.get_status(eth0), True)
+            self.assertIs(self.suppressor.get_status(eth0), True)
+
+        # Index answers are counted apart from the status cache.
+        stats = self.suppressor.cache_stats()
+        self.assertEqual(stats["status"]["hits"], 1)
+        self.assertEqual(stats["status"]["misses"], 1)
+        self.assertEqual(stats["status_index"]["hits"], 1)
+
+
+class TestPhaseTimer(unittest.TestCase):
+    """suppression.PhaseTimer tests."""
+
+    def test_phases(self):
+        timer = suppression.PhaseTimer()
+        with timer.phase("events"):
+            for _ in range(2):
+                with timer.phase("to-obj"):
+                    pass
+
+        self.assertEqual(timer.counts, {"events": 1, "to-obj": 2})
+        self.assertGreaterEqual(
+            timer.durations["events"], timer.durations["to-obj"])
+
+        # A new trace starts with new totals.
+        with timer.phase("events"):
+            pass
+
+        self.assertEqual(timer.counts, {"events": 1})
+
+    def test_trace(self):
+        timer = suppression.PhaseTimer(slow_seconds=0, sample_rate=1.0)
+        with patch.object(suppression.TRACE_LOG, "info") as info:
+            with timer.phase("events"):
+                timer.describe("events for 1 devices: host-1")
+                with timer.phase("gateways"):
+                    pass
+
+        self.assertEqual(info.call_count, 1)
+        self.assertIn("events for 1 devices: host-1", info.call_args[0])
+        self.assertEqual(timer.slow, 0)
+
+        # Unsampled slow traces are counted but not logged.
+        timer.sample_rate = 0
+        with patch.object(suppression.TRACE_LOG, "info") as info:
+            with timer.phase("events"):
+                pass
+
+        self.assertFalse(info.called)
+        self.assertEqual(timer.slow, 1)
+
+        # Tracing is disabled without slow_seconds.
+        timer = suppression.PhaseTimer()
+        with patch.object(suppression.TRACE_LOG, "info") as info:
+            with timer.phase("events"):
+                pass
+
+        self.assertFalse(info.called)
+
 
 class MockEvent(object):
     def __init__(self, **kwargs):
@@ -422,6 +1127,8 @@ class MockEvent(object):
 @contextlib.contextmanager
 def downed_devices(devices):
     original_get_status = copy.copy(connections.get_status)
+    original_get_statuses = copy.copy(connections.get_statuses)
+    original_get_down_devices = copy.copy(connections.get_down_devices)
 
     def patched_get_status(dmd, node):
         for device in devices:
@@ -430,15 +1137,29 @@ def downed_devices(devices):
 
         return True
 
-    # Patch get_status to return False for devices.
+    def patched_get_statuses(dmd, nodes):
+        return {x: patched_get_status(dmd, x) for x in nodes}
+
+    def patched_get_down_devices(dmd):
+        return {
+            x.getPrimaryId()
+            for x in (dmd.Devices.findDeviceByIdExact(y) for y in devices)
+            if x}
+
+    # Patch get_status, get_statuses and get_down_devices to return False
+    # for devices.
     connections.get_status = patched_get_status
+    connections.get_statuses = patched_get_statuses
+    connections.get_down_devices = patched_get_down_devices
 
     # Execute context manager's body.
     try:
         yield
     finally:
-        # Unpatch get_status.
+        # Unpatch get_status, get_statuses and get_down_devices.
         connections.get_status = original_get_status
+        connections.get_statuses = original_get_statuses
+        connections.get_down_devices = original_get_down_devices
 
 
 # -- Performance Testing -----------------------------------------------------
@@ -8,6 +8,8 @@
 #
 ######################################################################
 
+from mock import Mock
+
 from Products.Five import zcml
 
 import Products.ZenTestCase
@@ -15,6 +17,9 @@ from Products.ZenTestCase.BaseTestCase import BaseTestCase
 
 import ZenPacks.zenoss.Layer2
 from ZenPacks.zenoss.Layer2 import connections
+from ZenPacks.zenoss.Layer2.benchmark import Benchmark
+from ZenPacks.zenoss.Layer2.metrics import CycleStats, MetricsPublisher
+from ZenPacks.zenoss.Layer2.pipeline import EdgeWriter
 from ZenPacks.zenoss.Layer2.zenmapper import ZenMapper
 
 from .create_fake_devices import create_topology, router
@@ -41,10 +46,32 @@ class TestUpdateCatalog(BaseTestCase):
         self.zenmapper.options.workers = 0
         self.zenmapper.options.worker = False
         self.zenmapper.options.force = False
+        self.zenmapper.options.benchmark = False
+        self.zenmapper.options.resume = None
+        self.zenmapper.options.cycletime = 300
         self.zenmapper.options.optimize_interval = 0
+        self.zenmapper.options.writers = 1
+        self.zenmapper.options.queue_size = 1
+        self.zenmapper.options.max_check_interval = 0
+        self.zenmapper.options.shard_by = None
+        self.zenmapper.options.queue_interval = 10
+        self.zenmapper.options.shared_cache = False
+        self.zenmapper.options.shared_cache_file = None
 
         import logging
         self.zenmapper.log = logging.getLogger("test")
+        self.zenmapper.writer = EdgeWriter(
+            self.zenmapper.log,
+            threads=self.zenmapper.options.writers,
+            queue_size=self.zenmapper.options.queue_size)
+        self.zenmapper.scheduler = None
+        self.zenmapper.sharder = None
+        self.zenmapper.benchmark = None
+        self.zenmapper.governor = None
+        self.zenmapper.unfinished_paths = []
+        self.zenmapper.stats = CycleStats()
+        self.zenmapper.metrics = MetricsPublisher()
+        self.zenmapper.extract_seconds = {}
 
         zcml.load_config('testing-noevent.zcml', Products.ZenTestCase)
         zcml.load_config('configure.zcml', ZenPacks.zenoss.Layer2)
@@ -72,6 +99,114 @@ class TestUpdateCatalog(BaseTestCase):
         a_neighbors = connections.get_layer2_neighbor_devices(a)
         self.assertIn(b, a_neighbors)
 
+    def test_benchmark(self):
+        self.topology('a b')
+        a = self.dmd.getObjByPath(router("a"))
+        b = self.dmd.getObjByPath(router("b"))
+
+        self.zenmapper.options.benchmark = True
+        self.zenmapper.benchmark = Benchmark()
+        self.zenmapper.writer = EdgeWriter(
+            self.zenmapper.log,
+            threads=self.zenmapper.options.writers,
+            apply_fn=self.zenmapper.diff_update)
+
+        self.zenmapper.update_nodes([a.getPrimaryId(), b.getPrimaryId()])
+
+        # Edges were extracted and diffed, but not written.
+        self.assertEqual(self.zenmapper.benchmark.devices, 2)
+        self.assertEqual(self.zenmapper.benchmark.changed, 2)
+        self.assertGreater(self.zenmapper.benchmark.added, 0)
+        a_neighbors = connections.get_layer2_neighbor_devices(a)
+        self.assertNotIn(b, a_neighbors)
+
+        report = self.zenmapper.benchmark.report(top=1)
+        self.assertIn("checked 2 devices", report[0])
+
+    def test_benchmark_unchanged(self):
+        self.topology('a b')
+        a = self.dmd.getObjByPath(router("a"))
+        b = self.dmd.getObjByPath(router("b"))
+        self.zenmapper.update_nodes([a.getPrimaryId(), b.getPrimaryId()])
+
+        self.zenmapper.options.benchmark = True
+        self.zenmapper.benchmark = Benchmark()
+        self.zenmapper.writer = EdgeWriter(
+            self.zenmapper.log,
+            threads=self.zenmapper.options.writers,
+            apply_fn=self.zenmapper.diff_update)
+
+        self.zenmapper.update_nodes([a.getPrimaryId(), b.getPrimaryId()])
+
+        # Unchanged devices are still extracted without --force.
+        self.assertEqual(self.zenmapper.benchmark.changed, 2)
+        self.assertEqual(self.zenmapper.benchmark.added, 0)
+
+    def test_stored_neighbors(self):
+        self.topology('a b')
+        a = self.dmd.getObjByPath(router("a"))
+        b = self.dmd.getObjByPath(router("b"))
+        paths = [a.getPrimaryId(), b.getPrimaryId()]
+        self.zenmapper.update_nodes(paths)
+
+        graph = connections.get_graph()
+        graph.clear_neighbors()
+
+        # Reading neighbors doesn't store them.
+        self.assertIn(b, connections.get_layer2_neighbor_devices(a))
+        self.assertIsNone(graph.get_stored_neighbors(paths[0]))
+
+        self.assertEqual(
+            connections.store_missing_layer2_neighbors(paths, limit=1), 1)
+        self.assertEqual(
+            connections.store_missing_layer2_neighbors(paths, limit=10), 1)
+        self.assertEqual(graph.get_stored_neighbors(paths[0]), [paths[1]])
+
+    def test_queue(self):
+        self.topology('a b')
+        a = self.dmd.getObjByPath(router("a"))
+        b = self.dmd.getObjByPath(router("b"))
+
+        connections.enqueue_node(a)
+        connections.enqueue_node(b, priority=1)
+        self.assertEqual(
+            [x[1] for x in connections.get_queued(10)],
+            [b.getPrimaryId(), a.getPrimaryId()])
+
+        self.assertEqual(self.zenmapper.drain_queue(), 2)
+        self.assertEqual(connections.get_queued(10), [])
+        a_neighbors = connections.get_layer2_neighbor_devices(a)
+        self.assertIn(b, a_neighbors)
+
+    def test_queue_update_on_model_only(self):
+        self.topology('a b')
+        a = self.dmd.getObjByPath(router("a"))
+        b = self.dmd.getObjByPath(router("b"))
+        for device in (a, b):
+            device.setZenProperty("zL2UpdateInBackground", False)
+
+        # Background updates skip the devices.
+        self.zenmapper.update_nodes([a.getPrimaryId(), b.getPrimaryId()])
+        self.assertNotIn(b, connections.get_layer2_neighbor_devices(a))
+
+        # Queued updates from modeling don't.
+        connections.enqueue_node(a)
+        connections.enqueue_node(b)
+        self.assertEqual(self.zenmapper.drain_queue(), 2)
+        self.assertIn(b, connections.get_layer2_neighbor_devices(a))
+
+    def test_queue_workers_running(self):
+        self.topology('a b')
+        connections.enqueue_node(self.dmd.getObjByPath(router("a")))
+
+        # Nodes stay queued until workers finish.
+        self.zenmapper._workers = {0: Mock(**{"is_alive.return_value": True})}
+        self.assertEqual(self.zenmapper.drain_queue(), 0)
+        self.assertEqual(len(connections.get_queued(10)), 1)
+
+        self.zenmapper._workers[0].is_alive.return_value = False
+        self.assertEqual(self.zenmapper.drain_queue(), 1)
+
 
 def test_suite():
     from unittest import TestSuite, makeSuite
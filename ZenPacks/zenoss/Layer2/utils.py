@@ -12,14 +12,15 @@
 '''
 
 import contextlib
-import re
 
 from Products.Zuul.catalog.global_catalog import GlobalCatalog
 
+from . import macs
+
 
 def asmac(val):
     """Convert a byte string to a MAC address string.  """
-    return ':'.join('%02X' % ord(c) for c in val)
+    return macs.from_bytes(val)
 
 
 def asip(val):
@@ -28,30 +29,16 @@ def asip(val):
 
 
 def is_valid_macaddr802(value):
-    if not isinstance(value, basestring):
-        return False
-
-    allowed = re.compile(r'^([0-9A-F]{2}[:]){5}([0-9A-F]{2})$', re.IGNORECASE)
-    if allowed.match(value):
-        return True
-
-    return False
+    return macs.is_canonical(value)
 
 
 def filterMacSet(existing, excluded):
     """Remove all excluded MACs from existing; returns set() of MAC addresses.
        * original and excluded are any iterables of MACs
        * 'excluded' are MAC addresses to be removed from existing
-       * 'existing' is assumed to be a valid MAC iterable
+       * invalid MACs in either are ignored, and the result is normalized
     """
-    existing_macs = set(x.upper() for x in existing)
-    excluded_macs = set()
-    for mac in excluded:
-        # Ensure each element of excluded is valid MAC
-        if is_valid_macaddr802(mac):
-            excluded_macs.add(mac.upper())
-
-    return existing_macs - excluded_macs
+    return set(macs.subtract(existing, excluded))
 
 
 # Once upon a time this was defined here, but now is moved
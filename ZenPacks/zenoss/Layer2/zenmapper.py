@@ -17,18 +17,31 @@ import math
 import multiprocessing
 import optparse
 import os
-import resource
+import socket
 import sys
+import tempfile
+import time
 
 import Globals
+from twisted.internet import reactor
+
 from Products.ZenModel.Device import Device
 from Products.ZenUtils.CmdBase import remove_args
 from Products.ZenUtils.CyclingDaemon import CyclingDaemon, DEFAULT_MONITOR
 from Products.ZenUtils.Utils import convToUnits
+from Products.ZenUtils.guid.interfaces import IGlobalIdentifier
 from Products.Zuul.interfaces import ICatalogTool
 
-from ZenPacks.zenoss.Layer2 import connections
+from ZenPacks.zenoss.Layer2 import connections, shared_cache
+from ZenPacks.zenoss.Layer2.benchmark import Benchmark
+from ZenPacks.zenoss.Layer2.memory import MemoryGovernor, OVER, get_rss
+from ZenPacks.zenoss.Layer2.metrics import CycleStats, MetricsPublisher
+from ZenPacks.zenoss.Layer2.pipeline import EdgeWriter, DEFAULT_QUEUE_SIZE
 from ZenPacks.zenoss.Layer2.progresslog import ProgressLogger
+from ZenPacks.zenoss.Layer2.scheduling import Scheduler
+from ZenPacks.zenoss.Layer2.sharding import (
+    Sharder, SHARD_BY, device_class_from_path,
+    )
 
 LOG = logging.getLogger('zen.zenmapper')
 
@@ -38,6 +51,33 @@ DEFAULT_CYCLETIME = 300
 # Hot often (in seconds) to optimize database tables. 0 means never.
 DEFAULT_OPTIMIZE_INTERVAL = 0
 
+# Number of threads writing extracted edges to the database per process.
+DEFAULT_WRITERS = 1
+
+# Resident memory (in MB) a worker may use before it's replaced by a fresh
+# process that continues with its remaining devices. 0 means unlimited.
+DEFAULT_MEMORY_BUDGET = 0
+
+# Number of slowest devices listed in the benchmark report.
+DEFAULT_BENCHMARK_TOP = 10
+
+# Longest time (in seconds) between checks of devices whose edges don't
+# change. 0 means every device is checked every cycle.
+DEFAULT_MAX_CHECK_INTERVAL = 0
+
+# How often (in seconds) to update nodes queued after being remodeled.
+DEFAULT_QUEUE_INTERVAL = 10
+
+# Most queued nodes to update at a time.
+QUEUE_BATCH = 100
+
+# Most devices to store missing layer2 neighbors for each cycle.
+NEIGHBORS_BATCH = 1000
+
+# Number of cycles without a heartbeat after which a sharded instance is
+# considered gone, and its devices are reassigned to the remaining instances.
+INSTANCE_TIMEOUT_CYCLES = 3
+
 # ZenMapper.updates_nodes() will log at INFO level instead of DEBUG if it
 # takes longer than LONG_TIME seconds to update a node's edges, or if memory
 # grows more than HIGH_MEMORY bytes while updating a node's edges.
@@ -45,11 +85,12 @@ LONG_TIME = 300
 HIGH_MEMORY = pow(1024, 3)
 
 
-def exec_worker(offset, chunk):
+def exec_worker(offset, filename):
     """
     Used to create a worker for zenmapper daemon. Removes the
     "cycle", "workers" and "daemon" sys args and replace the current process by
-    executing sys args
+    executing sys args. The worker checks paths written to filename by
+    write_paths.
     """
     argv = [sys.executable]
     # Remove unwanted parameters from worker processes
@@ -59,13 +100,47 @@ def exec_worker(offset, chunk):
     argv.append('--duallog')
     argv.append('--worker')
     argv.append('--offset=%i' % offset)
-    argv.append('--chunk=%i' % chunk)
+    argv.append('--paths=%s' % filename)
     try:
         os.execvp(argv[0], argv)
     except:
         LOG.exception("failed to start worker process")
 
 
+def exec_resume(paths):
+    """
+    Replace the current worker process with a new one that updates paths.
+    Used to release all memory held by a worker that exceeded its budget.
+    """
+    filename = write_paths(paths)
+
+    argv = [sys.executable]
+    argv.extend(remove_args(sys.argv[:], [], ['--resume', '--paths']))
+    argv.append('--resume=%s' % filename)
+    os.execvp(argv[0], argv)
+
+
+def write_paths(paths):
+    """Write paths to a new temporary file and return its name."""
+    fd, filename = tempfile.mkstemp(prefix="zenmapper-", suffix=".paths")
+    with os.fdopen(fd, "w") as paths_file:
+        paths_file.write("\n".join(paths))
+
+    return filename
+
+
+def read_paths(filename):
+    """Return list of paths written by write_paths and remove the file."""
+    try:
+        with open(filename) as paths_file:
+            return filter(None, paths_file.read().splitlines())
+    finally:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
 def main():
     zenmapper = ZenMapper()
     zenmapper.run()
@@ -84,6 +159,68 @@ class ZenMapper(CyclingDaemon):
                 "worker-{}".format(
                     self.options.offset))
 
+        if self.options.benchmark:
+            # Diff against stored state instead of writing to it.
+            self.benchmark = Benchmark()
+            apply_fn = self.diff_update
+        else:
+            self.benchmark = None
+            apply_fn = connections.apply_node_update
+
+        self.writer = EdgeWriter(
+            self.log,
+            threads=self.options.writers,
+            queue_size=self.options.queue_size,
+            apply_fn=apply_fn,
+            callback=self.record_write)
+
+        if self.options.max_check_interval > 0 and not self.options.benchmark:
+            self.scheduler = Scheduler(
+                cycletime=self.options.cycletime,
+                max_interval=self.options.max_check_interval)
+        else:
+            self.scheduler = None
+
+        # Seconds spent extracting edges for updates still being written.
+        self.extract_seconds = {}
+
+        if self.options.memory_budget > 0:
+            self.governor = MemoryGovernor(
+                budget=self.options.memory_budget * 1024 * 1024)
+
+            if not self.options.worker and (
+                    self.options.device or
+                    not self.options.cycle or
+                    self.options.workers < 1):
+                self.log.warning(
+                    "--memory-budget is only enforced by replacing workers. "
+                    "Without --workers and --cycle, ZODB caches are "
+                    "minimized near the budget, but it can be exceeded.")
+        else:
+            self.governor = None
+
+        # Workers check paths assigned by their parent's sharder.
+        if self.options.shard_by and not self.options.worker:
+            self.sharder = Sharder(
+                self.options.instance_id,
+                timeout=(
+                    self.options.instance_timeout or
+                    self.options.cycletime * INSTANCE_TIMEOUT_CYCLES))
+        else:
+            self.sharder = None
+
+        # Paths left unchecked when update_nodes stops early.
+        self.unfinished_paths = []
+
+        self.stats = CycleStats()
+        self.metrics = MetricsPublisher(
+            filename=self.get_metrics_filename(),
+            tags={
+                "daemon": self.name,
+                "internal": True,
+                "worker": self.options.offset if self.options.worker else "",
+                })
+
     def buildOptions(self):
         super(CyclingDaemon, self).buildOptions()
 
@@ -138,7 +275,45 @@ class ZenMapper(CyclingDaemon):
             "--force",
             dest="force",
             action="store_true",
-            help="Force update for unchanged devices.")
+            help="Force update for unchanged devices. Interfaces are\n"
+                 "loaded rather than read from their stored index.")
+
+        group.add_option(
+            "--memory-budget",
+            dest="memory_budget",
+            default=DEFAULT_MEMORY_BUDGET,
+            type="int",
+            help="Resident memory (in MB) for each worker. ZODB caches\n"
+                 "are minimized as a worker approaches it, and a worker\n"
+                 "that exceeds it is replaced by a new process that\n"
+                 "continues with its remaining devices. Without workers\n"
+                 "caches are minimized, but the budget can be exceeded.\n"
+                 "0 is unlimited.\n"
+                 "[default: %default]")
+
+        group.add_option(
+            "--metrics-file",
+            dest="metrics_file",
+            help="Write each cycle's metrics to this JSON file. Workers\n"
+                 "write to a file of the same name with -worker-N added.\n"
+                 "[optional]")
+
+        group.add_option(
+            "--benchmark",
+            "--dry-run",
+            dest="benchmark",
+            action="store_true",
+            help="Check all devices (or --device) once without writing\n"
+                 "to the database, report throughput, then exit.\n"
+                 "Implies --force.")
+
+        group.add_option(
+            "--benchmark-top",
+            dest="benchmark_top",
+            default=DEFAULT_BENCHMARK_TOP,
+            type="int",
+            help="Number of slowest devices to report with --benchmark.\n"
+                 "[default: %default]")
 
         group.add_option(
             "--workers",
@@ -148,6 +323,90 @@ class ZenMapper(CyclingDaemon):
             help="Number of workers.\n"
                  "[default: %default]")
 
+        group.add_option(
+            "--writers",
+            dest="writers",
+            default=DEFAULT_WRITERS,
+            type="int",
+            help="Number of database writer threads per worker. 0 writes\n"
+                 "each device's edges before extracting the next.\n"
+                 "[default: %default]")
+
+        group.add_option(
+            "--queue-size",
+            dest="queue_size",
+            default=DEFAULT_QUEUE_SIZE,
+            type="int",
+            help="Number of devices' edges that may wait for a writer.\n"
+                 "[default: %default]")
+
+        group.add_option(
+            "--queue-interval",
+            dest="queue_interval",
+            default=DEFAULT_QUEUE_INTERVAL,
+            type="int",
+            help="How often (in seconds) to update devices queued by\n"
+                 "zenhub after they're remodeled. 0 leaves them to the\n"
+                 "next cycle.\n"
+                 "[default: %default]")
+
+        group.add_option(
+            "--max-check-interval",
+            dest="max_check_interval",
+            default=DEFAULT_MAX_CHECK_INTERVAL,
+            type="int",
+            help="Longest time (in seconds) between checks of devices\n"
+                 "whose connections don't change. Devices whose\n"
+                 "connections change are checked every cycle. 0 checks\n"
+                 "every device every cycle.\n"
+                 "[default: %default]")
+
+        group.add_option(
+            "--shared-cache",
+            dest="shared_cache",
+            action="store_true",
+            help="Write layer2 connections and down devices to\n"
+                 "--shared-cache-file each cycle. zeneventd workers\n"
+                 "on this host share it for event suppression instead\n"
+                 "of each loading their own.")
+
+        group.add_option(
+            "--shared-cache-file",
+            dest="shared_cache_file",
+            help="File written by --shared-cache. zeneventd reads\n"
+                 "%s in global.conf, so set that\n"
+                 "instead to change both.\n"
+                 "[default: %s in global.conf, or %s]" % (
+                     shared_cache.FILENAME_PROPERTY,
+                     shared_cache.FILENAME_PROPERTY,
+                     shared_cache.DEFAULT_FILENAME))
+
+        group.add_option(
+            "--shard-by",
+            dest="shard_by",
+            type="choice",
+            choices=SHARD_BY,
+            help="Share devices with other zenmapper instances by\n"
+                 "collector, device class, or hash of device UUID. Each\n"
+                 "instance updates only the devices it owns.\n"
+                 "[optional]")
+
+        group.add_option(
+            "--instance-id",
+            dest="instance_id",
+            default=socket.gethostname(),
+            help="Unique name of this instance when sharding.\n"
+                 "[default: %default]")
+
+        group.add_option(
+            "--instance-timeout",
+            dest="instance_timeout",
+            default=0,
+            type="int",
+            help="Seconds without a heartbeat after which a sharded\n"
+                 "instance's devices are reassigned. 0 is %s cycles.\n"
+                 "[default: %%default]" % INSTANCE_TIMEOUT_CYCLES)
+
         # Internal-use-only options. These are passed to workers by the main
         # process, and not expected to be passed to the main process by the
         # user.
@@ -164,27 +423,36 @@ class ZenMapper(CyclingDaemon):
             help=optparse.SUPPRESS_HELP)
 
         group.add_option(
-            "--chunk",
-            dest="chunk",
-            type="int",
+            "--paths",
+            dest="paths",
+            help=optparse.SUPPRESS_HELP)
+
+        group.add_option(
+            "--resume",
+            dest="resume",
             help=optparse.SUPPRESS_HELP)
 
-    def start_worker(self, worker_id, chunk_size):
+    def start_worker(self, worker_id, paths):
         """
-        Creates new process of zenmapper with a task to process chunk of nodes
+        Creates new process of zenmapper with a task to process paths
         """
         if worker_id in self._workers and self._workers[worker_id].is_alive():
             self.log.info("worker-%i still running", worker_id)
         else:
-            self.log.info("starting worker-%i for %s nodes", worker_id, chunk_size)
+            self.log.info(
+                "starting worker-%i for %s nodes", worker_id, len(paths))
             p = multiprocessing.Process(
                 target=exec_worker,
-                args=(worker_id, chunk_size)
+                args=(worker_id, write_paths(paths))
                 )
             p.daemon = True
             p.start()
             self._workers[worker_id] = p
 
+    def workers_running(self):
+        """Return True if any worker started by start_worker is running."""
+        return any(x.is_alive() for x in self._workers.itervalues())
+
     def get_paths_and_uuids(self, uuids=False):
         """Return list of paths and list of uuids."""
         path_list, uuid_list = [], []
@@ -201,32 +469,142 @@ class ZenMapper(CyclingDaemon):
 
         return path_list, uuid_list
 
-    def update_nodes(self, paths):
-        """Update nodes given paths."""
-        updated = 0
+    def get_uuids_by_path(self):
+        """Return map of device path to uuid."""
+        uuids_by_path = {}
+
+        for brain in ICatalogTool(self.dmd.Devices).search(Device):
+            path = path_from_brain(brain)
+            uuid = uuid_from_brain(brain)
+            if path and uuid:
+                uuids_by_path[path] = uuid
+
+        return uuids_by_path
+
+    def get_shard_keys(self, paths):
+        """Return map of device path to shard key for sharder."""
+        if self.options.shard_by == "hash":
+            return self.get_uuids_by_path()
+
+        if self.options.shard_by == "class":
+            return {x: device_class_from_path(x) for x in paths}
+
+        if self.options.shard_by == "collector":
+            collectors = {}
+            for monitor in self.dmd.Monitors.Performance.objectValues():
+                for device_id in monitor.devices.objectIdsAll():
+                    collectors[device_id] = monitor.id
+
+            return {
+                x: collectors.get(x.rsplit("/", 1)[-1])
+                for x in paths}
+
+        return {}
+
+    def get_metrics_filename(self):
+        """Return name of file to write metrics to, or None."""
+        if not self.options.metrics_file:
+            return None
+
+        if not self.options.worker:
+            return self.options.metrics_file
+
+        root, ext = os.path.splitext(self.options.metrics_file)
+        return "{}-worker-{}{}".format(root, self.options.offset, ext)
+
+    def record_write(self, update, changes, seconds):
+        """Record outcome of writing update for metrics and the scheduler."""
+        self.stats.add(
+            devices_updated=1,
+            edges_added=changes[0],
+            edges_removed=changes[1],
+            sql_seconds=seconds)
+
+        extract_seconds = self.extract_seconds.pop(update.uuid, 0)
+        if self.scheduler:
+            self.scheduler.record(
+                update.uuid,
+                changed=any(changes),
+                cost=extract_seconds + seconds)
+
+    def diff_update(self, update):
+        """Diff update against the database without writing to it."""
+        start = time.time()
+        added, removed = connections.diff_node_update(update)
+        self.benchmark.add("sql", time.time() - start, update.id)
+        self.benchmark.add_diff(len(added), len(removed))
+
+        return len(added), len(removed)
+
+    def update_nodes(self, paths, background=True):
+        """Update nodes given paths.
+
+        Edges are extracted from each node in this thread, and written to
+        the graph by self.writer's threads so that the two overlap.
+
+        Nodes with zL2UpdateInBackground disabled are skipped unless
+        background is False. Nodes queued after being remodeled aren't
+        background updates.
+
+        """
         progress = ProgressLogger(self.log, total=len(paths), interval=60)
+        self.unfinished_paths = []
+        self.stats = CycleStats()
+        queued = 0
+
+        # Benchmarks time extraction, so they never skip unchanged nodes.
+        force = self.options.force or self.options.benchmark
 
-        for node in nodes_from_paths(self.dmd.Devices, paths):
+        if force:
+            last_changes = None
+        else:
+            # One query instead of one per node to find unchanged nodes.
+            start = time.time()
+            last_changes = connections.get_last_changes()
+            self.stats.add(sql_seconds=time.time() - start)
+            if self.benchmark:
+                self.benchmark.add("sql", time.time() - start)
+
+        nodes = nodes_from_paths(self.dmd.Devices, paths)
+        if self.benchmark:
+            nodes = self.benchmark.timed_nodes(nodes)
+
+        for node in nodes:
             progress.increment()
+            self.stats.add(devices_checked=1)
 
-            if not node.getZ("zL2UpdateInBackground", True):
+            if background and not node.getZ("zL2UpdateInBackground", True):
                 self.log.debug("%s: zL2UpdateInBackground = False", node.id)
+                self.stats.add(devices_skipped=1)
                 continue
 
             start_time = datetime.datetime.now()
-            start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start_rss = get_rss()
 
             try:
-                added = connections.update_node(node, force=self.options.force)
+                update = connections.get_node_update(
+                    node,
+                    force=force,
+                    last_changes=last_changes,
+                    use_index=not self.options.force)
             except Exception:
                 self.log.exception("%s: unexpected exception while updating", node.id)
+                self.stats.add(devices_failed=1)
                 continue
 
-            if added:
-                end_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
-                end_time = datetime.datetime.now()
-                duration = end_time - start_time
-                growth = (end_rss - start_rss) * 1024
+            end_rss = get_rss()
+            end_time = datetime.datetime.now()
+            duration = end_time - start_time
+
+            if self.benchmark:
+                self.benchmark.add(
+                    "get_connections", duration.total_seconds(), node.id)
+
+                if update:
+                    self.benchmark.add_update(len(update.edges.rows))
+
+            if update:
+                growth = end_rss - start_rss
 
                 long_time = duration.total_seconds() > LONG_TIME
                 high_memory = growth > HIGH_MEMORY
@@ -238,20 +616,114 @@ class ZenMapper(CyclingDaemon):
 
                 self.log.log(
                     log_level,
-                    "%s: updated (%s in %s)",
+                    "%s: extracted %s edges (%s in %s)",
                     node.id,
+                    len(update.edges.rows),
                     convToUnits(growth, 1024.0, "B"),
                     duration)
 
-                updated += 1
+                if self.scheduler:
+                    self.extract_seconds[update.uuid] = duration.total_seconds()
+
+                # Blocks while the writers are queue_size updates behind.
+                self.stats.observe_queue(self.writer.queue.qsize())
+                self.writer.put(update)
+                queued += 1
             else:
                 self.log.debug("%s: already up to date", node.id)
+                self.stats.add(devices_skipped=1)
+
+                if self.scheduler:
+                    self.scheduler.record(
+                        IGlobalIdentifier(node).getGUID(),
+                        changed=False,
+                        cost=duration.total_seconds())
+
+            if self.governor and self.governor.check(node._p_jar) is OVER:
+                # Only workers can be replaced to release memory. See the
+                # warning logged at startup by other processes.
+                if self.options.worker:
+                    self.unfinished_paths = remaining_paths(paths, node)
+                    self.log.warning(
+                        "%s: exceeded memory budget (%s) with %s nodes left",
+                        node.id,
+                        convToUnits(get_rss(), 1024.0, "B"),
+                        len(self.unfinished_paths))
+
+                    break
+
+        updated = self.writer.join()
+
+        # Writers only count successful writes.
+        self.stats.add(devices_failed=queued - updated)
+
+        if self.scheduler:
+            self.scheduler.save()
 
         return updated
 
+    def drain_queue(self):
+        """Update nodes queued after being remodeled.
+
+        Nothing is updated while workers are running. They could be
+        updating the same nodes, and recording their schedule.
+
+        Returns number of nodes updated.
+
+        """
+        if self.workers_running():
+            self.log.debug("leaving queued nodes until workers finish")
+            return 0
+
+        queued = connections.get_queued(QUEUE_BATCH)
+        if not queued:
+            return 0
+
+        if self.sharder:
+            # Leave other instances' nodes queued for them.
+            if self.options.shard_by == "hash":
+                keys = {path: uuid for uuid, path, _ in queued}
+            else:
+                keys = self.get_shard_keys([x[1] for x in queued])
+
+            queued = [
+                x for x in queued
+                if self.sharder.owns(keys.get(x[1], x[1]))]
+
+        if not queued:
+            return 0
+
+        if self.scheduler:
+            # Workers recorded checks since this process last loaded.
+            self.scheduler.load()
+
+        self.log.info("updating %s queued nodes", len(queued))
+        # Queued nodes are modeling-time updates. Update them even if
+        # their zL2UpdateInBackground is disabled.
+        updated = self.update_nodes([x[1] for x in queued], background=False)
+        connections.remove_queued(queued)
+
+        return updated
+
+    def drain_cycle(self):
+        """Update queued nodes every queue_interval seconds.
+
+        Checks while workers are running are skipped, so queued nodes
+        are updated by the first check after they finish.
+
+        """
+        try:
+            self.syncdb()
+            self.drain_queue()
+        except Exception:
+            self.log.exception("failed to update queued nodes")
+
+        reactor.callLater(self.options.queue_interval, self.drain_cycle)
+
     def run(self):
         """Execute startup-time-only tasks."""
-        connections.migrate()
+        if not self.options.benchmark:
+            connections.migrate()
 
         if self.options.clear:
             self.log.info("clearing database")
@@ -267,24 +739,76 @@ class ZenMapper(CyclingDaemon):
             device = self.dmd.Devices.findDeviceByIdExact(self.options.device)
             if device:
                 self.log.info("updating %s", device.id)
+                if self.scheduler:
+                    self.scheduler.load()
+
                 self.update_nodes([device.getPrimaryId()])
                 self.log.info("finished updating %s", device.id)
             else:
                 self.log.error("device %s not found", self.options.device)
 
-        # The clear/optimize/device options should prevent cycling.
+        elif self.options.benchmark:
+            node_paths = sorted(self.get_paths_and_uuids(uuids=False)[0])
+            self.log.info("benchmarking %s nodes", len(node_paths))
+            self.update_nodes(node_paths)
+
+        if self.options.benchmark:
+            for line in self.benchmark.report(top=self.options.benchmark_top):
+                self.log.info("benchmark: %s", line)
+
+        # The clear/optimize/device/benchmark options should prevent cycling.
         should_cycle = not any((
             self.options.clear,
             self.options.optimize,
-            self.options.device))
+            self.options.device,
+            self.options.benchmark))
 
         if should_cycle:
+            if self.options.cycle and self.options.queue_interval > 0:
+                reactor.callWhenRunning(self.drain_cycle)
+
             super(ZenMapper, self).run()
 
     def main_loop(self):
         """Execute once-per-cycletime tasks."""
+        if self.options.resume:
+            # Continue where a worker that exceeded its memory budget stopped.
+            if self.scheduler:
+                self.scheduler.load()
+
+            self.check_nodes(read_paths(self.options.resume))
+            return
+
+        if self.sharder:
+            self.sharder.refresh()
+
+        if not self.options.worker:
+            # Remodeled nodes before everything else.
+            self.drain_queue()
+
+        self.check_due_nodes()
+
+        if not self.options.worker:
+            # The reactor can't run drain_cycle while this process checks
+            # nodes itself, so nodes queued meanwhile are updated now.
+            # Nothing is drained if workers were started to check them.
+            self.drain_queue()
+
+    def check_due_nodes(self):
+        """Check nodes owned by this process that are due to be checked.
+
+        Workers check the nodes they're assigned by their parent, so
+        every node the parent owns is checked once even if instances
+        come and go while workers start.
+
+        """
         if self.options.worker:
+            node_paths = read_paths(self.options.paths)
+        elif self.sharder and not self.sharder.is_designated():
             node_paths = self.get_paths_and_uuids(uuids=False)[0]
+            self.log.debug(
+                "leaving database maintenance to %s",
+                self.sharder.instances[0])
         else:
             node_paths, node_uuids = self.get_paths_and_uuids(uuids=True)
 
@@ -296,9 +820,30 @@ class ZenMapper(CyclingDaemon):
                 connections.optimize()
                 self.log.info("finished optimizing database")
 
-        # Paths must be sorted for workers to get the right chunks.
+            stored = connections.store_missing_layer2_neighbors(
+                node_paths, limit=NEIGHBORS_BATCH)
+
+            if stored:
+                self.log.info("stored layer2 neighbors of %s nodes", stored)
+
+            if self.options.shared_cache:
+                self.write_shared_cache()
+
         node_paths.sort()
 
+        if self.sharder:
+            all_count = len(node_paths)
+            node_paths = self.sharder.filter(
+                node_paths,
+                self.get_shard_keys(node_paths))
+
+            self.log.info(
+                "%s owns %s of %s nodes (%s live instances)",
+                self.sharder.instance,
+                len(node_paths),
+                all_count,
+                len(self.sharder.instances))
+
         # Start workers if configured, but only if cycling.
         if self.options.workers > 0 and self.options.cycle:
             chunk_size = int(
@@ -310,25 +855,62 @@ class ZenMapper(CyclingDaemon):
                 chunk_size)
 
             for i in xrange(self.options.workers):
-                self.start_worker(i, chunk_size)
+                start = i * chunk_size
+                self.start_worker(i, node_paths[start:start + chunk_size])
 
             return
 
-        if self.options.worker:
-            start = self.options.offset * self.options.chunk
-            node_paths = node_paths[start:start + self.options.chunk]
+        if self.scheduler:
+            # Load even if forced so checks are recorded against history.
+            self.scheduler.load()
 
+        if self.scheduler and not self.options.force:
+            due_paths = self.scheduler.get_due(
+                node_paths,
+                self.get_uuids_by_path())
+
+            self.log.info(
+                "%s of %s nodes due to be checked",
+                len(due_paths),
+                len(node_paths))
+
+            node_paths = due_paths
+
+        self.check_nodes(node_paths)
+
+    def write_shared_cache(self):
+        """Write layer2 connections and down devices to the shared cache."""
+        filename = (
+            self.options.shared_cache_file or shared_cache.get_filename())
+
+        edges = connections.get_layer2_edges()
+        if edges is None:
+            self.log.warning("not writing %s: edges unavailable", filename)
+            return
+
+        # Readers get statuses from ZEP themselves if down is None.
+        down = connections.get_down_devices(self.dmd)
+
+        try:
+            shared_cache.write(filename, edges, down)
+        except Exception:
+            self.log.exception("failed to write %s", filename)
+        else:
+            self.log.info("wrote %s edges to %s", len(edges), filename)
+
+    def check_nodes(self, node_paths):
+        """Update nodes given paths, and log a summary."""
         self.log.info("checking %s nodes", len(node_paths))
 
         start_time = datetime.datetime.now()
-        start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start_rss = get_rss()
 
         updated = self.update_nodes(node_paths)
 
-        end_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        end_rss = get_rss()
         end_time = datetime.datetime.now()
         duration = end_time - start_time
-        growth = (end_rss - start_rss) * 1024
+        growth = end_rss - start_rss
 
         self.log.info(
             "updated %s of %s nodes (%s in %s)",
@@ -337,6 +919,21 @@ class ZenMapper(CyclingDaemon):
             convToUnits(growth, 1024.0, "B"),
             duration)
 
+        # Lag is how far this cycle's work overran the cycle time.
+        self.stats.add(
+            cycle_seconds=duration.total_seconds(),
+            worker_lag=max(
+                0, duration.total_seconds() - self.options.cycletime))
+
+        self.metrics.publish(self.stats)
+
+        if self.unfinished_paths:
+            self.log.info(
+                "restarting worker for %s remaining nodes",
+                len(self.unfinished_paths))
+
+            exec_resume(self.unfinished_paths)
+
 
 def path_from_brain(brain):
     try:
@@ -356,6 +953,14 @@ def uuid_from_brain(brain):
         return
 
 
+def remaining_paths(paths, node):
+    """Return paths after node's path."""
+    try:
+        return paths[paths.index(node.getPrimaryId()) + 1:]
+    except ValueError:
+        return []
+
+
 def nodes_from_paths(root, paths):
     for path in paths:
         try:
@@ -39,3 +39,13 @@ class Layer2PostEventPlugin(object):
     def apply(evtproxy, dmd):
         """Process event (evtproxy) using dmd as context."""
         suppression.get_suppressor(dmd).process_event(evtproxy)
+
+    @staticmethod
+    def apply_batch(evtproxies, dmd):
+        """Process events (evtproxies) together using dmd as context.
+
+        Callers that drain events in batches should prefer this to
+        calling apply for each event. See Suppressor.process_events.
+
+        """
+        suppression.get_suppressor(dmd).process_events(evtproxies)